@@ -0,0 +1,97 @@
+# concurrent fan-out of control messages to many peers
+from concurrent.futures import ThreadPoolExecutor, wait
+import math
+
+
+class Broadcaster:
+    """
+    The Broadcaster class delivers one call to many peers concurrently and collects their acknowledgements.
+    Every target gets its own timeout, so a slow or dead peer never delays the others.
+    With a fanout, the targets are split into fanout subtrees whose first peer relays the call to the rest,
+    so the sender only makes fanout calls however large the network is.
+    It has the following methods:
+    1. broadcast - Deliver a call to a set of peers
+    2. call - Deliver a call to one peer
+    """
+
+    def __init__(self, transport, max_workers=32, timeout=5.0, fanout=None):
+        """
+        Construct a new 'Broadcaster' object.
+
+        :param transport: The transport used to reach the peers
+        :param max_workers: The number of calls in flight at once
+        :param timeout: The time in seconds to wait for every target
+        :param fanout: The number of subtrees the targets are split into, None to call every target directly
+        :return: returns nothing
+        """
+        self.transport = transport
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.timeout = timeout
+        self.fanout = fanout
+
+    def call(self, uri, method, args, timeout):
+        """
+        Deliver a call to one peer
+        :param uri: The uri of the peer
+        :param method: The name of the exposed method
+        :param args: The positional arguments of the call
+        :param timeout: The time in seconds to wait for the peer
+        :return: the result of the call
+        """
+        with self.transport.proxy(uri) as peer:
+            peer._pyroTimeout = timeout
+            return getattr(peer, method)(*args)
+
+    def broadcast(self, targets, method, args=(), timeout=None, fanout=None):
+        """
+        Deliver a call to a set of peers
+        :param targets: dictionary of peer id to uri
+        :param method: The name of the exposed method
+        :param args: The positional arguments of the call
+        :param timeout: The time in seconds to wait for every target, the broadcaster's timeout by default
+        :param fanout: The number of subtrees relaying the call, the broadcaster's fanout by default
+        :return: the result of every peer that answered, and the error of every peer that did not
+        """
+        timeout = self.timeout if timeout is None else timeout
+        fanout = self.fanout if fanout is None else fanout
+        peer_ids = list(targets)
+
+        # peer id of every call to the peers it covers
+        if fanout and 1 < fanout < len(peer_ids):
+            groups = {group[0]: group for group in (peer_ids[i::fanout] for i in range(fanout))}
+            # a relay waits for its own subtree, so its sender waits one timeout per level below
+            levels = math.ceil(math.log(len(peer_ids), fanout))
+            calls = {head: ("relay_broadcast", ({peer_id: targets[peer_id] for peer_id in group[1:]}, method, list(args), timeout, fanout)) for head, group in groups.items()}
+            deadline = timeout * (levels + 1)
+        else:
+            groups = {peer_id: [peer_id] for peer_id in peer_ids}
+            calls = {peer_id: (method, args) for peer_id in peer_ids}
+            deadline = timeout
+
+        futures = {self.executor.submit(self.call, targets[peer_id], name, call_args, deadline): peer_id for peer_id, (name, call_args) in calls.items()}
+        done, not_done = wait(futures, timeout=deadline)
+
+        acks, failures = {}, {}
+        for future in done:
+            peer_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures[peer_id] = str(e)
+                # a relay that cannot be reached must not cut off its subtree, pass it on to the rest of the group
+                if len(groups[peer_id]) > 1:
+                    rest = {member: targets[member] for member in groups[peer_id][1:]}
+                    sub_acks, sub_failures = self.broadcast(rest, method, args, timeout, fanout)
+                    acks.update(sub_acks)
+                    failures.update(sub_failures)
+                continue
+            if calls[peer_id][0] == "relay_broadcast":
+                sub_acks, sub_failures = result
+                acks.update(sub_acks)
+                failures.update(sub_failures)
+            else:
+                acks[peer_id] = result
+        for future in not_done:
+            for member in groups[futures[future]]:
+                failures[member] = "timed out"
+        return acks, failures
@@ -0,0 +1,196 @@
+# bounded cache of the sellers known to a trader
+from collections import Counter, OrderedDict
+from threading import BoundedSemaphore
+
+POLICIES = ["lru", "lfu"]
+
+
+class SellerCache:
+    """
+    The SellerCache class keeps the sellers of the products a trader sells in constant memory.
+    Sellers are cached per product, and a product is either resident with all of its sellers or not cached at all.
+    Once the cache holds more sellers than its capacity, whole products are evicted,
+    the least recently used first with the "lru" policy, the least often used first with the "lfu" policy.
+    It can be used as the dictionary of seller id to seller information it replaces.
+    It has the following methods:
+    1. lookup - Get the sellers of a product, counting a hit or a miss
+    2. put_product - Cache all the sellers of a product
+    3. discard - Drop a seller
+    4. clear - Drop every product
+    5. stats - Get the cache counters
+    """
+
+    def __init__(self, capacity, policy="lru"):
+        """
+        Construct a new 'SellerCache' object.
+
+        :param capacity: The number of sellers to keep, a product with more sellers is kept alone
+        :param policy: The eviction policy, "lru" or "lfu"
+        :return: returns nothing
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown eviction policy " + str(policy) + ", the policies are " + ", ".join(POLICIES))
+        self.capacity = capacity
+        self.policy = policy
+        # product to its sellers, least recently used first
+        self.products = OrderedDict()
+        # product of every cached seller
+        self.owners = {}
+        # lookups of every resident product, for the "lfu" policy
+        self.uses = Counter()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sem = BoundedSemaphore(1)
+
+    def lookup(self, product):
+        """
+        Get the sellers of a product, counting a hit or a miss
+        :param product: name of the product
+        :return: dictionary of seller id to seller information, None if the product is not resident
+        """
+        self.sem.acquire()
+        try:
+            sellers = self.products.get(product)
+            if sellers is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.products.move_to_end(product)
+            self.uses[product] += 1
+            return dict(sellers)
+        finally:
+            self.sem.release()
+
+    def put_product(self, product, sellers):
+        """
+        Cache all the sellers of a product, evicting other products once the cache is over its capacity
+        :param product: name of the product
+        :param sellers: dictionary of seller id to seller information
+        :return: list of the ids of the evicted sellers
+        """
+        self.sem.acquire()
+        try:
+            evicted = []
+            # a product read again keeps its uses, a product filled on a miss is used once
+            uses = self.uses[product] if product in self.products else 1
+            if product in self.products:
+                evicted += self.remove_product(product)
+            for seller_id in sellers:
+                if seller_id in self.owners:
+                    # the seller moved to this product
+                    self.products[self.owners[seller_id]].pop(seller_id)
+                    self.size -= 1
+            self.products[product] = dict(sellers)
+            self.uses[product] = uses
+            for seller_id in sellers:
+                self.owners[seller_id] = product
+            self.size += len(sellers)
+
+            while self.size > self.capacity and len(self.products) > 1:
+                if self.policy == "lfu":
+                    victim = min((name for name in self.products if name != product), key=lambda name: self.uses[name])
+                else:
+                    victim = next(iter(self.products))
+                evicted += self.remove_product(victim)
+                self.evictions += 1
+            return [seller_id for seller_id in evicted if seller_id not in self.owners]
+        finally:
+            self.sem.release()
+
+    def remove_product(self, product):
+        """
+        Drop a product and its sellers, must be called with sem held
+        :param product: name of the product
+        :return: list of the ids of the dropped sellers
+        """
+        sellers = self.products.pop(product)
+        self.uses.pop(product, None)
+        for seller_id in sellers:
+            self.owners.pop(seller_id, None)
+        self.size -= len(sellers)
+        return list(sellers)
+
+    def discard(self, seller_id):
+        """
+        Drop a seller, its product stays resident
+        :param seller_id: id of the seller
+        :return: nothing
+        """
+        self.sem.acquire()
+        try:
+            product = self.owners.pop(seller_id, None)
+            if product is not None:
+                self.products[product].pop(seller_id)
+                self.size -= 1
+        finally:
+            self.sem.release()
+
+    def clear(self):
+        """
+        Drop every product, they are filled again on demand
+        :return: nothing
+        """
+        self.sem.acquire()
+        try:
+            self.products.clear()
+            self.owners.clear()
+            self.uses.clear()
+            self.size = 0
+        finally:
+            self.sem.release()
+
+    def stats(self):
+        """
+        Get the cache counters
+        :return: dictionary of capacity, policy, cached sellers and products, hits, misses and evictions
+        """
+        return {"capacity": self.capacity, "policy": self.policy, "sellers": self.size, "products": len(self.products), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __contains__(self, seller_id):
+        return seller_id in self.owners
+
+    def __getitem__(self, seller_id):
+        return self.products[self.owners[seller_id]][seller_id]
+
+    def __setitem__(self, seller_id, seller_info):
+        # only the sellers of resident products are cached, the others are read from the warehouse on demand
+        self.sem.acquire()
+        try:
+            product = seller_info["product_name"]
+            previous = self.owners.get(seller_id)
+            if previous is not None and previous != product:
+                self.products[previous].pop(seller_id)
+                self.owners.pop(seller_id)
+                self.size -= 1
+            if product not in self.products:
+                return
+            if seller_id not in self.products[product]:
+                self.size += 1
+            self.products[product][seller_id] = seller_info
+            self.owners[seller_id] = product
+        finally:
+            self.sem.release()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, seller_id, default=None):
+        return self[seller_id] if seller_id in self else default
+
+    def keys(self):
+        return list(self.owners)
+
+    def values(self):
+        return [seller_info for _, seller_info in self.items()]
+
+    def items(self):
+        self.sem.acquire()
+        try:
+            return [(seller_id, self.products[product][seller_id]) for seller_id, product in self.owners.items()]
+        finally:
+            self.sem.release()
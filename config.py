@@ -0,0 +1,192 @@
+# settings of a peer, grouped by the feature they belong to
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+
+@dataclass
+class MarketConfig:
+    """
+    The MarketConfig class holds the settings every peer of the bazaar shares.
+
+    :param product_count: The maximum number of products the peer can sell (if role is seller)
+    :param product_time: The time after which sellers re-register their products
+    :param n_traders: The number of traders in the network
+    :param with_cache: Boolean to indicate whether traders should use cache or not
+    """
+    product_count: int = 5
+    product_time: float = 3
+    n_traders: int = 2
+    with_cache: bool = True
+
+
+@dataclass
+class HeartbeatConfig:
+    """
+    The HeartbeatConfig class holds the settings of the heartbeat between the traders.
+
+    :param fault_tolerance_heartbeat: Boolean to indicate whether traders should use fault tolerance or not
+    :param heartbeat_timeout: The timeout for the heartbeat
+    """
+    fault_tolerance_heartbeat: bool = False
+    heartbeat_timeout: float = 0
+
+
+@dataclass
+class LaunchConfig:
+    """
+    The LaunchConfig class holds what a launcher shares with the peers it starts.
+
+    :param startup_barrier: The barrier all peers wait on after registering and after connecting neighbors
+    :param topology_ready: The event set by peer 0 once the traders are elected
+    :param first_trade: The event set by the first buyer that completes a purchase
+    :param trace: Boolean to indicate whether the peer records the buy, registration and warehouse calls it receives to trace_<id>.jsonl
+    """
+    startup_barrier: Any = None
+    topology_ready: Any = None
+    first_trade: Any = None
+    trace: bool = False
+
+
+@dataclass
+class BuyerConfig:
+    """
+    The BuyerConfig class holds the settings of the orders of a buyer.
+
+    :param max_retries: The number of times a buyer retries a rejected request with another trader
+    :param retry_backoff: The base delay in seconds of the buyer's exponential backoff
+    :param basket_size: The number of products a buyer orders per request, baskets are fulfilled all or nothing
+    :param hedge_requests: Boolean to indicate whether a buyer also sends an order to a second trader when the first is slower than its usual 95th percentile
+    :param hedge_delay: The time in seconds a buyer waits before hedging until it has measured enough requests
+    :param pipeline_window: The number of orders a buyer keeps outstanding at once, 1 to wait for every order before the next
+    :param order_timeout: The time in seconds a buyer waits for the answer to a pipelined order
+    """
+    max_retries: int = 3
+    retry_backoff: float = 0.1
+    basket_size: int = 1
+    hedge_requests: bool = False
+    hedge_delay: float = 1.0
+    pipeline_window: int = 1
+    order_timeout: float = 30
+
+
+@dataclass
+class TraderConfig:
+    """
+    The TraderConfig class holds the settings of how a trader matches orders.
+
+    :param max_pending_requests: The number of buy requests a trader queues before rejecting new ones as busy
+    :param split_policy: How a trader splits an order no single seller can fill, "fewest" sellers first, "oldest" stock first or None to reject it
+    :param negative_cache_ttl: The time in seconds a trader remembers that a product has no seller
+    :param order_log_size: The number of order ids traders and the warehouse remember to drop duplicate orders
+    :param seller_cache_size: The number of sellers a trader caches, filled per product from the warehouse on demand, None to cache every seller
+    :param seller_cache_policy: The products evicted first from a full seller cache, "lru" for the least recently used or "lfu" for the least often used
+    :param reload_window: The time in seconds a trader reuses a finished reload of its cache for the next misses instead of reloading again, 0 to only share the reloads in flight
+    """
+    max_pending_requests: int = 8
+    split_policy: Optional[str] = "fewest"
+    negative_cache_ttl: float = 5
+    order_log_size: int = 4096
+    seller_cache_size: Optional[int] = None
+    seller_cache_policy: str = "lru"
+    reload_window: float = 0
+
+
+@dataclass
+class LeaseConfig:
+    """
+    The LeaseConfig class holds the settings of the units traders lease from the warehouse.
+
+    :param reservation_ttl: The lease time in seconds of units reserved by traders, None to disable reservations
+    :param reservation_block: The number of units a trader tries to reserve from a seller at once
+    """
+    reservation_ttl: Optional[float] = None
+    reservation_block: int = 10
+
+
+@dataclass
+class WriteBehindConfig:
+    """
+    The WriteBehindConfig class holds the settings of the sales traders write behind to the warehouse.
+
+    :param write_behind_interval: The time in seconds between two flushes of the sales a trader keeps in its transaction log, None to update the warehouse on every sale
+    :param write_behind_trades: The number of sales after which a trader flushes them without waiting for the interval
+    """
+    write_behind_interval: Optional[float] = None
+    write_behind_trades: int = 20
+
+
+@dataclass
+class GossipConfig:
+    """
+    The GossipConfig class holds the settings of the seller updates traders gossip to each other.
+
+    :param gossip_interval: The time in seconds between two anti-entropy rounds of a trader with the other traders, None to not gossip
+    :param gossip_log_size: The number of seller updates a trader keeps for other traders repairing missed gossip
+    """
+    gossip_interval: Optional[float] = None
+    gossip_log_size: int = 1024
+
+
+@dataclass
+class WarehouseConfig:
+    """
+    The WarehouseConfig class holds the settings of the warehouse and its storage.
+
+    :param buyer_history_size: The number of recent buyers remembered per seller
+    :param buyer_history_spill: Boolean to indicate whether the warehouse archives older buyers to buyer_history_<seller_id>.txt
+    :param inventory_format: The warehouse storage, "json" for seller_information.json or "mmap" for the memory-mapped seller_information.mmap
+    :param inventory_capacity: The number of seller records seller_information.mmap is created with, it doubles whenever it is full
+    :param change_log_size: The number of seller changes the warehouse remembers for traders catching up incrementally
+    :param top_sellers: The number of sellers with the most stock kept in the warehouse's view of every product
+    """
+    buyer_history_size: int = 100
+    buyer_history_spill: bool = False
+    inventory_format: str = "json"
+    inventory_capacity: int = 1024
+    change_log_size: int = 1024
+    top_sellers: int = 3
+
+
+@dataclass
+class DaemonConfig:
+    """
+    The DaemonConfig class holds the settings of the Pyro daemon and the threads of a peer.
+
+    :param server_type: The Pyro daemon server type, "thread" or "multiplex", None for the Pyro default
+    :param rpc_workers: The number of Pyro worker threads serving calls with the thread server, None for the Pyro default
+    :param background_workers: The number of threads running the peer's long-lived loops, such as heartbeats and timers
+    """
+    server_type: Optional[str] = None
+    rpc_workers: Optional[int] = None
+    background_workers: int = 10
+
+
+@dataclass
+class BroadcastConfig:
+    """
+    The BroadcastConfig class holds the settings of the control messages sent to every peer.
+
+    :param broadcast_timeout: The time in seconds a broadcast waits for every peer
+    :param broadcast_fanout: The number of peers a broadcast is sent to directly, the rest receive it through them, None to send to every peer directly
+    """
+    broadcast_timeout: float = 5
+    broadcast_fanout: Optional[int] = None
+
+
+@dataclass
+class PeerConfig:
+    """
+    The PeerConfig class holds the settings of a peer, one section per feature.
+    Every section left out takes its defaults, and dataclasses.replace derives the settings of another role from it.
+    """
+    market: MarketConfig = field(default_factory=MarketConfig)
+    heartbeat: HeartbeatConfig = field(default_factory=HeartbeatConfig)
+    launch: LaunchConfig = field(default_factory=LaunchConfig)
+    buyer: BuyerConfig = field(default_factory=BuyerConfig)
+    trader: TraderConfig = field(default_factory=TraderConfig)
+    leases: LeaseConfig = field(default_factory=LeaseConfig)
+    write_behind: WriteBehindConfig = field(default_factory=WriteBehindConfig)
+    gossip: GossipConfig = field(default_factory=GossipConfig)
+    warehouse: WarehouseConfig = field(default_factory=WarehouseConfig)
+    daemon: DaemonConfig = field(default_factory=DaemonConfig)
+    broadcast: BroadcastConfig = field(default_factory=BroadcastConfig)
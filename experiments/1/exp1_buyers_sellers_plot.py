@@ -1,18 +1,18 @@
-from datetime import datetime
+import os
+import sys
 import matplotlib.pyplot as plt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from log_analyzer import LogStats
 
 cache_average = []
 cacheless_average = []
 traders = [1, 2, 3]
 
 def calculate_average(filename, c):
-    with open(c + '/buyer_seller/' + filename, 'r') as f:
-        data = f.readlines()
-    
-    start = datetime.strptime(data[0].split()[1], "%H:%M:%S.%f")
-    end = datetime.strptime(data[-1].split()[1], "%H:%M:%S.%f")
-    duration = end - start
-    return (len(data) * 5 )/ duration.total_seconds()
+    # every purchase is of 5 goods
+    stats = LogStats()
+    stats.add_log(c + '/buyer_seller/' + filename)
+    return stats.mean_throughput() * 5
     
 filenames_cache = ['1buyer_2sellers.txt', '1buyer_4sellers.txt', '1buyers_3sellers.txt', '2buyers_3sellers.txt', '4buyers_2sellers.txt']
 filenames_cacheless = ['2buyers_1seller.txt', '2buyers_2sellers.txt', '2buyers_3sellers.txt', '3buyers_3sellers.txt', '4buyers_1seller.txt']
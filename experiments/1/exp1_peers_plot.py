@@ -1,18 +1,18 @@
-from datetime import datetime
+import os
+import sys
 import matplotlib.pyplot as plt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from log_analyzer import LogStats
 
 cache_average = []
 cacheless_average = []
 peers = [6, 7, 8]
 
 def calculate_average(filename, c):
-    with open(c + '/peers/' + filename, 'r') as f:
-        data = f.readlines()
-    
-    start = datetime.strptime(data[0].split()[1], "%H:%M:%S.%f")
-    end = datetime.strptime(data[-1].split()[1], "%H:%M:%S.%f")
-    duration = end - start
-    return (len(data) * 5 )/ duration.total_seconds()
+    # every purchase is of 5 goods
+    stats = LogStats()
+    stats.add_log(c + '/peers/' + filename)
+    return stats.mean_throughput() * 5
     
 filenames = ['6peers.txt', '7peers.txt', '8peers.txt']
 for filename in filenames:
@@ -1,18 +1,18 @@
-from datetime import datetime
+import os
+import sys
 import matplotlib.pyplot as plt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from log_analyzer import LogStats
 
 cache_average = []
 cacheless_average = []
 traders = [1, 2, 3]
 
 def calculate_average(filename, c):
-    with open(c + '/traders/' + filename, 'r') as f:
-        data = f.readlines()
-    
-    start = datetime.strptime(data[0].split()[1], "%H:%M:%S.%f")
-    end = datetime.strptime(data[-1].split()[1], "%H:%M:%S.%f")
-    duration = end - start
-    return (len(data) * 5 )/ duration.total_seconds()
+    # every purchase is of 5 goods
+    stats = LogStats()
+    stats.add_log(c + '/traders/' + filename)
+    return stats.mean_throughput() * 5
     
 filenames = ['1trader.txt', '2traders.txt', '3traders.txt']
 for filename in filenames:
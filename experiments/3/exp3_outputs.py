@@ -1,32 +1,11 @@
-from datetime import datetime
-
-retired = False
-sold_before_retire = 0
-sold_after_retire = 0
-start = ''
-end = ''
-before_retire_throughput = 0
-after_retire_throughput = 0
-with open("exp3_outputs.txt") as f:
-    for line in f:
-        if line.split()[2] == 'retired':
-            retired = True
-            before_retire_throughput = sold_before_retire / (datetime.strptime(end, "%H:%M:%S.%f") - datetime.strptime(start, "%H:%M:%S.%f")).total_seconds()
-            start = ''
-            continue
-
-        if not retired:
-            sold_before_retire += 1
-            if start == '':
-                start = line.split()[1]
-            end = line.split()[1]
-
-        if retired:
-            sold_after_retire += 1
-            if start == '':
-                start = line.split()[1]
-            end = line.split()[1]
-
-after_retire_throughput = sold_after_retire / (datetime.strptime(end, "%H:%M:%S.%f") - datetime.strptime(start, "%H:%M:%S.%f")).total_seconds()
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from log_analyzer import LogStats, find_failover
+
+# the retired line marks the failure of a trader
+stats = LogStats(failover=find_failover(["exp3_outputs.txt"]))
+stats.add_log("exp3_outputs.txt")
+before_retire_throughput, after_retire_throughput = stats.failover_throughput()
 print("Before retire throughput: ", before_retire_throughput)
 print("After retire throughput: ", after_retire_throughput)
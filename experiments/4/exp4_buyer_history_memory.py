@@ -0,0 +1,55 @@
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from history import BuyerHistory
+
+n_trades = 1000000
+n_sellers = 50
+n_buyers = 50
+history_size = 100
+sellers = ['seller' + str(i) for i in range(n_sellers)]
+buyers = ['buyer' + str(i) for i in range(n_buyers)]
+
+def inventory():
+    return {seller: {"seller": {"bully_id": i, "id": seller}, "product_name": "fish", "product_count": 5} for i, seller in enumerate(sellers)}
+
+def unbounded_lists(trades):
+    # buyer lists kept inside the inventory, as the warehouse did before
+    data = inventory()
+    for seller in data:
+        data[seller]["buyer_list"] = []
+    for seller, buyer in trades:
+        data[seller]["buyer_list"].append(buyer)
+    return data, None
+
+def bounded_history(trades):
+    # inventory without buyers and a bounded history per seller
+    data = inventory()
+    history = {seller: BuyerHistory(history_size) for seller in sellers}
+    for seller, buyer in trades:
+        history[seller].add(buyer)
+    return data, history
+
+def measure(name, method, trades):
+    tracemalloc.start()
+    start = time.time()
+    data, history = method(trades)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # every warehouse write and every load_state serializes the inventory once
+    start = time.time()
+    size = len(json.dumps(data))
+    serialize = time.time() - start
+    print(name, ": ", round(peak / 2**20, 2), "MiB peak, ", round(current / 2**20, 2), "MiB retained, ", round(elapsed, 2), "s for", n_trades, "trades, inventory of", size, "bytes serialized in", round(serialize * 1000, 3), "ms")
+
+random.seed(0)
+trades = [(random.choice(sellers), random.choice(buyers)) for _ in range(n_trades)]
+measure("Unbounded buyer lists", unbounded_lists, trades)
+measure("Bounded buyer history", bounded_history, trades)
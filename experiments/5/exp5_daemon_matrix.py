@@ -0,0 +1,151 @@
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Barrier, Event, Process
+import numpy as np
+import Pyro5.api
+import Pyro5.errors
+import Pyro5.nameserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from config import DaemonConfig, PeerConfig, TraderConfig
+from peer import Peer
+
+ns_name = "localhost"
+products = ["fish", "salt", "boar"]
+duration = 5
+n_clients = 32
+# every setting is measured this many times and ranked by its median, single runs differ by more than the settings
+rounds = 3
+# daemon settings tried for the peer under test, the other peers keep the Pyro defaults
+settings = [("thread", 4), ("thread", 16), ("thread", 64), ("multiplex", None)]
+# the buyers the trader answers, one per client, served by one process with a worker for each of them
+buyers = ["buyer" + str(i) for i in range(10, 10 + n_clients)]
+
+def serve(ids, bully_id, role, config, ready, registered, stop):
+    # every group of peers runs in its own process, so its daemon settings do not leak into the others
+    sys.stdout = open(os.devnull, "w")
+    # the peers of a group take consecutive indexes from bully_id, peer tables are keyed by index
+    peers = [Peer(id, bully_id + i, role, products, ns_name, config) for i, id in enumerate(ids)]
+    with peers[0].make_daemon() as daemon:
+        for peer in peers:
+            peer.product_name = "fish"
+            peer.ns = peer.get_nameserver(ns_name)
+            peer.register_name(daemon.register(peer))
+        threading.Thread(target=daemon.requestLoop, daemon=True).start()
+        registered.wait()
+        for peer in peers:
+            peer.get_neighbors(announce=False)
+        ready.set()
+        stop.wait()
+        # end the restock and heartbeat loops so the process can exit
+        for peer in peers:
+            peer.role = "retire"
+
+def start_peers(roles, configs):
+    stop = Event()
+    # peers look their neighbors up once all of them are registered
+    registered = Barrier(len(roles))
+    processes = []
+    readies = []
+    for ids, bully_id, role in roles:
+        ready = Event()
+        process = Process(target=serve, args=(ids, bully_id, role, configs.get(ids[0]), ready, registered, stop))
+        process.start()
+        processes.append(process)
+        readies.append(ready)
+    for ready in readies:
+        ready.wait()
+    return Pyro5.api.locate_ns(host=ns_name), stop, processes
+
+def stop_peers(ns, stop, processes):
+    stop.set()
+    for process in processes:
+        process.join()
+    for name in list(ns.list()):
+        if name != "Pyro.NameServer":
+            ns.remove(name)
+
+def load(uri, call):
+    # per-call proxies, as peers open them, every client calls with its own index
+    latencies = []
+    results = {"accepted": 0, "rejected": 0, "errors": 0}
+    deadline = time.time() + duration
+
+    def client(index):
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                with Pyro5.api.Proxy(uri) as peer:
+                    accepted = call(peer, index)
+                latencies.append(time.time() - start)
+                results["accepted" if accepted is not False else "rejected"] += 1
+            except Pyro5.errors.PyroError:
+                results["errors"] += 1
+                time.sleep(0.01)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    p50, p95 = np.percentile(latencies, [50, 95]) if latencies else (0, 0)
+    return results["accepted"] / duration, results["rejected"] / duration, results["errors"], p50 * 1000, p95 * 1000
+
+def bench_trader(server_type, rpc_workers):
+    # seller2 is elected trader, so the trader settings apply to it. Its admission limit is scaled to its workers,
+    # so the thread server queues as many requests as it serves at once and the matrix measures the daemon model,
+    # not busy rejections. The multiplex server serves one request at a time and never reaches the limit.
+    max_pending_requests = rpc_workers if rpc_workers is not None else TraderConfig.max_pending_requests
+    configs = {
+        "seller2": PeerConfig(trader=TraderConfig(max_pending_requests=max_pending_requests), daemon=DaemonConfig(server_type, rpc_workers)),
+        buyers[0]: PeerConfig(daemon=DaemonConfig("thread", 2 * n_clients)),
+    }
+    ns, stop, processes = start_peers([(["server9"], -1, "server"), (["seller0"], 0, "seller"), (buyers, 10, "buyer"), (["seller2"], 2, "trader")], configs)
+    for id in ["server9", "seller0", "seller2"] + buyers:
+        with Pyro5.api.Proxy(ns.lookup(id)) as peer:
+            peer.setTrader(["seller2"])
+    with Pyro5.api.Proxy(ns.lookup("server9")) as server:
+        server.register_products_with_warehouse({"seller": {"bully_id": 0, "id": "seller0"}, "product_name": "fish", "product_count": 10**9})
+    buyer_infos = [{"bully_id": 10 + i, "id": id, "clock": 0} for i, id in enumerate(buyers)]
+    result = load(ns.lookup("seller2"), lambda trader, index: trader.trading_lookup(buyer_infos[index], "fish", 1))
+    stop_peers(ns, stop, processes)
+    return result
+
+def bench_server(server_type, rpc_workers):
+    configs = {"server9": PeerConfig(daemon=DaemonConfig(server_type, rpc_workers))}
+    ns, stop, processes = start_peers([(["server9"], -1, "server")], configs)
+    seller = {"seller": {"bully_id": 0, "id": "seller0"}, "product_name": "fish", "product_count": 10**9}
+    with Pyro5.api.Proxy(ns.lookup("server9")) as server:
+        server.register_products_with_warehouse(seller)
+
+    # the calls traders make on every sale and every catch up
+    def call(server, index):
+        server.update_warehouse("seller0", 1, {"id": buyers[index]}, seller)
+        return server.get_warehouse_changes(0)[0]
+    result = load(ns.lookup("server9"), call)
+    stop_peers(ns, stop, processes)
+    return result
+
+
+if __name__ == "__main__":
+    # the warehouse and trader files are written to a scratch directory
+    os.chdir(tempfile.mkdtemp())
+    threading.Thread(target=Pyro5.nameserver.start_ns_loop, kwargs={"host": ns_name}, daemon=True).start()
+    time.sleep(1)
+
+    print(datetime.datetime.now(), n_clients, "clients for", duration, "s per setting, median of", rounds, "rounds")
+    print("role     server     workers  accepted/s  rejected/s  errors  p50 ms  p95 ms")
+    for role, bench in (("trader", bench_trader), ("server", bench_server)):
+        best = None
+        for server_type, rpc_workers in settings:
+            runs = [bench(server_type, rpc_workers) for _ in range(rounds)]
+            accepted, rejected, errors, p50, p95 = np.median(runs, axis=0)
+            errors = int(errors)
+            print(role.ljust(8), server_type.ljust(10), str(rpc_workers or "-").ljust(8), str(round(accepted, 1)).ljust(11), str(round(rejected, 1)).ljust(11), str(errors).ljust(7), str(round(p50, 1)).ljust(7), round(p95, 1))
+            if best is None or accepted > best[0]:
+                best = (accepted, server_type, rpc_workers)
+        print("Best setting for", role, ":", best[1], "with", best[2] or "no", "workers")
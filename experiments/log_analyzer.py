@@ -0,0 +1,212 @@
+# Streaming analysis of the bazaar logs - trader_*.txt, server_outputs.txt and buyer output
+from itertools import islice
+import sys
+import numpy as np
+
+# "YYYY-MM-DD HH:MM:SS.ffffff", datetime.now() drops the fraction when it is zero
+TIMESTAMP_LENGTH = 26
+SECONDS_LENGTH = 19
+US = 1000000
+# buyers print "bought" for every purchase, in their output and in the experiment logs
+DEFAULT_EVENT = " bought "
+# lines written when a trader retires or is found dead by the other trader
+DEFAULT_MARKERS = ("retired", " is retiring from the market", " to be dead")
+# inter-trade gaps are histogrammed on log-spaced bins from 1us to 10000s
+GAP_BINS = np.logspace(0, 10, 401)
+
+
+def timestamp(line):
+    """
+    Cut the timestamp off a log line
+    :param line: The log line
+    :return: the timestamp text, or None if the line does not start with one
+    """
+    if len(line) < SECONDS_LENGTH or not line[:4].isdigit():
+        return None
+    if len(line) >= TIMESTAMP_LENGTH and line[SECONDS_LENGTH] == ".":
+        return line[:TIMESTAMP_LENGTH]
+    return line[:SECONDS_LENGTH]
+
+def read_timestamps(path, match=None, chunk_lines=1000000):
+    """
+    Stream the timestamps of the matching lines of a log, parsed in bulk one chunk at a time
+    :param path: The path of the log
+    :param match: The text a line must contain to be counted, None for every line
+    :param chunk_lines: The number of lines held in memory at once
+    :return: generator of int64 arrays of microseconds since the epoch
+    """
+    with open(path, errors="replace") as f:
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                return
+            stamps = [timestamp(line) for line in lines if match is None or match in line]
+            stamps = [stamp for stamp in stamps if stamp is not None]
+            if stamps:
+                yield np.array(stamps, dtype="datetime64[us]").astype(np.int64)
+
+def find_failover(paths, markers=DEFAULT_MARKERS):
+    """
+    Find the first trader failure in a set of logs
+    :param paths: The paths of the logs
+    :param markers: The texts of the lines marking a failure
+    :return: the time of the first failure in microseconds since the epoch, or None
+    """
+    failover = None
+    for path in paths:
+        for marker in markers:
+            for chunk in read_timestamps(path, marker):
+                if failover is None or chunk.min() < failover:
+                    failover = int(chunk.min())
+    return failover
+
+
+class LogStats:
+    """
+    The LogStats class accumulates statistics of event timestamps in bounded memory.
+    Memory grows with the number of throughput windows, never with the number of events.
+    It has the following methods:
+    1. add - Add a chunk of timestamps of one log
+    2. throughput - Get the windowed throughput time series
+    3. gap_percentiles - Get percentiles of the inter-trade latency
+    4. failover_throughput - Get the throughput before and after the failover
+    """
+
+    def __init__(self, window=1.0, failover=None):
+        """
+        Construct a new 'LogStats' object.
+
+        :param window: The width of the throughput windows in seconds
+        :param failover: The time of the failover in microseconds since the epoch, None to not split
+        :return: returns nothing
+        """
+        self.window = int(window * US)
+        self.start = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.total = 0
+        self.first = None
+        self.last = None
+        # last timestamp of every log, so gaps carry over chunk boundaries
+        self.previous = {}
+        self.gap_hist = np.zeros(len(GAP_BINS) - 1, dtype=np.int64)
+        self.gap_count = 0
+        self.gap_sum = 0
+        self.failover = failover
+        # count, first and last event before and after the failover
+        self.sides = {"before": [0, None, None], "after": [0, None, None]}
+
+    def add(self, log, stamps):
+        """
+        Add a chunk of timestamps of one log
+        :param log: The name of the log the chunk was read from
+        :param stamps: int64 array of microseconds since the epoch
+        :return: nothing
+        """
+        if len(stamps) == 0:
+            return
+        lo, hi = int(stamps.min()), int(stamps.max())
+        self.total += len(stamps)
+        self.first = lo if self.first is None else min(self.first, lo)
+        self.last = hi if self.last is None else max(self.last, hi)
+
+        # windows are aligned to the earliest event seen, earlier logs shift the series right
+        aligned = lo - lo % self.window
+        if self.start is None:
+            self.start = aligned
+        elif aligned < self.start:
+            shift = (self.start - aligned) // self.window
+            self.counts = np.concatenate([np.zeros(shift, dtype=np.int64), self.counts])
+            self.start = aligned
+        counts = np.bincount((stamps - self.start) // self.window)
+        if len(counts) > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(len(counts) - len(self.counts), dtype=np.int64)])
+        self.counts[:len(counts)] += counts
+
+        if log in self.previous:
+            gaps = np.diff(stamps, prepend=self.previous[log])
+        else:
+            gaps = np.diff(stamps)
+        self.previous[log] = int(stamps[-1])
+        gaps = gaps[gaps > 0]
+        self.gap_hist += np.histogram(gaps, GAP_BINS)[0]
+        self.gap_count += len(gaps)
+        self.gap_sum += int(gaps.sum())
+
+        if self.failover is not None:
+            for side, part in (("before", stamps[stamps < self.failover]), ("after", stamps[stamps >= self.failover])):
+                if len(part):
+                    count, first, last = self.sides[side]
+                    self.sides[side] = [count + len(part), int(part.min()) if first is None else min(first, int(part.min())), int(part.max()) if last is None else max(last, int(part.max()))]
+
+    def add_log(self, path, match=DEFAULT_EVENT, chunk_lines=1000000):
+        """
+        Stream a whole log into the statistics
+        :param path: The path of the log
+        :param match: The text of the event lines
+        :param chunk_lines: The number of lines held in memory at once
+        :return: nothing
+        """
+        for stamps in read_timestamps(path, match, chunk_lines):
+            self.add(path, stamps)
+
+    def mean_throughput(self):
+        """
+        Get the average number of events per second between the first and the last event
+        :return: events per second
+        """
+        if self.total < 2 or self.last == self.first:
+            return 0.0
+        return self.total * US / (self.last - self.first)
+
+    def throughput(self):
+        """
+        Get the windowed throughput time series
+        :return: window start in seconds since the first window and events per second of every window
+        """
+        return np.arange(len(self.counts)) * self.window / US, self.counts * US / self.window
+
+    def gap_percentiles(self, percentiles=(50, 95, 99)):
+        """
+        Get percentiles of the inter-trade latency from the gap histogram
+        :param percentiles: The percentiles to compute
+        :return: the upper bin edge in seconds of every percentile
+        """
+        if self.gap_count == 0:
+            return [0.0 for _ in percentiles]
+        cumulative = np.cumsum(self.gap_hist)
+        ranks = [int(np.searchsorted(cumulative, self.gap_count * p / 100.0)) for p in percentiles]
+        return [GAP_BINS[min(rank + 1, len(GAP_BINS) - 1)] / US for rank in ranks]
+
+    def failover_throughput(self):
+        """
+        Get the throughput before and after the failover
+        :return: events per second before and after, None for a side with fewer than two events
+        """
+        result = []
+        for side in ("before", "after"):
+            count, first, last = self.sides[side]
+            result.append(count * US / (last - first) if count > 1 and last > first else None)
+        return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Incorrect number of arguments, the correct command is python3 log_analyzer.py window_in_sec log [log ...]")
+        sys.exit()
+    window = float(sys.argv[1])
+    paths = sys.argv[2:]
+
+    stats = LogStats(window, find_failover(paths))
+    for path in paths:
+        stats.add_log(path)
+
+    print("Events: ", stats.total)
+    print("Average throughput: ", round(stats.mean_throughput(), 3), "events per second")
+    for start, rate in zip(*stats.throughput()):
+        print("  ", round(start, 3), "s ", round(rate, 3), "events per second")
+    p50, p95, p99 = stats.gap_percentiles()
+    print("Inter-trade latency p50 ", round(p50, 6), "s p95 ", round(p95, 6), "s p99 ", round(p99, 6), "s mean ", round(stats.gap_sum / max(stats.gap_count, 1) / US, 6), "s")
+    if stats.failover is not None:
+        before, after = stats.failover_throughput()
+        print("Before failover throughput: ", before)
+        print("After failover throughput: ", after)
@@ -0,0 +1,330 @@
+# Fault injection benchmark - runs a fixed workload on the simulated bazaar while a schedule of faults is applied
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+import numpy as np
+import Pyro5.errors
+import simulate
+from transport import InMemoryTransport
+
+FAULTS = ["kill", "pause", "delay", "drop", "partition"]
+
+
+class FaultInjector:
+    """
+    The FaultInjector class decides the fate of every call made over an in-memory transport.
+    It has the following methods:
+    1. inject - Start a fault
+    2. heal - End a fault
+    3. apply - Apply the active faults to a call
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'FaultInjector' object.
+
+        :return: returns nothing
+        """
+        self.down = set()
+        # paused peer to the event set when it resumes
+        self.paused = {}
+        # method to added latency in seconds
+        self.delays = {}
+        # method and target peer, None for any peer, of the calls dropped
+        self.dropped = set()
+        # peer to its partition, peers in no partition form one more
+        self.partitions = {}
+
+    def inject(self, fault):
+        """
+        Start a fault
+        :param fault: dictionary with the kind of fault and its target, method, latency or groups
+        :return: nothing
+        """
+        kind = fault["fault"]
+        if kind == "kill":
+            self.down.add(fault["target"])
+        elif kind == "pause":
+            self.paused[fault["target"]] = threading.Event()
+        elif kind == "delay":
+            self.delays[fault["method"]] = fault["latency"]
+        elif kind == "drop":
+            self.dropped.add((fault["method"], fault.get("target")))
+        elif kind == "partition":
+            for i, group in enumerate(fault["groups"]):
+                for peer_id in group:
+                    self.partitions[peer_id] = i
+
+    def heal(self, fault):
+        """
+        End a fault
+        :param fault: the fault passed to inject
+        :return: nothing
+        """
+        kind = fault["fault"]
+        if kind == "kill":
+            self.down.discard(fault["target"])
+        elif kind == "pause":
+            self.paused.pop(fault["target"]).set()
+        elif kind == "delay":
+            self.delays.pop(fault["method"], None)
+        elif kind == "drop":
+            self.dropped.discard((fault["method"], fault.get("target")))
+        elif kind == "partition":
+            self.partitions = {}
+
+    def apply(self, source, target, method):
+        """
+        Apply the active faults to a call, raising CommunicationError if the call does not get through
+        :param source: The id of the calling peer, None if unknown
+        :param target: The id of the called peer
+        :param method: The name of the method called
+        :return: nothing
+        """
+        for peer_id in (source, target):
+            if peer_id in self.down:
+                raise Pyro5.errors.CommunicationError(peer_id + " is down")
+        # a paused peer neither sends nor answers until it resumes
+        for peer_id in (source, target):
+            resumed = self.paused.get(peer_id)
+            if resumed is not None:
+                resumed.wait()
+        if (method, None) in self.dropped or (method, target) in self.dropped:
+            raise Pyro5.errors.CommunicationError("call to " + method + " of " + target + " dropped")
+        if self.partitions and source is not None and self.partitions.get(source, -1) != self.partitions.get(target, -1):
+            raise Pyro5.errors.CommunicationError(source + " and " + target + " are partitioned")
+        delay = self.delays.get(method)
+        if delay:
+            time.sleep(delay)
+
+
+def resolve(target, traders):
+    """
+    Turn a target of the schedule into a peer id
+    :param target: "trader:<i>" for the i-th elected trader, "warehouse" or a peer id
+    :param traders: the ids of the elected traders
+    :return: peer id
+    """
+    if target.startswith("trader:"):
+        return traders[int(target.split(":")[1])]
+    if target == "warehouse":
+        return "server9"
+    return target
+
+async def buyer_loop(peer, loop, pool, deadline, orders):
+    """
+    Send buy requests back to back until the deadline, counting lost and duplicated orders
+    :return: nothing
+    """
+    while time.time() < deadline:
+        if peer.role == "buyer":
+            answers = orders["answers"].get(peer.id, 0)
+            sales = orders["sales"].get(peer.id, 0)
+            orders["sent"] += 1
+            try:
+                accepted = await loop.run_in_executor(pool, peer.sendBuyRequest)
+            except Exception as e:
+                accepted = None
+                print(datetime.datetime.now(), "Exception in buyer_loop", e)
+            if accepted is False:
+                orders["rejected"] += 1
+            elif orders["answers"].get(peer.id, 0) == answers:
+                # accepted by no trader or never answered
+                orders["lost"] += 1
+            # a buyer has one order in flight, so a second sale for it is a duplicate
+            orders["duplicated"] += max(0, orders["sales"].get(peer.id, 0) - sales - 1)
+        await asyncio.sleep(1)
+
+def count_answers(peer, orders):
+    """
+    Count the answers and sales a buyer receives from traders
+    :return: nothing
+    """
+    transaction = peer.transaction
+
+    def counted(product_name, buyer_info_id, seller_id, trader_id, buyer_success, insufficient, item_cnt, order_id=None):
+        orders["answers"][peer.id] = orders["answers"].get(peer.id, 0) + 1
+        if buyer_success:
+            orders["sales"][peer.id] = orders["sales"].get(peer.id, 0) + 1
+            orders["sale_times"].append(time.time())
+        return transaction(product_name, buyer_info_id, seller_id, trader_id, buyer_success, insufficient, item_cnt, order_id)
+    counted._pyroExposed = True
+    peer.transaction = counted
+
+async def monitor(peers, traders, removals, deadline):
+    """
+    Record when the peers first stop listing each elected trader as a trader
+    :return: nothing
+    """
+    while time.time() < deadline:
+        now = time.time()
+        for trader in traders:
+            if trader not in removals and any(trader not in peer.trader for peer in peers if peer.id != trader):
+                removals[trader] = now
+        await asyncio.sleep(0.1)
+
+async def apply_schedule(schedule, injector, results, start):
+    """
+    Inject and heal the faults of the schedule at their times
+    :return: nothing
+    """
+    async def heal_later(fault, result):
+        await asyncio.sleep(fault["duration"])
+        injector.heal(fault)
+        result["healed"] = time.time()
+        print(datetime.datetime.now(), "Healed", fault["fault"], "of", fault.get("target", fault.get("method", "")))
+
+    heals = []
+    for fault, result in zip(schedule, results):
+        await asyncio.sleep(max(0, start + fault["at"] - time.time()))
+        injector.inject(fault)
+        result["injected"] = time.time()
+        print(datetime.datetime.now(), "Injected", fault["fault"], "of", fault.get("target", fault.get("method", "")))
+        if fault.get("duration"):
+            heals.append(asyncio.create_task(heal_later(fault, result)))
+    await asyncio.gather(*heals)
+
+async def run(peers, transport, schedule, duration, workers):
+    """
+    Elect the traders, then run the workload for the given duration while the schedule is applied
+    :return: the list of fault results and the order statistics
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    for peer in peers:
+        peer.ns = peer.get_nameserver(peer.hostname)
+        peer.register_name(peer.transport.bind(peer))
+        peer.announce()
+    for peer in peers:
+        peer.get_neighbors(announce=False)
+        peer.restocking = True
+
+    coordinator = [peer for peer in peers if peer.bully_id == 0][0]
+    await loop.run_in_executor(pool, coordinator.elect_traders)
+    traders = [peer.id for peer in peers if peer.role == "trader"]
+    # the traders watch each other with the heartbeat, without the built-in retirement of one of them
+    for peer in peers:
+        if peer.role == "trader":
+            peer.background.submit(peer.ping_message, [trader for trader in traders if trader != peer.id][0])
+
+    schedule = [dict(fault) for fault in sorted(schedule, key=lambda fault: fault["at"])]
+    for fault in schedule:
+        if "target" in fault:
+            fault["target"] = resolve(fault["target"], traders)
+        if "groups" in fault:
+            fault["groups"] = [[resolve(target, traders) for target in group] for group in fault["groups"]]
+    results = [{"fault": fault["fault"], "target": fault.get("target"), "at": fault["at"], "injected": None, "detected": None, "healed": None} for fault in schedule]
+
+    orders = {"sent": 0, "rejected": 0, "lost": 0, "duplicated": 0, "answers": {}, "sales": {}, "sale_times": []}
+    for peer in peers:
+        if peer.role == "buyer":
+            count_answers(peer, orders)
+
+    injector = FaultInjector()
+    transport.faults = injector
+    start = time.time()
+    deadline = start + duration
+    removals = {}
+    tasks = [apply_schedule(schedule, injector, results, start), monitor(peers, traders, removals, deadline)]
+    for peer in peers:
+        if peer.role == "seller":
+            tasks.append(simulate.seller_loop(peer, loop, pool, deadline))
+        elif peer.role == "buyer":
+            tasks.append(buyer_loop(peer, loop, pool, deadline, orders))
+    await asyncio.gather(*tasks)
+
+    # a fault is detected when the network drops its trader, or any trader while a fault on other peers lasts
+    for result in results:
+        if result["injected"] is None:
+            continue
+        if result["target"] in removals:
+            result["detected"] = removals[result["target"]]
+        elif result["target"] not in traders:
+            healed = result["healed"] if result["healed"] is not None else deadline
+            detected = [removed for removed in removals.values() if result["injected"] <= removed <= healed]
+            result["detected"] = min(detected) if detected else None
+
+    for peer in peers:
+        if peer.role == "trader":
+            peer.role = "retire"
+    for fault in schedule:
+        if fault["fault"] == "pause" and fault["target"] in injector.paused:
+            injector.heal(fault)
+    pool.shutdown(wait=False)
+    orders["start"] = start
+    return results, orders
+
+def report(results, orders, duration, window, recover_fraction=0.8):
+    """
+    Turn the raw measurements into the benchmark results
+    :param results: the fault results of run
+    :param orders: the order statistics of run
+    :param duration: the duration of the run in seconds
+    :param window: the width of the throughput windows in seconds
+    :param recover_fraction: the share of the baseline throughput that counts as recovered
+    :return: dictionary of results
+    """
+    start = orders["start"]
+    n_windows = int(np.ceil(duration / window))
+    counts = np.bincount(((np.array(orders["sale_times"]) - start) // window).astype(np.int64).clip(0, n_windows - 1), minlength=n_windows) if orders["sale_times"] else np.zeros(n_windows, dtype=np.int64)
+    rates = counts / window
+
+    injected = [result["injected"] - start for result in results if result["injected"] is not None]
+    first_fault = min(injected) if injected else duration
+    before = rates[:max(1, int(first_fault // window))]
+    baseline = float(before.mean())
+
+    faults = []
+    for result in results:
+        entry = {"fault": result["fault"], "target": result["target"], "at": result["at"], "time_to_detect": None, "time_to_recover": None}
+        if result["injected"] is not None:
+            at = result["injected"] - start
+            if result["detected"] is not None:
+                entry["time_to_detect"] = round(result["detected"] - result["injected"], 3)
+            for i in range(int(at // window) + 1, n_windows):
+                if baseline > 0 and rates[i] >= recover_fraction * baseline:
+                    entry["time_to_recover"] = round((i + 1) * window - at, 3)
+                    break
+        faults.append(entry)
+
+    after = rates[int(first_fault // window):] if injected else rates[:0]
+    return {
+        "faults": faults,
+        "orders": {key: orders[key] for key in ["sent", "rejected", "lost", "duplicated"]},
+        "completed": len(orders["sale_times"]),
+        "baseline_throughput": round(baseline, 3),
+        "min_throughput_after_fault": round(float(after.min()), 3) if len(after) else None,
+        "throughput_dip": round(1 - float(after.min()) / baseline, 3) if len(after) and baseline > 0 else None,
+        "window": window,
+        "throughput": [round(float(rate), 3) for rate in rates],
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or len(sys.argv) > 5:
+        print("Incorrect number of arguments, the correct command is python3 faults.py schedule.json number_of_peers duration_in_sec [seed]")
+        sys.exit()
+    with open(sys.argv[1]) as f:
+        schedule = json.load(f)
+    n_peers = int(sys.argv[2])
+    duration = float(sys.argv[3])
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    for fault in schedule:
+        if fault["fault"] not in FAULTS:
+            print("Unknown fault", fault["fault"], "the faults are", ", ".join(FAULTS))
+            sys.exit()
+
+    random.seed(seed)
+    transport = InMemoryTransport(seed=seed)
+    peers = simulate.get_peers(n_peers, transport)
+    results, orders = asyncio.run(run(peers, transport, schedule, duration, min(64, n_peers)))
+    summary = report(results, orders, duration, 2.0)
+    with open("fault_results.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,69 @@
+# bounded history of the buyers of a seller
+from collections import Counter, deque
+
+
+class BuyerHistory:
+    """
+    The BuyerHistory class keeps the buyers of one seller in constant memory.
+    It remembers the most recent buyers in a ring buffer and counts purchases per buyer,
+    optionally archiving buyers that fall out of the ring buffer to a spill file.
+    It has the following methods:
+    1. add - Record a purchase by a buyer
+    2. recent - Get the most recent buyers
+    3. close - Close the spill file
+    It can be used as a context manager that closes the spill file on exit.
+    """
+
+    def __init__(self, capacity, spill_file=None):
+        """
+        Construct a new 'BuyerHistory' object.
+
+        :param capacity: The number of recent buyers to keep
+        :param spill_file: The file evicted buyers are appended to, None to drop them
+        :return: returns nothing
+        """
+        self.buyers = deque(maxlen=capacity)
+        self.counts = Counter()
+        self.total = 0
+        self.spill_file = spill_file
+        # opened at the first spill and kept open until close
+        self.spill = None
+
+    def add(self, buyer_id):
+        """
+        Record a purchase by a buyer
+        :param buyer_id: The id of the buyer
+        :return: nothing
+        """
+        if self.spill_file and len(self.buyers) == self.buyers.maxlen:
+            if self.spill is None:
+                self.spill = open(self.spill_file, "a")
+            self.spill.write(self.buyers[0] + "\n")
+            # flushed at every spill, so nothing is left unwritten when the peer process is killed
+            self.spill.flush()
+        self.buyers.append(buyer_id)
+        self.counts[buyer_id] += 1
+        self.total += 1
+
+    def recent(self):
+        """
+        Get the most recent buyers
+        :return: list of buyer ids, oldest first
+        """
+        return list(self.buyers)
+
+    def close(self):
+        """
+        Close the spill file, a later spill opens it again
+        :return: nothing
+        """
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
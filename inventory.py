@@ -0,0 +1,254 @@
+# memory-mapped inventory of fixed-size seller records shared by the warehouse and co-located traders
+import mmap
+import os
+import struct
+from threading import BoundedSemaphore
+
+MAGIC = b"INV1"
+# magic, capacity, number of records
+HEADER = struct.Struct("<4sII")
+HEADER_SIZE = 64
+SEQ = struct.Struct("<I")
+# seqlock, seller id, bully id, product code, count, version
+RECORD = struct.Struct("<I32siH2xqQ4x")
+FIELDS = struct.Struct("<32siH2xqQ4x")
+
+
+class MappedInventory:
+    """
+    The MappedInventory class stores the warehouse as an array of fixed-size seller records in a memory-mapped file.
+    The warehouse is the only writer and updates records in place under a per-record seqlock,
+    so traders on the same host read current stock without parsing the file.
+    When the file is full, the warehouse doubles it; records never move, so readers only map the file again.
+    It has the following methods:
+    1. add - Add a seller record
+    2. update - Change the product count of a seller
+    3. read - Read a seller record consistently
+    4. find_seller - Find a seller of a product with enough stock
+    5. sellers_of - Get every seller of a product
+    6. to_dict - Build the seller information dictionary used by the JSON warehouse
+    7. grow - Make room for more seller records
+    8. remap - Map the file again, closing the old mapping
+    """
+
+    def __init__(self, path, products, capacity=1024, writable=False):
+        """
+        Construct a new 'MappedInventory' object, creating the file if the warehouse opens it first.
+
+        :param path: The path of the inventory file
+        :param products: The list of products, a product's code is its index in the list
+        :param capacity: The number of seller records the file is created with
+        :param writable: Boolean to indicate whether this is the warehouse's writable mapping
+        :return: returns nothing
+        """
+        self.products = products
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            # create the file under another name so that traders never map a partially written file
+            with open(path + ".tmp", "wb") as f:
+                f.write(HEADER.pack(MAGIC, capacity, 0).ljust(HEADER_SIZE, b"\0"))
+                f.write(b"\0" * RECORD.size * capacity)
+            os.replace(path + ".tmp", path)
+
+        self.file = open(path, "r+b" if writable else "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        # one thread maps the file again at a time
+        self.map_sem = BoundedSemaphore(1)
+        magic, self.capacity, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not an inventory file")
+
+        # seller id and product code to record index, records never move once added
+        self.index = {}
+        self.product_index = {}
+        self.indexed = 0
+
+    def count(self):
+        """
+        Get the number of seller records
+        :return: number of records
+        """
+        while True:
+            try:
+                return HEADER.unpack_from(self.map, 0)[2]
+            except ValueError:
+                # the mapping was closed after the file was mapped again, read the new one
+                continue
+
+    def offset(self, i):
+        """
+        Get the position of a record in the file
+        :param i: The index of the record
+        :return: byte offset of the record
+        """
+        return HEADER_SIZE + i * RECORD.size
+
+    def refresh_index(self):
+        """
+        Index the records added since the last call
+        :return: nothing
+        """
+        count = self.count()
+        if count > self.capacity:
+            # the warehouse grew the file since it was mapped
+            self.map_sem.acquire()
+            try:
+                if count > self.capacity:
+                    self.remap(mmap.ACCESS_READ)
+                    self.capacity = HEADER.unpack_from(self.map, 0)[1]
+            finally:
+                self.map_sem.release()
+        while self.indexed < count:
+            seller_id, _, code, _, _ = self.read(self.indexed)
+            self.index[seller_id] = self.indexed
+            self.product_index.setdefault(code, []).append(self.indexed)
+            self.indexed += 1
+
+    def read(self, i):
+        """
+        Read a seller record consistently, retrying while the warehouse is writing it
+        :param i: The index of the record
+        :return: seller id, bully id, product code, count, version
+        """
+        offset = self.offset(i)
+        while True:
+            try:
+                before = SEQ.unpack_from(self.map, offset)[0]
+                if before & 1:
+                    continue
+                seller_id, bully_id, code, count, version = FIELDS.unpack_from(self.map, offset + SEQ.size)
+                if SEQ.unpack_from(self.map, offset)[0] == before:
+                    return seller_id.rstrip(b"\0").decode(), bully_id, code, count, version
+            except ValueError:
+                # the mapping was closed after the file was mapped again, read the new one
+                continue
+
+    def write(self, i, seller_id, bully_id, code, count, version):
+        """
+        Write a seller record under its seqlock
+        :return: nothing
+        """
+        offset = self.offset(i)
+        seq = SEQ.unpack_from(self.map, offset)[0]
+        SEQ.pack_into(self.map, offset, seq + 1)
+        FIELDS.pack_into(self.map, offset + SEQ.size, seller_id.encode(), bully_id, code, count, version)
+        SEQ.pack_into(self.map, offset, seq + 2)
+
+    def add(self, seller_id, bully_id, product_name, count):
+        """
+        Add a seller record, only called by the warehouse
+        :param seller_id: The id of the seller
+        :param bully_id: The bully id of the seller
+        :param product_name: The product the seller sells
+        :param count: The product count
+        :return: nothing
+        """
+        i = self.count()
+        if i >= self.capacity:
+            self.grow(2 * self.capacity)
+        if len(seller_id.encode()) > 32:
+            raise ValueError("seller id " + seller_id + " is longer than 32 bytes")
+        code = self.products.index(product_name)
+        self.write(i, seller_id, bully_id, code, count, 1)
+        # publish the record only once it is complete
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, i + 1)
+        self.refresh_index()
+
+    def grow(self, capacity):
+        """
+        Make room for more seller records, only called by the warehouse
+        :param capacity: The new number of seller records
+        :return: nothing
+        """
+        self.file.truncate(HEADER_SIZE + RECORD.size * capacity)
+        # readers in other processes keep reading the records their old mapping covers
+        self.remap(mmap.ACCESS_WRITE)
+        self.capacity = capacity
+        HEADER.pack_into(self.map, 0, MAGIC, capacity, self.count())
+
+    def remap(self, access):
+        """
+        Map the file again, closing the old mapping once no thread of the process is reading it
+        :param access: The mmap access of the new mapping
+        :return: nothing
+        """
+        old = self.map
+        self.map = mmap.mmap(self.file.fileno(), 0, access=access)
+        while True:
+            try:
+                old.close()
+                return
+            except BufferError:
+                # a thread is unpacking a record from the old mapping, it reads the new one next
+                continue
+
+    def update(self, seller_id, count):
+        """
+        Set the product count of a seller in place, only called by the warehouse
+        :param seller_id: The id of the seller
+        :param count: The new product count
+        :return: nothing
+        """
+        if seller_id not in self.index:
+            self.refresh_index()
+        i = self.index[seller_id]
+        _, bully_id, code, _, version = self.read(i)
+        self.write(i, seller_id, bully_id, code, count, version + 1)
+
+    def find_seller(self, product_name, item_count, exclude, held=None):
+        """
+        Find a seller of a product with enough stock
+        :param product_name: The name of the product
+        :param item_count: The least product count
+        :param exclude: The id of a peer that must not be returned
+        :param held: dictionary of seller id to units sold but not written to the inventory yet, taken off the stock
+        :return: seller information of the first seller with enough stock or '', and whether any seller has the product
+        """
+        self.refresh_index()
+        found = False
+        for i in self.product_index.get(self.products.index(product_name), []):
+            seller_id, bully_id, code, count, _ = self.read(i)
+            if seller_id == exclude:
+                continue
+            found = True
+            count -= (held or {}).get(seller_id, 0)
+            if count >= item_count:
+                return {"seller": {"bully_id": bully_id, "id": seller_id}, "product_name": product_name, "product_count": count}, found
+        return '', found
+
+    def sellers_of(self, product_name, held=None):
+        """
+        Get every seller of a product, in the order they were added
+        :param product_name: The name of the product
+        :param held: dictionary of seller id to units sold but not written to the inventory yet, taken off the stock
+        :return: list of seller information
+        """
+        self.refresh_index()
+        sellers = []
+        for i in self.product_index.get(self.products.index(product_name), []):
+            seller_id, bully_id, code, count, _ = self.read(i)
+            count -= (held or {}).get(seller_id, 0)
+            sellers.append({"seller": {"bully_id": bully_id, "id": seller_id}, "product_name": product_name, "product_count": count})
+        return sellers
+
+    def to_dict(self, seller_ids=None):
+        """
+        Build the seller information dictionary used by the JSON warehouse
+        :param seller_ids: ids of the sellers to read, None for every seller. Unknown ids are left out
+        :return: dictionary of seller id to seller information
+        """
+        self.refresh_index()
+        data = {}
+        indices = range(self.indexed) if seller_ids is None else [self.index[seller_id] for seller_id in dict.fromkeys(seller_ids) if seller_id in self.index]
+        for i in indices:
+            seller_id, bully_id, code, count, _ = self.read(i)
+            data[seller_id] = {"seller": {"bully_id": bully_id, "id": seller_id}, "product_name": self.products[code], "product_count": count}
+        return data
+
+    def close(self):
+        """
+        Unmap and close the inventory file
+        :return: nothing
+        """
+        self.map.close()
+        self.file.close()
@@ -1,11 +1,69 @@
+from config import DaemonConfig, HeartbeatConfig, LaunchConfig, MarketConfig, PeerConfig, TraderConfig
+from dataclasses import replace
 from peer import Peer
-import Pyro5
+import datetime
+from multiprocessing import Barrier, Event
+import Pyro5.api
+import Pyro5.errors
+import Pyro5.nameserver
 import random
 import sys
 from threading import Thread
 import time
 
-def get_peers():
+def wait_for_nameserver(ns_name, timeout=10):
+    """
+    Poll the nameserver until it answers instead of sleeping for a fixed time
+    :param ns_name: The hostname of the nameserver
+    :param timeout: The maximum time to wait in seconds
+    :return: nothing
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            Pyro5.api.locate_ns(host=ns_name)
+            return
+        except Pyro5.errors.NamingError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+def collect_profiles(ns_name, duration, interval=0.005):
+    """
+    Profile every peer registered with the nameserver of a running bazaar and merge their dumps
+    :param ns_name: The hostname of the nameserver
+    :param duration: The time to profile for in seconds
+    :param interval: The time between two stack samples in seconds
+    :return: nothing
+    """
+    ns = Pyro5.api.locate_ns(host=ns_name)
+    peer_uris = {name: uri for name, uri in ns.list().items() if name != "Pyro.NameServer"}
+    started = {}
+    try:
+        for name, uri in peer_uris.items():
+            try:
+                with Pyro5.api.Proxy(uri) as peer:
+                    if peer.start_profiling(interval):
+                        started[name] = uri
+                    else:
+                        print(datetime.datetime.now(), name, "is already being profiled")
+            except Pyro5.errors.CommunicationError:
+                print(datetime.datetime.now(), "Could not start profiling", name)
+        print(datetime.datetime.now(), "Profiling", len(started), "peers for", duration, "s")
+        time.sleep(duration)
+    finally:
+        # the profilers that started are stopped even if profiling was interrupted
+        # every peer also keeps its own profile_<id>.folded, the merged file holds all of them
+        with open("profile_all.folded", "w") as f:
+            for name, uri in started.items():
+                try:
+                    with Pyro5.api.Proxy(uri) as peer:
+                        f.write(peer.stop_profiling())
+                except Pyro5.errors.CommunicationError:
+                    print(datetime.datetime.now(), "Could not collect the profile of", name)
+    print(datetime.datetime.now(), "Collapsed stacks of all peers written to profile_all.folded")
+
+def get_peers(startup_barrier, topology_ready, first_trade):
     n_peers = int(sys.argv[2])
     n_items = 5
     n_traders = 2
@@ -17,6 +75,8 @@ def get_peers():
     ns_name = sys.argv[1]
     peers = []
     with_cache = True
+    # record every inbound call to trace_<id>.jsonl for replay.py when the run ends with "trace"
+    trace = sys.argv[-1] == "trace"
     if sys.argv[3] == "true":
         fault_tolerance_heartbeat = True
         heartbeat_timeout = int(sys.argv[4])
@@ -30,46 +90,62 @@ def get_peers():
         print("No server found, start one")
         Thread(target=Pyro5.nameserver.start_ns_loop, kwargs={"host": ns_name}).start()
         # wait for the nameserver to be up
-        time.sleep(2)
+        wait_for_nameserver(ns_name)
+    # misses within 0.1 s of a finished reload of a trader's cache reuse it
+    config = PeerConfig(
+        market=MarketConfig(n_items, product_time, n_traders, with_cache),
+        heartbeat=HeartbeatConfig(fault_tolerance_heartbeat, heartbeat_timeout),
+        launch=LaunchConfig(startup_barrier, topology_ready, first_trade, trace),
+        trader=TraderConfig(reload_window=0.1),
+    )
+    # Pyro daemon settings per role, the best of experiments/5/exp5_daemon_matrix.txt for the trader and the warehouse.
+    # Buyers and sellers take the trader settings since any of them may be elected
+    trader_config = replace(config, daemon=DaemonConfig("multiplex", background_workers=4))
+    server_config = replace(config, daemon=DaemonConfig("multiplex", background_workers=2))
 
     # ensures at least 1 seller
     role = 'seller'
     id = role + str(n_peers-2)
-    peers.append(Peer(id, n_peers-2,role, n_items, product_time, products, ns_name, n_traders, with_cache,fault_tolerance_heartbeat,heartbeat_timeout))
+    peers.append(Peer(id, n_peers-2, role, products, ns_name, trader_config))
 
     # ensures at least 1 buyer
     role = 'buyer'
     id = role + str(n_peers-1)
-    peers.append(Peer(id, n_peers-1, role, n_items, product_time, products, ns_name, n_traders, with_cache,fault_tolerance_heartbeat,heartbeat_timeout))
+    peers.append(Peer(id, n_peers-1, role, products, ns_name, trader_config))
 
     # add n_peers-2 buyers and sellers
     for i in range(n_peers - 2):
         # random assignment of roles
         role = roles[random.randint(0,len(roles) - 1)]
         id = role + str(i)
-        peer = Peer(id, i, role, n_items, product_time, products, ns_name, n_traders, with_cache,fault_tolerance_heartbeat,heartbeat_timeout)
+        peer = Peer(id, i, role, products, ns_name, trader_config)
         peers.append(peer)
 
-    peers.append(Peer('server9', -1, 'server', n_items, product_time, products, ns_name, n_traders, with_cache, fault_tolerance_heartbeat, heartbeat_timeout))
+    peers.append(Peer('server9', -1, 'server', products, ns_name, server_config))
 
     return peers
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("Incorrect number of arguments, the correct command is python3 join.py localhost number_of_arguments")
+    if len(sys.argv) == 4 and sys.argv[1] == "profile":
+        collect_profiles(sys.argv[2], float(sys.argv[3]))
         sys.exit()
-    peers = get_peers()
+    if len(sys.argv) not in (5, 6) or (len(sys.argv) == 6 and sys.argv[5] != "trace"):
+        print("Incorrect number of arguments, the correct command is python3 join.py localhost number_of_arguments true|false timeout [trace]")
+        sys.exit()
+    start = time.time()
+    # buyers, sellers and the warehouse server all wait on the barrier
+    startup_barrier = Barrier(int(sys.argv[2]) + 1)
+    topology_ready = Event()
+    first_trade = Event()
+    peers = get_peers(startup_barrier, topology_ready, first_trade)
 
-    time.sleep(2)
     try:
         for person in peers:
             person.start()
+        topology_ready.wait()
+        print(datetime.datetime.now(), "Topology ready after ", round(time.time() - start, 3), "s")
+        first_trade.wait()
+        print(datetime.datetime.now(), "Time to first trade: ", round(time.time() - start, 3), "s")
     except KeyboardInterrupt:
         sys.exit()
-
-
-
-
-
-
@@ -1,76 +1,156 @@
 # class to implement a peer - can be a buyer or a seller
 import atexit
-from concurrent.futures import ThreadPoolExecutor
+import copy
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import datetime
 import json
 import numpy as np
 import os.path
 import Pyro5.server
 import Pyro5.api
+import Pyro5.errors
 import random
 import re
 import glob
-from threading import BoundedSemaphore
+import heapq
+from threading import BoundedSemaphore, BrokenBarrierError, Thread
 from multiprocessing import Process
 import time
+from broadcast import Broadcaster
+from cache import SellerCache
+from config import PeerConfig
+from history import BuyerHistory
+from inventory import MappedInventory
+from profiler import StackSampler
+from transport import PyroTransport, make_daemon
+from workload import TraceRecorder
+
+# metadata peers register with the nameserver, so one listing gives every peer with its index
+PEER_METADATA = "bazaar.peer"
+INDEX_METADATA = "bazaar.index:"
+# order ids are the buyer, its epoch and a counter
+ORDER_ID = re.compile("(.*)-([0-9]+)$")
+
+
 class Peer(Process):
     """
     The Peer class represents a buyer or a seller within the P2P network.
-    It has the following methods:
-    1. get_random_neighbors - Create a neighbor list and assign neighbors to the peer
-    2. connect_neighbors - Select at most max_neighbors random neighbors from the neighbor list and connect to them
-    3. add_neighbor - Add a neighbor to the peer's neighbor list
-    4. get_neighbor_len - Get the number of neighbors of the peer
+    It has the following methods, besides the exposed handlers of elections, heartbeats and transactions:
+    1. register_name - Register the peer and its index with the nameserver
+    2. get_neighbors - Build the peer table from one nameserver listing and connect to every neighbor
+    3. connect_neighbors - Connect to every peer of the peer table
+    4. add_neighbor - Add a neighbor to the peer table
     5. get_nameserver - Get the nameserver proxy
     6. run - Starts the market simulation
+    7. make_daemon - Create the Pyro daemon of the peer
+    8. elect_traders - Elect the traders and announce them to the network
+    9. market_round - Run one round of the market driven by peer 0
+    10. start_profiling - Start sampling the stacks of the peer process
+    11. stop_profiling - Stop profiling and return the collapsed stacks
+    12. relay_broadcast - Handle a broadcast and pass it on to a subtree of peers
+    13. sendBuyRequest - Send a buy request, a basket or a window of pipelined orders to the traders
+    14. trading_lookup - Match a buy request to sellers as a trader
+    15. trading_basket_lookup - Match a basket to sellers all or nothing as a trader
+    16. hedge_order - Let a buyer send a copy of an order to another trader
+    17. cancel_order - Drop an order another trader sold
+    18. register_products - Register a restock with a trader
+    19. receive_gossip - Apply the seller updates gossiped by another trader
+    20. get_gossip - Get the seller updates sent after a sequence number
+    21. get_seller_cache_stats - Get the counters of the trader's bounded seller cache
+    22. get_reload_stats - Get the number of cache reloads of the trader and of the misses that shared one
+    23. update_warehouse - Record a sale in the warehouse
+    24. update_warehouse_batch - Record the sales written behind by a trader in the warehouse
+    25. acknowledge_batch - Forget a write-behind batch its trader has flushed
+    26. register_batch_with_warehouse - Record a batch of restocks in the warehouse
+    27. reserve_units - Lease units of a product to a trader
+    28. settle_leases_with_warehouse - Record the sales of leases and renew or return them
+    29. fulfill_basket - Take every item of a basket from the warehouse or none
+    30. fulfill_split - Take every part of a split order from the warehouse or none
+    31. claim_order_with_warehouse - Give a hedged order to the first trader that claims it
+    32. get_buyer_history - Get the buyers of a seller
+    33. get_warehouse_snapshot - Get the whole warehouse and its version
+    34. get_warehouse_changes - Get the sellers changed after a version of the warehouse
+    35. get_product_sellers - Get the sellers of some products
+    36. get_product_view - Get the running totals of a product
+    37. get_product_views - Get the running totals of every product
     """
 
-    def __init__(self, id, bully_id, role, product_count, product_time, products, hostname, n_traders, with_cache,fault_tolerance_heartbeat,heartbeat_timeout):
+    def __init__(self, id, bully_id, role, products, hostname, config=None, transport=None):
         """
         Construct a new 'Peer' object.
 
         :param id: The id of the peer
         :param bully_id: The bully id of the peer
         :param role: The role of the peer
-        :param product_count: The maximum number of products the peer can sell (if role is seller)
-        :param product_time: The time after which sellers re-register their products
         :param products: The list of products that a peer can buy or sell
         :param hostname: The hostname of the peer
-        :param n_traders: The number of traders in the network
-        :param with_cache: Boolean to indicate whether traders should use cache or not
-        :param fault_tolerance_heartbeat: Boolean to indicate whether traders should use fault tolerance or not
-        :param heartbeat_timeout: The timeout for the heartbeat
+        :param config: The settings of the peer, see config.PeerConfig, None for the defaults
+        :param transport: The transport used to reach other peers, Pyro over the network by default
         :return: returns nothing
         """
+        config = config if config is not None else PeerConfig()
         Process.__init__(self)
         self.id = id
         self.bully_id = bully_id
+        # the bully id the peer joins with is unique and never changes, unlike bully_id which is drawn again for every election
+        self.index = bully_id
         self.hostname = hostname
+        # peer index to peer id and uri of every peer in the nameserver listing, the peer included
+        self.peer_table = {}
+        # peer id to uri of every other peer, the view of peer_table the handlers address peers by
         self.neighbors = {}
         self.trader = []
         self.role = role
         self.products = products
         self.product_name = self.products[random.randint(0, len(self.products)-1)]
-        self.n = product_count
-        self.product_count = product_count
-        self.product_time = product_time
-        self.ns = self.get_nameserver(hostname)
+        self.n = config.market.product_count
+        self.product_count = config.market.product_count
+        self.product_time = config.market.product_time
+        self.transport = transport if transport is not None else PyroTransport(hostname)
+        # located in run so the launcher does not look up the nameserver once per peer before forking
+        self.ns = None
+        # short tasks such as fan-out calls, long-lived loops run on background so they never starve them
         self.executor = ThreadPoolExecutor(max_workers=10)
-        self.with_cache = with_cache
+        self.background = ThreadPoolExecutor(max_workers=config.daemon.background_workers, thread_name_prefix="background")
+        # the daemon model is fixed when the peer process starts
+        self.server_type = config.daemon.server_type
+        self.rpc_workers = config.daemon.rpc_workers
+        self.broadcaster = Broadcaster(self.transport, timeout=config.broadcast.broadcast_timeout, fanout=config.broadcast.broadcast_fanout)
+        self.with_cache = config.market.with_cache
         # to store previous role when elected to trader
         self.prev_role = ""
 
         # for trader
-        self.seller_information = {}
+        self.seller_cache_size = config.trader.seller_cache_size
+        self.seller_information = SellerCache(config.trader.seller_cache_size, config.trader.seller_cache_policy) if config.trader.seller_cache_size else {}
+        # version of the warehouse seller_information was caught up to, None until the first snapshot
+        self.cache_version = None
+        # warehouse version every seller's entry was read at, from the warehouse or gossiped by the other traders
+        self.seller_versions = {}
+        # for trader, seller updates sent to the other traders, and the last update received from each of them
+        self.gossip_interval = config.gossip.gossip_interval
+        self.gossip_seq = 0
+        self.gossip_log = deque(maxlen=config.gossip.gossip_log_size)
+        self.gossip_seen = {}
+        self.gossip_sem = BoundedSemaphore(1)
+        # for trader, the last reload of the cache and of every product, shared by the misses waiting on it
+        self.reload_window = config.trader.reload_window
+        self.reloads = {}
+        self.reload_sem = BoundedSemaphore(1)
+        self.reload_count = 0
+        self.reload_shared = 0
         self.transaction_information = {}
         self.storage_semaphore = BoundedSemaphore(1)
         self.transaction_semaphore = BoundedSemaphore(1)
         self.trading_list_semaphore = BoundedSemaphore(1)
-        self.n_traders = n_traders
+        self.n_traders = config.market.n_traders
+        # admission control, bounds the requests waiting on fail_sem
+        self.admission_sem = BoundedSemaphore(config.trader.max_pending_requests)
 
         self.heartbeat_status = True
-        self.fault_tolerance_heartbeat = fault_tolerance_heartbeat
-        self.heartbeat_timeout = heartbeat_timeout
+        self.fault_tolerance_heartbeat = config.heartbeat.fault_tolerance_heartbeat
+        self.heartbeat_timeout = config.heartbeat.heartbeat_timeout
         
         # for failure condition on buyers
         self.buy_request_done = False
@@ -80,58 +160,168 @@ class Peer(Process):
         self.recvWon = False
         self.recvOK = False
         self.won_sem = BoundedSemaphore(1)
+        self.election_sem = BoundedSemaphore(1)
         self.product_sem = BoundedSemaphore(1)
+        self.max_retries = config.buyer.max_retries
+        self.retry_backoff = config.buyer.retry_backoff
+        self.basket_size = config.buyer.basket_size
+        # for buyer, every order carries a unique id so that hedged copies are sold once
+        self.hedge_requests = config.buyer.hedge_requests
+        self.hedge_delay = config.buyer.hedge_delay
+        self.request_latencies = deque(maxlen=100)
+        self.order_counter = 0
+        self.order_epoch = str(int(time.time() * 1000))
+        self.order_log_size = config.trader.order_log_size
+        # for buyer, pipelined orders by order id, each with its product, future and deadline
+        self.pipeline_window = config.buyer.pipeline_window
+        self.order_timeout = config.buyer.order_timeout
+        self.outstanding = {}
+        # completed orders not yet returned by sendPipelinedRequests, oldest first
+        self.finished_orders = deque()
+        self.outstanding_sem = BoundedSemaphore(1)
+        self.pipeline_slots = BoundedSemaphore(config.buyer.pipeline_window)
+        self.order_executor = ThreadPoolExecutor(max_workers=config.buyer.pipeline_window) if config.buyer.pipeline_window > 1 else None
+        # for trader and server, order ids claimed or cancelled, oldest first,
+        # and the highest forgotten order of every buyer and epoch
+        self.orders = OrderedDict()
+        self.order_floors = {}
+        self.order_sem = BoundedSemaphore(1)
+        # for trader, entries in its order journal since it was last rewritten
+        self.order_journal_entries = 0
+
+        # workload capture
+        self.recorder = TraceRecorder("trace_" + self.id + ".jsonl", self.id) if config.launch.trace else None
+        # on-demand profiling, started and stopped over RPC
+        self.profiler = None
+        self.profiler_sem = BoundedSemaphore(1)
+
+        # readiness signals shared with the launcher
+        self.startup_barrier = config.launch.startup_barrier
+        self.topology_ready = config.launch.topology_ready
+        self.first_trade = config.launch.first_trade
 
         # for multicast lamport clocks
         self.clock_sem = BoundedSemaphore(1)
-        self.clock = 0 + int(self.id[-1]) / 10.0
-        self.buyer_list = [] # only for seller
+        # ties between equal clocks are broken by the peer index, see getClock
+        self.clock = 0
+        self.buyer_list = deque(maxlen=config.warehouse.buyer_history_size) # only for seller, most recent buyers
+
+        # for seller restocking, stock is the number of units registered with the traders and not sold yet
+        self.stock = 0
+        self.stock_sem = BoundedSemaphore(1)
+        self.restocking = False
+        self.restock_trader = None
+
+        # for trader, restock deltas waiting to be forwarded to the warehouse in one batch
+        self.pending_registrations = {}
+        self.registration_sem = BoundedSemaphore(1)
+        self.forward_sem = BoundedSemaphore(1)
+
+        # for trader, sales written behind to the warehouse, kept under "pending_sales" in the transaction log until flushed,
+        # then under "flushing_sales" until the warehouse acknowledges them
+        self.write_behind_interval = config.write_behind.write_behind_interval
+        self.write_behind_trades = config.write_behind.write_behind_trades
+        self.pending_trades = 0
+        self.flush_counter = 0
+        self.flush_sem = BoundedSemaphore(1)
+
+        # for trader, units leased from the warehouse and sold locally
+        self.reservation_ttl = config.leases.reservation_ttl
+        self.reservation_block = config.leases.reservation_block
+        self.leases = {}
+        self.lease_sem = BoundedSemaphore(1)
+        # for trader, products known to have no seller mapped to when that stops being trusted
+        self.negative_cache_ttl = config.trader.negative_cache_ttl
+        self.split_policy = config.trader.split_policy
+        self.unavailable_products = {}
+        # bumped whenever a product is restocked, so a lookup racing with a restock is not cached
+        self.product_versions = {}
+
+        # for server, buyers of every seller kept apart from the inventory file
+        self.buyer_history_size = config.warehouse.buyer_history_size
+        self.buyer_history_spill = config.warehouse.buyer_history_spill
+        self.buyer_history = {}
+
+        # for server and co-located traders, the memory-mapped warehouse
+        self.inventory_format = config.warehouse.inventory_format
+        self.inventory_capacity = config.warehouse.inventory_capacity
+        self.inventory = None
+
+        # for server, the warehouse version and the sellers changed by every version,
+        # counted from the time in microseconds the server started so versions after a restart are above every version before it
+        self.warehouse_version = int(time.time() * 1000000)
+        self.warehouse_snapshot = None
+        self.warehouse_changes = deque(maxlen=config.warehouse.change_log_size)
+        # oldest version whose changes are all still in warehouse_changes
+        self.warehouse_changes_from = self.warehouse_version + 1
+
+        # for server, running totals of every product, updated with the sellers changed by every version
+        self.top_sellers = config.warehouse.top_sellers
+        self.product_stock = {}
+        self.product_views = {}
+        # for server, a heap of the stock of every seller of a product, pushed on every change and ranked lazily
+        self.product_heaps = {}
+
+        # for server, leases granted to traders, loaded from leases.json on first use
+        self.granted_leases = None
+        self.lease_counter = 0
+        # for server, the units and buyers applied per seller of every write-behind batch not acknowledged by its trader yet,
+        # loaded from batches.json on first use
+        self.applied_batches = None
+
+    def register_name(self, uri):
+        """
+        Register the peer with the nameserver, tagged as a peer of the bazaar with its index
+        :param uri: The uri of the peer
+        :return: nothing
+        """
+        self.ns.register(self.id, uri, metadata={PEER_METADATA, INDEX_METADATA + str(self.index)})
 
-    def get_neighbors(self):
+    def get_neighbors(self, announce=True):
         """
         Create a neighbor list and assign neighbors to the peer
+        :param announce: Boolean to indicate whether the peer adds itself to its neighbors, which is only needed
+            if peers may have listed the nameserver before this peer registered
         :return: returns nothing
         """
-        neighbor_list = []
-        ns_dict = self.ns.list()
-        re_pattern = "seller[0-9]+|buyer[0-9]+|server9"
+        # A single listing gives the uri and index of every peer, the nameserver is not asked again per peer
+        listing = self.ns.list(metadata_all={PEER_METADATA}, return_metadata=True)
+        for peer_id, (uri, metadata) in listing.items():
+            index = next(int(tag[len(INDEX_METADATA):]) for tag in metadata if tag.startswith(INDEX_METADATA))
+            self.peer_table[index] = (peer_id, uri)
+        self.connect_neighbors(announce)
 
-        # Build a list of neighbors from the nameserver excluding the peer itself
-        for id in ns_dict:
-            if "NameServer" not in id and self.id != id and re.match(re_pattern, id):
-                neighbor_list.append(id)
-        self.connect_neighbors(neighbor_list)
-
-        neighbor_list.clear()
-
-    def connect_neighbors(self, neighbor_list):
+    def connect_neighbors(self, announce=True):
         """
-        Select all peers as neighbors and connect to them for fully connected network
-        :param neighbor_list: The list of neighbors
+        Select all peers of the peer table as neighbors and connect to them for fully connected network
+        :param announce: Boolean to indicate whether the peer adds itself to every neighbor's peer table
         :return: nothing
         """
-        if neighbor_list:
-
-            for i in range(0, len(neighbor_list)):
-                neighbor_id = neighbor_list[i]
-                self.neighbors[neighbor_id] = self.ns.lookup(neighbor_id)
-
-                with Pyro5.api.Proxy(self.neighbors[neighbor_id]) as neighbor:
-                    try:
-                        self.executor.submit(neighbor.add_neighbor, self.id)
-                    except Exception as e:
-                        print(datetime.datetime.now(), "Exception in connect_neighbors", e)
+        for index, (neighbor_id, uri) in list(self.peer_table.items()):
+            if index == self.index:
+                continue
+            self.neighbors[neighbor_id] = uri
+            if not announce:
+                continue
+            with self.transport.proxy(uri) as neighbor:
+                try:
+                    self.executor.submit(neighbor.add_neighbor, self.index, self.id, self.peer_table[self.index][1])
+                except Exception as e:
+                    print(datetime.datetime.now(), "Exception in connect_neighbors", e)
 
     @Pyro5.server.expose
-    def add_neighbor(self, neighbor_id):
+    def add_neighbor(self, index, neighbor_id, uri):
         """
-        Add a neighbor to the peer's neighbor list
+        Add a neighbor to the peer table
+        :param index: The index of the neighbor
         :param neighbor_id: The id of the neighbor to add
+        :param uri: The uri of the neighbor
         :return: nothing
         """
         # Complete bi-directional connections
-        if neighbor_id not in self.neighbors.keys():
-            self.neighbors[neighbor_id] = self.ns.lookup(neighbor_id)
+        if index not in self.peer_table:
+            self.peer_table[index] = (neighbor_id, uri)
+            self.neighbors[neighbor_id] = uri
 
     def get_nameserver(self, ns_name):
         """
@@ -141,7 +331,7 @@ class Peer(Process):
         """
 
         try:
-            ns = Pyro5.core.locate_ns(host=ns_name)
+            ns = self.transport.get_nameserver()
             return ns
         except Exception as e:
             print(datetime.datetime.now(), "Exception in get_nameserver", e)
@@ -153,102 +343,437 @@ class Peer(Process):
         """
 
         try:
-            with Pyro5.server.Daemon(host=self.hostname) as daemon:
+            with self.make_daemon() as daemon:
                 uri = daemon.register(self)
-                # Claim thread ownership of ns server proxy since each Pyro proxy is a thread
-                self.ns._pyroClaimOwnership()
-                self.ns.register(self.id, uri)
-
-                if self.role == "buyer":
-                    print(datetime.datetime.now(), self.id, "joins to buy ", self.product_name, " with bully id ", self.bully_id)
-                elif self.role == "seller":
-                    print(datetime.datetime.now(), self.id, "joins to sell ", self.product_name, " with bully id ", self.bully_id)
-                else:
-                    print(datetime.datetime.now(), self.id, "joins as server process ")
-
-                # Peer starts listening for requests
-                self.executor.submit(daemon.requestLoop)
-                time.sleep(1)
-
-                # Create a neighbor list and assign neighbors to the peer
-                self.get_neighbors()
-
-                # Peer 0 elects nt traders
-                traders = []
-                if self.id[-1] == "0":
-                    while len(traders) != self.n_traders:
-                        self.startElection()
-                        
-                        # get all traders
-                        for neighbor_name in self.neighbors:
-                            with Pyro5.api.Proxy(self.neighbors[neighbor_name]) as neighbor:
-                                if neighbor.isTrader() and neighbor_name not in traders:
-                                    traders.append(neighbor_name)
+                self.ns = self.get_nameserver(self.hostname)
+                self.register_name(uri)
 
+                self.announce()
 
-                        if self.role == "trader" and self.id not in traders:
-                            traders.append(self.id)
+                # Peer starts listening for requests, the daemon socket is already bound
+                Thread(target=daemon.requestLoop, name="requestLoop", daemon=True).start()
+                registered = self.wait_for_peers()
 
-                    print(datetime.datetime.now(), "Traders selected are: ", traders)
+                # Create a neighbor list and assign neighbors to the peer, every peer is listed once all of them registered
+                self.get_neighbors(announce=not registered)
+                self.wait_for_peers()
 
-                    # set all traders for neighbors and self
-                    for neighbor_name in self.neighbors:
-                        with Pyro5.api.Proxy(self.neighbors[neighbor_name]) as neighbor:
-                            neighbor.setTrader(traders)
-                    self.setTrader(traders)
-                    
-                    if self.fault_tolerance_heartbeat:
-                        for i,trader in enumerate(self.trader):
-                            if self.id != trader:
-                                with Pyro5.api.Proxy(self.neighbors[trader]) as neighbor:
-                                    neighbor.startTrading(i)
-                        if self.role == "trader":
-                            # traders.append(self.id)
-                            self.startTrading(1)
+                # Peer 0 elects nt traders
+                if self.index == 0:
+                    self.elect_traders()
+                    if self.topology_ready is not None:
+                        self.topology_ready.set()
 
                     while True:
                         # Peer 0 starts the market simulation
-                        # Register seller products with the warehouse
-                        print(datetime.datetime.now(), "sellers register products with trader")
-                        for neighbor_name in self.neighbors:
-                            with Pyro5.api.Proxy(self.neighbors[neighbor_name]) as neighbor:
-                                if "seller" in neighbor_name and not neighbor.isRetire():
-                                    neighbor.startSellerTrading()
-
-                        # Register self if seller
-                        # Case when peer 0 is a trader handled in startSellerTrading
-                        if "seller" in self.id:
-                            self.startSellerTrading()
-
-                        # Start buyer threads for trading
-                        print(datetime.datetime.now(), "buyers start trading on threads")
-                        for neighbor_name in self.neighbors:
-                            with Pyro5.api.Proxy(self.neighbors[neighbor_name]) as neighbor:
-                                if "buyer" in neighbor_name and not neighbor.isTrader() and not neighbor.isRetire():
-                                    neighbor.sendBuyRequest()
-                                    time.sleep(1)
-
-                        # Buy for self
-                        if "buyer" in self.id and not self.isTrader() and not self.isRetire():
-                            self.sendBuyRequest()
-                            time.sleep(1)
+                        self.market_round()
                                 
                 while True:
                     time.sleep(1)
 
         except Exception as e:
             print(datetime.datetime.now(), "Exception in main", e.with_traceback())
+        finally:
+            for history in self.buyer_history.values():
+                history.close()
+
+    def make_daemon(self):
+        """
+        Create the Pyro daemon of the peer with its server type and worker count
+        :return: the daemon
+        """
+        return make_daemon(self.hostname, self.server_type, self.rpc_workers)
+
+    def wait_for_peers(self):
+        """
+        Wait until every peer has reached the same startup step
+        :return: True if every peer reached it, False if the peer stopped waiting without knowing
+        """
+        if self.startup_barrier is None:
+            time.sleep(1)
+            return False
+        try:
+            self.startup_barrier.wait(timeout=30)
+            return True
+        except BrokenBarrierError:
+            print(datetime.datetime.now(), self.id, "startup barrier broken, continuing with the peers found so far")
+            return False
+
+    def record(self, call, *args):
+        """
+        Record an inbound call to the peer's trace
+        :param call: name of the method called
+        :param args: arguments of the call
+        :return: nothing
+        """
+        if self.recorder is not None:
+            self.recorder.record(call, *args)
+
+    @Pyro5.server.expose
+    def start_profiling(self, interval=0.005):
+        """
+        Start sampling the stacks of every thread of the peer process
+        :param interval: The time between two samples in seconds
+        :return: False if the peer is already being profiled, True otherwise
+        """
+        self.profiler_sem.acquire()
+        try:
+            if self.profiler is not None:
+                return False
+            self.profiler = StackSampler(interval)
+            self.profiler.start()
+            print(datetime.datetime.now(), self.id, "started profiling")
+            return True
+        finally:
+            self.profiler_sem.release()
+
+    @Pyro5.server.expose
+    def stop_profiling(self):
+        """
+        Stop profiling and dump the collapsed stacks to profile_<id>.folded
+        :return: the collapsed stacks prefixed with the peer id, or '' if the peer was not being profiled
+        """
+        self.profiler_sem.acquire()
+        try:
+            if self.profiler is None:
+                return ''
+            profiler = self.profiler
+            self.profiler = None
+        finally:
+            self.profiler_sem.release()
+        profiler.stop()
+        collapsed = profiler.collapsed(self.id)
+        with open("profile_" + self.id + ".folded", "w") as f:
+            f.write(collapsed)
+        print(datetime.datetime.now(), self.id, "stopped profiling after", profiler.samples, "samples")
+        return collapsed
+
+    def broadcast(self, method, *args):
+        """
+        Call an exposed method on every neighbor concurrently
+        :param method: name of the method
+        :param args: arguments of the call
+        :return: the result of every neighbor that answered
+        """
+        acks, failures = self.broadcaster.broadcast(self.neighbors, method, args)
+        if failures:
+            print(datetime.datetime.now(), self.id, "broadcast of", method, "did not reach", ", ".join(sorted(failures)))
+        return acks
+
+    @Pyro5.server.expose
+    def relay_broadcast(self, targets, method, args, timeout, fanout):
+        """
+        Handle a broadcast and pass it on to a subtree of peers
+        :param targets: dictionary of peer id to uri of the peers this peer relays to
+        :param method: name of the method
+        :param args: arguments of the call
+        :param timeout: time in seconds to wait for every peer
+        :param fanout: number of subtrees to split the targets into
+        :return: the result of every peer of the subtree that answered, and the error of every peer that did not
+        """
+        target = getattr(self, method)
+        if not getattr(target, "_pyroExposed", False):
+            raise AttributeError("method " + method + " is not exposed by " + self.id)
+        own = self.executor.submit(target, *args)
+        acks, failures = self.broadcaster.broadcast(targets, method, args, timeout, fanout)
+        try:
+            acks[self.id] = own.result(timeout)
+        except Exception as e:
+            failures[self.id] = str(e) or "timed out"
+        return acks, failures
+
+    def announce(self):
+        """
+        Print the role the peer joins the market with
+        :return: nothing
+        """
+        if self.role == "buyer":
+            print(datetime.datetime.now(), self.id, "joins to buy ", self.product_name, " with bully id ", self.bully_id)
+        elif self.role == "seller":
+            print(datetime.datetime.now(), self.id, "joins to sell ", self.product_name, " with bully id ", self.bully_id)
+        else:
+            print(datetime.datetime.now(), self.id, "joins as server process ")
+
+    def elect_traders(self):
+        """
+        Elect n_traders traders and announce them to the network
+        :return: the list of traders
+        """
+        traders = []
+        while len(traders) != self.n_traders:
+            self.startElection()
+            
+            # get all traders
+            for neighbor_name in self.neighbors:
+                with self.transport.proxy(self.neighbors[neighbor_name]) as neighbor:
+                    if neighbor.isTrader() and neighbor_name not in traders:
+                        traders.append(neighbor_name)
+
+
+            if self.role == "trader" and self.id not in traders:
+                traders.append(self.id)
+
+        print(datetime.datetime.now(), "Traders selected are: ", traders)
+
+        # set all traders for neighbors and self
+        self.broadcast("setTrader", traders)
+        self.setTrader(traders)
+        
+        if self.fault_tolerance_heartbeat:
+            for i,trader in enumerate(self.trader):
+                if self.id != trader:
+                    with self.transport.proxy(self.neighbors[trader]) as neighbor:
+                        neighbor.startTrading(i)
+            if self.role == "trader":
+                # the second trader is the one that fails
+                self.startTrading(self.trader.index(self.id))
+        return traders
+
+    def market_round(self):
+        """
+        Run one round of the market driven by peer 0
+        :return: nothing
+        """
+        # Sellers restock on their own product_time timers, see restock_loop
+
+        # Start buyer threads for trading
+        print(datetime.datetime.now(), "buyers start trading on threads")
+        for neighbor_name in self.neighbors:
+            with self.transport.proxy(self.neighbors[neighbor_name]) as neighbor:
+                if "buyer" in neighbor_name and not neighbor.isTrader() and not neighbor.isRetire():
+                    neighbor.startBuyRequest()
+                    time.sleep(1)
+
+        # Buy for self
+        if "buyer" in self.id and not self.isTrader() and not self.isRetire():
+            self.sendBuyRequest()
+            time.sleep(1)
+
+    @Pyro5.server.expose
+    def startBuyRequest(self):
+        """
+        Send a buy request without holding the caller, the trader answers the buyer with a call back to it
+        :return: nothing
+        """
+        self.executor.submit(self.sendBuyRequest)
 
     @Pyro5.server.expose
     def sendBuyRequest(self):
         """
-        Send buy request to a random trader
+        Send buy request to a random trader, retrying with another trader while traders are busy
+        :return: True if a trader accepted the request, False otherwise
+        """
+        if self.basket_size > 1:
+            return self.sendBasketRequest()
+        if self.pipeline_window > 1:
+            return self.sendPipelinedRequests()
+        if self.send_to_trader("trading_lookup", self.new_order(), self.product_name, self.product_count):
+            return True
+        print(datetime.datetime.now(), self.id, " gave up buying ", self.product_name, " after ", self.max_retries + 1, " attempts")
+        return False
+
+    @Pyro5.server.expose
+    def sendBasketRequest(self):
+        """
+        Send a basket of basket_size random products to a random trader in a single request
+        :return: True if a trader accepted the request, False otherwise
+        """
+        basket = [{"product": self.product_name, "count": self.product_count}]
+        for _ in range(self.basket_size - 1):
+            basket.append({"product": random.choice(self.products), "count": self.product_count})
+        if self.send_to_trader("trading_basket_lookup", self.new_order(), basket):
+            return True
+        print(datetime.datetime.now(), self.id, " gave up buying a basket of ", len(basket), " items after ", self.max_retries + 1, " attempts")
+        return False
+
+    @Pyro5.server.expose
+    def sendPipelinedRequests(self):
+        """
+        Fill the window of outstanding orders, then return the oldest completed order, waiting for one if none completed yet
+        Completed orders not returned yet keep their place in the window, so every call sends as many orders as it returns
+        :return: True if a trader accepted the completed order, False otherwise
+        """
+        while self.window_in_use() < self.pipeline_window:
+            self.submit_order()
+        if not self.finished_orders:
+            wait([order["future"] for order in list(self.outstanding.values())], return_when=FIRST_COMPLETED)
+        future = self.finished_orders.popleft()
+        if future.exception() is not None:
+            print(datetime.datetime.now(), self.id, " got no answer for order ", future.order_id, " within ", self.order_timeout, " seconds")
+            return False
+        return future.result()
+
+    def window_in_use(self):
+        """
+        Get the number of orders in the window, outstanding or completed but not returned by sendPipelinedRequests yet
+        :return: number of orders
+        """
+        self.outstanding_sem.acquire()
+        try:
+            return len(self.outstanding) + len(self.finished_orders)
+        finally:
+            self.outstanding_sem.release()
+
+    def submit_order(self):
+        """
+        Send an order without waiting for it, blocking while the window of outstanding orders is full
+        :return: future of the order, resolved with True if a trader accepted it and False if every trader rejected it
+        """
+        self.pipeline_slots.acquire()
+        self.product_sem.acquire()
+        product = self.product_name
+        self.product_name = self.products[random.randint(0, len(self.products)-1)]
+        self.product_sem.release()
+
+        self.outstanding_sem.acquire()
+        buyer_info = self.new_order()
+        future = Future()
+        future.order_id = buyer_info["order_id"]
+        self.outstanding[buyer_info["order_id"]] = {"product": product, "count": self.product_count, "future": future, "deadline": time.time() + self.order_timeout}
+        self.outstanding_sem.release()
+        self.order_executor.submit(self.send_order, buyer_info, product)
+        return future
+
+    def send_order(self, buyer_info, product):
+        """
+        Send a pipelined order to a trader and wait for its answer until the order's deadline
+        :param buyer_info: buyer information of the order
+        :param product: name of the product
         :return: nothing
         """
-        # select a random trader
-        trader = random.choice(self.trader)
-        with Pyro5.api.Proxy(self.neighbors[trader]) as neighbor:
-            neighbor.trading_lookup(self.tradingMessage(), self.product_name, self.product_count)
+        order = self.outstanding[buyer_info["order_id"]]
+        # an order the trader did not answer by its deadline timed out
+        accepted = None
+        try:
+            if not self.send_to_trader("trading_lookup", buyer_info, product, order["count"]):
+                print(datetime.datetime.now(), self.id, " gave up buying ", product, " after ", self.max_retries + 1, " attempts")
+                accepted = False
+            else:
+                # the trader answers through transaction, usually before the call returns
+                wait([order["future"]], timeout=max(0, order["deadline"] - time.time()))
+        except Exception as e:
+            print(datetime.datetime.now(), self.id, " could not send order ", buyer_info["order_id"], e)
+            accepted = False
+        finally:
+            if not order["future"].done():
+                self.complete_order(buyer_info["order_id"], accepted)
+            self.pipeline_slots.release()
+
+    def complete_order(self, order_id, accepted):
+        """
+        Resolve the future of an outstanding order and take it out of the window
+        :param order_id: id of the order
+        :param accepted: True if a trader accepted the order, False if it was rejected, None if it timed out
+        :return: True if the order was outstanding
+        """
+        self.outstanding_sem.acquire()
+        order = self.outstanding.pop(order_id, None)
+        if order is not None:
+            self.finished_orders.append(order["future"])
+        self.outstanding_sem.release()
+        if order is None:
+            return False
+        if accepted is None:
+            order["future"].set_exception(TimeoutError("order " + order_id + " timed out"))
+        else:
+            order["future"].set_result(accepted)
+        return True
+
+    def send_to_trader(self, method, *args):
+        """
+        Call a trader, retrying with another trader with exponential backoff while traders are busy
+        :param method: name of the trader method, which returns False when the trader rejects the request
+        :param args: arguments of the trader method
+        :return: True if a trader accepted the request, False otherwise
+        """
+        rejected_by = []
+        for attempt in range(self.max_retries + 1):
+            # select a random trader, preferring the ones that have not rejected this request
+            candidates = [trader for trader in self.trader if trader not in rejected_by]
+            trader = random.choice(candidates if candidates else self.trader)
+            if self.hedge_requests and len(self.trader) > 1:
+                accepted = self.call_hedged(trader, method, args)
+            else:
+                accepted = self.call_trader(trader, method, args)
+            # None means another trader already handled the same order
+            if accepted or accepted is None:
+                return True
+            rejected_by.append(trader)
+
+            if attempt < self.max_retries:
+                # exponential backoff with full jitter so that rejected buyers do not retry in lockstep
+                time.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+        return False
+
+    def new_order(self):
+        """
+        Build the buyer information of a new order, with an id unique to this order
+        :return: buyer information
+        """
+        self.order_counter += 1
+        buyer_info = self.tradingMessage()
+        buyer_info["order_id"] = self.id + "-" + self.order_epoch + "-" + str(self.order_counter)
+        return buyer_info
+
+    def call_trader(self, trader, method, args):
+        """
+        Call one trader
+        :param trader: id of the trader
+        :param method: name of the trader method
+        :param args: arguments of the trader method
+        :return: the answer of the trader, False if it could not be reached
+        """
+        try:
+            with self.transport.proxy(self.neighbors[trader]) as neighbor:
+                return getattr(neighbor, method)(*args)
+        except Pyro5.errors.CommunicationError as e:
+            print(datetime.datetime.now(), self.id, " could not reach trader ", trader, e)
+            return False
+
+    def call_hedged(self, trader, method, args):
+        """
+        Call a trader, and a second trader with the same order if the first is slower than usual
+        :param trader: id of the first trader
+        :param method: name of the trader method
+        :param args: arguments of the trader method, the buyer information first
+        :return: True if a trader sold the order, None if it was handled by a trader that did not answer first, False if it was rejected
+        """
+        start = time.time()
+        order_id = args[0]["order_id"]
+        calls = {self.executor.submit(self.call_trader, trader, method, args): trader}
+        # hedge after the 95th percentile of recent requests, so only the slowest 5% are sent twice
+        delay = np.percentile(self.request_latencies, 95) if len(self.request_latencies) >= 20 else self.hedge_delay
+        done, pending = wait(calls, timeout=delay)
+        # the first trader must claim the order at the warehouse once a copy exists, unless it already claimed it itself,
+        # it is asked without waiting, as a stalled trader answers it as late as the order
+        hedging = self.executor.submit(self.call_trader, trader, "hedge_order", (order_id,)) if pending else None
+
+        answer = False
+        while True:
+            if hedging in done:
+                done = done - {hedging}
+                if hedging.result():
+                    hedge = random.choice([other for other in self.trader if other != trader])
+                    print(datetime.datetime.now(), self.id, " hedging order ", order_id, " to trader ", hedge)
+                    hedged_args = (dict(args[0], hedged=True),) + tuple(args[1:])
+                    future = self.executor.submit(self.call_trader, hedge, method, hedged_args)
+                    calls[future] = hedge
+                    pending = pending | {future}
+                hedging = None
+            for future in done:
+                result = future.result()
+                if result:
+                    self.request_latencies.append(time.time() - start)
+                    # the first completion wins, the other trader drops the order if it has not claimed it yet
+                    for other in pending:
+                        self.executor.submit(self.call_trader, calls[other], "cancel_order", (order_id,))
+                    return True
+                if result is None:
+                    answer = None
+            if not pending:
+                return answer
+            done, pending = wait(pending | ({hedging} if hedging else set()), return_when=FIRST_COMPLETED)
+            pending = pending - {hedging}
 
     @Pyro5.server.expose
     def setTrader(self, traders):
@@ -259,6 +784,23 @@ class Peer(Process):
         """
         self.trader = traders
 
+        # Sellers restock on their own timer once they know the traders
+        if self.role == "seller" and not self.restocking:
+            self.restocking = True
+            self.background.submit(self.restock_loop)
+
+    def restock_loop(self):
+        """
+        Restock every product_time seconds for as long as the peer is a seller
+        :return: nothing
+        """
+        while self.role == "seller":
+            try:
+                self.startSellerTrading()
+            except Exception as e:
+                print(datetime.datetime.now(), "Exception in restock_loop", e)
+            time.sleep(self.product_time)
+
     @Pyro5.server.expose
     def election_message(self,message,neighbor):
         """
@@ -277,58 +819,11 @@ class Peer(Process):
             pass
 
         if message == "Election":
-            # Send back "OK" if either of recvOK or recvWon is true
-            if self.recvOK or self.recvWon:
-                with Pyro5.api.Proxy(self.neighbors[neighbor["id"]]) as neighbor_x:
-                    neighbor_x.adjustClockValue(self.clock)
-                    neighbor_x.election_message("OK",{"bully_id":self.bully_id,"id":self.id, "clock":self.clock})
-            else:
-                # Send back "OK" to previous neighbor and "Election" to next higher neighbor
-                with Pyro5.api.Proxy(self.neighbors[neighbor["id"]]) as neighbor_x:
-                    neighbor_x.adjustClockValue(self.clock)
-                    neighbor_x.election_message("OK",{"bully_id":self.bully_id,"id":self.id, "clock":self.clock})
-
-                # Find neighbors with higher bully id
-                neighbor_bully_ids = {}
-                for neighbor_id in self.neighbors:
-                    with Pyro5.api.Proxy(self.neighbors[neighbor_id]) as neighbor:
-                        neighbor_bully_ids[neighbor_id] = neighbor.get_bully_id()
-                        greater_bullies = [k for k, v in neighbor_bully_ids.items() if v > self.bully_id]
-
-                if len(greater_bullies) > 0:
-                    self.recvWon = False
-                    self.recvOK = False
-                    for ng in self.neighbors:
-                        if int(ng[-1]) > self.bully_id:
-                            if self.trader != [] and int(ng[-1]) == self.trader[0]["bully_id"]:
-                                continue
-                            else:
-                                with Pyro5.api.Proxy(self.neighbors[ng]) as neighbor:
-                                    if self.sendWon == False and (self.recvOK == False or self.recvWon == False):
-                                        # Message send event, increment clock value
-                                        self.clock_sem.acquire()
-                                        self.forwardClockValue()
-                                        self.clock_sem.release()
-
-                                        neighbor.election_message("Election",{"bully_id":self.bully_id,"id":self.id, "clock":self.clock})
-                    time.sleep(2)
-                    self.won_sem.acquire()
-                    # If no OK or Won messages received, declare self as winner
-                    if not self.recvOK and not self.recvWon:
-                        self.sendWon = True
-                        # Semaphore released in sendWonMessage
-                        self.sendWonMessage()
-                    else:
-                        self.won_sem.release()
-
-                # If no neighbors with higher bully id, become coordinator
-                else:
-                    self.won_sem.acquire()
-                    if self.sendWon == False:
-                        self.sendWon = True
-                        self.sendWonMessage()
-                    else:
-                        self.won_sem.release()
+            # Answer "OK" with the return value and carry the election on after returning, a multiplexed sender
+            # waiting on this call could take neither an "OK" sent back to it nor the "I Won" of a peer further up
+            if not (self.recvOK or self.recvWon):
+                self.executor.submit(self.carry_election, neighbor.get("greater"))
+            return {"bully_id":self.bully_id,"id":self.id, "clock":self.clock}
 
         # If OK message received, set recvOK to true
         elif message == "OK":
@@ -342,6 +837,71 @@ class Peer(Process):
             self.won_sem.release()
             self.trader.append(neighbor)
 
+    def carry_election(self, greater=None):
+        """
+        Send "Election" to the neighbors with a higher bully id, and become the coordinator if none of them answers
+        A peer carries one election at a time, the messages that arrive meanwhile are only answered
+        :param greater: ids of the neighbors with a higher bully id known to the sender, highest first, None to ask every neighbor
+        :return: nothing
+        """
+        if not self.election_sem.acquire(blocking=False):
+            return
+        try:
+            # Find neighbors with higher bully id
+            greater_bullies = self.greater_bullies() if greater is None else greater
+
+            if len(greater_bullies) > 0:
+                self.recvWon = False
+                self.recvOK = False
+                traders = self.trader_ids()
+                for ng in greater_bullies:
+                    if ng in traders:
+                        continue
+                    if self.sendWon == False and self.recvOK == False and self.recvWon == False:
+                        self.send_election(ng)
+                time.sleep(2)
+                self.won_sem.acquire()
+                # If no OK or Won messages received, declare self as winner
+                if not self.recvOK and not self.recvWon:
+                    self.sendWon = True
+                    # Semaphore released in sendWonMessage
+                    self.sendWonMessage()
+                else:
+                    self.won_sem.release()
+
+            # If no neighbors with higher bully id, become coordinator
+            else:
+                self.won_sem.acquire()
+                if self.sendWon == False:
+                    self.sendWon = True
+                    self.sendWonMessage()
+                else:
+                    self.won_sem.release()
+        finally:
+            self.election_sem.release()
+
+    def send_election(self, neighbor_id):
+        """
+        Send "Election" to a neighbor with a higher bully id, taking its "OK" answer
+        Neighbors are asked highest first and the first that answers takes the election over, so every neighbor ranked
+        above it is a trader or unreachable. It is told it has no higher neighbor left to ask instead of asking all of them again
+        :param neighbor_id: id of the neighbor
+        :return: True if the neighbor answered
+        """
+        # Message send event, increment clock value
+        self.clock_sem.acquire()
+        self.forwardClockValue()
+        self.clock_sem.release()
+        try:
+            with self.transport.proxy(self.neighbors[neighbor_id]) as neighbor:
+                answer = neighbor.election_message("Election", {"bully_id":self.bully_id,"id":self.id, "clock":self.clock, "greater": []})
+        except Pyro5.errors.CommunicationError as e:
+            print(datetime.datetime.now(), self.id, " could not send election to ", neighbor_id, e)
+            return False
+        if answer is not None:
+            self.election_message("OK", answer)
+        return answer is not None
+
     @Pyro5.server.expose
     def isTrader(self):
         """
@@ -378,30 +938,25 @@ class Peer(Process):
         # time.sleep(2)
         
         # Sets default values for recvOK, recvWon, sendWon before starting election
-        for x in self.neighbors:
-            with Pyro5.api.Proxy(self.neighbors[x]) as neighbor:
-                if not neighbor.isTrader() and not neighbor.isServer():
-                    neighbor.setDefaultFlags()
+        self.broadcast("setDefaultFlags", True)
         self.setDefaultFlags()
        
         # Find neighbors with higher bully id
-        neighbor_bully_ids = {}
-        for neighbor_id in self.neighbors:
-            with Pyro5.api.Proxy(self.neighbors[neighbor_id]) as neighbor:
-                neighbor_bully_ids[neighbor_id] = neighbor.get_bully_id()
-                greater_bullies = [k for k, v in neighbor_bully_ids.items() if v > self.bully_id]
+        greater_bullies = self.greater_bullies()
         if len(greater_bullies) > 0:
             self.recvWon = False
             self.recvOK = False
             for ng in greater_bullies:
-                with Pyro5.api.Proxy(self.neighbors[ng]) as neighbor:
-                    if self.recvOK == False and self.recvWon == False and neighbor.isTrader() == False:
-                        # Message send event, increment clock value
-                        self.clock_sem.acquire()
-                        self.forwardClockValue()
-                        self.clock_sem.release()
-
-                        neighbor.election_message("Election",{"bully_id":self.bully_id,"id":self.id, "clock":self.clock})
+                if self.recvOK or self.recvWon:
+                    break
+                try:
+                    with self.transport.proxy(self.neighbors[ng]) as neighbor:
+                        if neighbor.isTrader():
+                            continue
+                except Pyro5.errors.CommunicationError as e:
+                    print(datetime.datetime.now(), self.id, " could not reach ", ng, e)
+                    continue
+                self.send_election(ng)
             time.sleep(2)
             # if peer doesn't receive any OK or Won message, it is the coordinator
             self.won_sem.acquire()
@@ -418,12 +973,41 @@ class Peer(Process):
             # semaphore is released in the sendWonMessage method
             self.sendWonMessage()
 
+    def greater_bullies(self):
+        """
+        Find the neighbors with a higher bully id, ties broken by the higher peer index
+        :return: list of neighbor ids, highest bully id first
+        """
+        acks = self.broadcast("get_election_id")
+        own = [self.bully_id, self.index]
+        ranked = sorted(acks.items(), key=lambda ack: ack[1], reverse=True)
+        return [neighbor_id for neighbor_id, election_id in ranked if election_id > own]
+
+    @Pyro5.server.expose
+    def get_election_id(self):
+        """
+        Get the bully id of the peer and its index, which orders peers that drew the same bully id
+        :return: bully id, peer index
+        """
+        return [self.bully_id, self.index]
+
+    def trader_ids(self):
+        """
+        Get the ids of the traders
+        :return: list of trader ids
+        """
+        # a peer that won an election lists itself as a dictionary until setTrader runs
+        return [trader["id"] if isinstance(trader, dict) else trader for trader in self.trader]
+
     @Pyro5.server.expose
-    def setDefaultFlags(self):
+    def setDefaultFlags(self, skip_traders=False):
         """
         Set default values for recvOK, recvWon, sendWon
+        :param skip_traders: boolean indicating if traders and the server keep their flags
         :return: nothing
         """
+        if skip_traders and (self.isTrader() or self.isServer()):
+            return
         self.recvOK = False
         self.recvWon = False
         self.sendWon = False
@@ -437,6 +1021,12 @@ class Peer(Process):
         """
         print(datetime.datetime.now(),"Trading initiated by ",self.id)
 
+        if self.role == "trader" and len(self.trader) < 2:
+            # A single trader has no other trader to ping, and nobody would take over if it failed
+            with open("trader_" + self.id + ".txt","a+") as f:
+                print(datetime.datetime.now(), "No other trader to send heartbeats to", file=f)
+            return
+
         if self.role == "trader":
             other_trader = ""
             if self.id == self.trader[0]:
@@ -444,8 +1034,8 @@ class Peer(Process):
             else:
                 other_trader = self.trader[0]
             if fail_one == 1:
-                self.executor.submit(self.retire_with_time,self.heartbeat_timeout)
-            self.executor.submit(self.ping_message, other_trader)
+                self.background.submit(self.retire_with_time,self.heartbeat_timeout)
+            self.background.submit(self.ping_message, other_trader)
 
     @Pyro5.server.expose
     def retire_with_time(self,ttl):
@@ -458,6 +1048,9 @@ class Peer(Process):
         time.sleep(ttl)
         with open("trader_" + self.id + ".txt","a+") as f:
             print(datetime.datetime.now(), self.id, " is retiring from the market", file=f)
+        # Hand the sales written behind to the warehouse before leaving
+        if self.write_behind_interval:
+            self.flush_sales()
         self.role = "retire"
     
     @Pyro5.server.expose
@@ -485,21 +1078,38 @@ class Peer(Process):
             
             with open("trader_" + self.id + ".txt","a+") as f:
                 print(datetime.datetime.now(), "Found trasactions file for other trader: ", old_index_file, file=f)
-            for neighbor_name in self.neighbors:
-                with Pyro5.api.Proxy(self.neighbors[neighbor_name]) as neighbor_1:
-                    neighbor_1.removeTrader(neighbor_id)
+            self.broadcast("removeTrader", neighbor_id)
             self.removeTrader(neighbor_id)
             
             with open("trader_" + self.id + ".txt","a+") as f:
                 print(datetime.datetime.now(), "Removed other trader from neighbors", file=f)
             
-            with open(old_index_file,"w") as transact:
-                with open("trader_" + self.id + ".txt","a+") as f:
-                    print(datetime.datetime.now(), "Entering pending transactions of other trader", file=f)
-                pending_req = json.load(transact)
-                if not pending_req:
-                    for req in pending_req:
-                        k,v  = req.items()[0]
+            # Orders the other trader claimed are not sold again when their buyers retry them here
+            self.seed_orders(["orders_trader_" + neighbor_id + ".jsonl"])
+            if os.path.exists(old_index_file):
+                with open(old_index_file) as transact:
+                    with open("trader_" + self.id + ".txt","a+") as f:
+                        print(datetime.datetime.now(), "Entering pending transactions of other trader", file=f)
+                    pending_req = json.load(transact)
+                # Flush the sales the other trader had not written behind to the warehouse yet,
+                # its batches keep their ids so the warehouse does not apply them twice
+                batch = pending_req.pop("flushing_sales", None)
+                pending = pending_req.pop("pending_sales", None)
+                # Its leases are settled with every sale journaled and returned, the warehouse skips sales it has settled
+                lease_sales = pending_req.pop("lease_sales", {})
+                batches = [b for b in [batch, pending] if b is not None]
+                if batches or lease_sales:
+                    with self.transport.proxy(self.neighbors["server9"]) as server:
+                        for b in batches:
+                            server.update_warehouse_batch(list(b["sales"].values()), b["id"])
+                        if lease_sales:
+                            server.settle_leases_with_warehouse([dict(sale, renew=False) for sale in lease_sales.values()], 0)
+                    with open(old_index_file,"w") as transact:
+                        json.dump(pending_req,transact)
+                    for b in batches:
+                        self.acknowledge_flush(b["id"])
+                    with open("trader_" + self.id + ".txt","a+") as f:
+                        print(datetime.datetime.now(), "Flushed ", sum(len(b["sales"]) for b in batches), " sellers' sales and settled ", len(lease_sales), " leases of other trader", file=f)
         return
         
 
@@ -536,7 +1146,7 @@ class Peer(Process):
         :return: nothing
         """
         
-        with Pyro5.api.Proxy(self.neighbors[neighbor_id]) as neighbor:
+        with self.transport.proxy(self.neighbors[neighbor_id]) as neighbor:
             x = neighbor.ping_reply(self.id)
         with open("trader_" + self.id + ".txt","a+") as f:
             print(datetime.datetime.now(), "Ping reply from ", neighbor_id, " is ", x, file=f)
@@ -545,18 +1155,38 @@ class Peer(Process):
     @Pyro5.server.expose
     def startSellerTrading(self):
         """
-        Start trading as a seller
+        Restock as a seller, registering only the units sold since the last restock
         :return: nothing
         """
         print(datetime.datetime.now(),"trading entered by ",self.id)
 
         if self.role == "seller":
-            # Register seller products with the coordinator
-            print(datetime.datetime.now(),self.id," is registering its market for ",self.product_name)
-            print(datetime.datetime.now(),self.id," traders = ",self.trader)
-            with Pyro5.api.Proxy(self.neighbors[random.choice(self.trader)]) as neighbor:
-                if not neighbor.isRetire():
-                    neighbor.register_products({"seller":{"bully_id":self.bully_id,"id":self.id},"product_name": self.product_name,"product_count":self.product_count})
+            self.stock_sem.acquire()
+            delta = self.n - self.stock
+            self.stock_sem.release()
+            # Nothing was sold since the last restock, so there is nothing to register
+            if delta <= 0:
+                return
+
+            # Register with the same trader every time so that its restocks batch together
+            if self.restock_trader not in self.trader:
+                self.restock_trader = random.choice(self.trader)
+            print(datetime.datetime.now(),self.id," is restocking ",delta," ",self.product_name," with trader ",self.restock_trader)
+            try:
+                with self.transport.proxy(self.neighbors[self.restock_trader]) as neighbor:
+                    if neighbor.isRetire():
+                        # Keep the delta for the next restock, which picks another trader
+                        self.restock_trader = None
+                        return
+                    neighbor.register_products({"seller":{"bully_id":self.bully_id,"id":self.id},"product_name": self.product_name,"product_count":delta})
+            except Pyro5.errors.CommunicationError:
+                # Without the heartbeat nobody removes a dead trader, so the next restock goes to the next trader with the delta kept
+                self.restock_trader = self.trader[(self.trader.index(self.restock_trader) + 1) % len(self.trader)]
+                print(datetime.datetime.now(),self.id," could not reach its trader, restocking with ",self.restock_trader," next")
+                return
+            self.stock_sem.acquire()
+            self.stock += delta
+            self.stock_sem.release()
         
         elif self.role == "trader":
             pass
@@ -574,20 +1204,22 @@ class Peer(Process):
         self.prev_role = self.role
         self.role = "trader"
         self.load_state()
+        self.seed_orders(glob.glob("orders_trader_*.jsonl"))
         self.won_sem.release()
-
-        # Send Won message to all neighbors
-        for neighbor_name in self.neighbors:
-            with open("trader_" + self.id + ".txt","a+") as f:
-                print(datetime.datetime.now(), "sending won message to neighbor: ",neighbor_name, file = f)
-                with Pyro5.api.Proxy(self.neighbors[neighbor_name]) as neighbor:
-
-                    # Message send event, increment clock value
-                    self.clock_sem.acquire()
-                    self.forwardClockValue()
-                    self.clock_sem.release()
-
-                    neighbor.election_message("I Won",{"bully_id":self.bully_id,"id":self.id, "clock":self.clock})
+        if self.reservation_ttl:
+            self.background.submit(self.lease_loop)
+        if self.write_behind_interval:
+            self.background.submit(self.flush_loop)
+        if self.gossip_interval:
+            self.background.submit(self.gossip_loop)
+
+        # Send Won message to all neighbors at once, a single multicast send event for the clock
+        with open("trader_" + self.id + ".txt","a+") as f:
+            print(datetime.datetime.now(), "sending won message to neighbors: ",", ".join(self.neighbors), file = f)
+        self.clock_sem.acquire()
+        self.forwardClockValue()
+        self.clock_sem.release()
+        self.broadcast("election_message", "I Won", {"bully_id":self.bully_id,"id":self.id, "clock":self.clock})
 
         with open("trader_" + self.id + ".txt","a+") as f:
             print(datetime.datetime.now(), "coordinator notified all neighbors.", file = f)
@@ -619,7 +1251,7 @@ class Peer(Process):
     @Pyro5.server.expose
     def addBuyer(self, buyer_id):
         """
-        Add buyer to the list of buyers for the seller
+        Add buyer to the most recent buyers of the seller
         :param buyer_id: buyer id
         :return: nothing
         """
@@ -632,7 +1264,7 @@ class Peer(Process):
         :param other: clock value of the sender
         :return: nothing
         """
-        self.clock = max(int(self.clock), int(other)) + 1 + int(self.id[-1]) / 10.0
+        self.clock = max(self.clock, int(other)) + 1
 
     @Pyro5.server.expose
     def forwardClockValue(self):
@@ -646,9 +1278,9 @@ class Peer(Process):
     def getClock(self):
         """
         Get clock value of the peer
-        :return: clock value
+        :return: clock value and peer index, compared in that order so that equal clocks are ordered for any number of peers
         """
-        return self.clock
+        return [self.clock, self.index]
 
     @Pyro5.server.expose
     def update_warehouse(self, seller_peer_id, item_count, buyer_info, seller):
@@ -658,18 +1290,77 @@ class Peer(Process):
         :param item_count: item count
         :param buyer_info: buyer information
         :param seller: seller
+        :return: the warehouse version and the seller information of the seller after the sale
         """
+        self.record("update_warehouse", seller_peer_id, item_count, buyer_info, seller)
         
-        data = {}
-        with open("seller_information.json") as sell:
-            data = json.load(sell)
-        with open("seller_information.json", "w") as sell:
+        self.storage_semaphore.acquire()
+        try:
+            data = self.load_warehouse([seller_peer_id])
             data[seller_peer_id]["product_count"] -= item_count
-            data[seller_peer_id]["buyer_list"].append(buyer_info["id"])
-            json.dump(data,sell)
+            self.save_warehouse(data, [seller_peer_id])
+            self.record_buyers(seller_peer_id, [buyer_info["id"]])
+            version = self.warehouse_version
+        finally:
+            self.storage_semaphore.release()
 
-        with open("server_outputs.txt") as f:
+        with open("server_outputs.txt", "a+") as f:
             print(datetime.datetime.now(), "Recorded transaction for purchase of ", data[seller_peer_id]["product_name"], " in warehouse", file = f)
+        return version, {seller_peer_id: data[seller_peer_id]}
+
+    @Pyro5.server.expose
+    def update_warehouse_batch(self, sales, batch_id=None):
+        """
+        Update warehouse information for several sales with a single write
+        :param sales: list of seller peer id, item count and buyer ids
+        :param batch_id: id of the batch, None to always apply it. A batch sent again with the same id, possibly with
+            more sales added since, has only the sales not applied before applied
+        :return: the warehouse version and the seller information of every seller after the sales
+        """
+        self.record("update_warehouse_batch", sales, batch_id)
+        self.storage_semaphore.acquire()
+        try:
+            data = self.load_warehouse([sale["seller"] for sale in sales])
+            applied = dict(self.load_batches().get(batch_id, {})) if batch_id is not None else {}
+            buyers = {}
+            changed = []
+            for sale in sales:
+                count, n_buyers = applied.get(sale["seller"], (0, 0))
+                if sale["count"] > count:
+                    data[sale["seller"]]["product_count"] -= sale["count"] - count
+                    changed.append(sale["seller"])
+                buyers[sale["seller"]] = sale["buyers"][n_buyers:]
+                applied[sale["seller"]] = (max(count, sale["count"]), max(n_buyers, len(sale["buyers"])))
+            if changed:
+                self.save_warehouse(data, changed)
+            for seller_peer_id, buyer_ids in buyers.items():
+                self.record_buyers(seller_peer_id, buyer_ids)
+            if batch_id is not None:
+                # kept until the trader acknowledges the batch, however many orders and batches come in between
+                self.applied_batches[batch_id] = applied
+                self.save_batches()
+            version = self.warehouse_version
+        finally:
+            self.storage_semaphore.release()
+
+        with open("server_outputs.txt", "a+") as f:
+            print(datetime.datetime.now(), "Recorded ", len(sales), " sales in warehouse", file = f)
+        return version, {sale["seller"]: data[sale["seller"]] for sale in sales}
+
+    @Pyro5.server.expose
+    def acknowledge_batch(self, batch_id):
+        """
+        Forget a write-behind batch its trader has taken out of its transaction log, so it is never sent again
+        :param batch_id: id of the batch
+        :return: nothing
+        """
+        self.record("acknowledge_batch", batch_id)
+        self.storage_semaphore.acquire()
+        try:
+            if self.load_batches().pop(batch_id, None) is not None:
+                self.save_batches()
+        finally:
+            self.storage_semaphore.release()
 
     @Pyro5.server.expose
     def check_seller_in_cache(self, item, item_count):
@@ -681,158 +1372,953 @@ class Peer(Process):
         """
         with open ("trader_" + self.id + ".txt","a+") as f:
             print(datetime.datetime.now(), "Checking if item ", item, " is in cache", file = f)
+        if self.inventory_format == "mmap" and self.open_inventory() is not None:
+            # Read the current stock in place from the warehouse's mapping
+            found_seller, found = self.inventory.find_seller(item, item_count, self.id, self.unflushed_counts())
+            if found_seller:
+                self.seller_information[found_seller["seller"]["id"]] = found_seller
+            return found_seller, found
         sellers = []
         found_seller = ''
         found = False
-        for peer_id in self.seller_information.keys():
-            if self.seller_information[peer_id]["product_name"] == item and self.id != peer_id:
-                sellers.append(self.seller_information[peer_id])
+        # A bounded cache only holds some products, and gives the sellers of the item alone
+        cached = self.cached_sellers(item) if isinstance(self.seller_information, SellerCache) else self.seller_information
+        for peer_id in list(cached.keys()):
+            if cached[peer_id]["product_name"] == item and self.id != peer_id:
+                sellers.append(cached[peer_id])
 
         # If sellers are found, send a request
         if len(sellers)>0:
             found = True
             # Iterate over all sellers to find potential matches to the buyer requests
             for sl in sellers:
-                sl_id = sl["seller"]["id"]
-                if self.seller_information[sl_id]["product_count"] < item_count:
+                if sl["product_count"] < item_count:
                     continue
                 else:
                     found_seller = sl
                     break
         return found_seller, found
 
-    @Pyro5.server.expose
-    def trading_lookup(self,buyer_info,item,item_count):
+    def cached_sellers(self, item):
         """
-        Match sellers to buyers by product name
-        :param buyer_info: buyer information
-        :param item: product name
-        :param item_count number of items to buy
-        :return: nothing
+        Get the sellers of a product from the bounded seller cache, reading them from the warehouse on a miss
+        :param item: name of the item
+        :return: dictionary of seller id to seller information
         """
-        self.fail_sem.acquire()
-
-        if self.role == "trader":
-            with open("trader_" + self.id + ".txt","a+") as f:
-                print(datetime.datetime.now(),"Received request from buyer ",buyer_info["id"], "for product ",item,"("+str(item_count)+")", file = f)
-            transactions_file = "transactions_trader_"+self.id+".json"
-            # Save current incomplete transaction to a file for recovery
-            tlog = {"buyer":buyer_info["id"],"seller":"_","product":item,"product_count":item_count,"completed":False}
-            self.put_log(tlog,transactions_file,False,True)
+        sellers = self.seller_information.lookup(item)
+        if sellers is None:
+            # Misses on the same product share one read of the warehouse
+            sellers = self.single_flight(item, lambda: self.fill_product(item))
+        return sellers
 
-            # Find sellers with the product
-            sl = ''
-            found = False
+    def fill_product(self, item):
+        """
+        Read the sellers of a product from the warehouse into the bounded seller cache, evicting other products when it is full
+        :param item: name of the item
+        :return: dictionary of seller id to seller information
+        """
+        try:
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                version, sellers = server.get_product_sellers([item])
+        except Pyro5.errors.CommunicationError as e:
+            print(datetime.datetime.now(), self.id, "could not read the sellers of", item, e)
+            return {}
 
-            if self.with_cache:
-                # Check if the seller is in the cache
-                sl, found = self.check_seller_in_cache(item,item_count)
+        self.storage_semaphore.acquire()
+        try:
+            self.transaction_semaphore.acquire()
+            try:
+                # Sales not written behind yet are missing from the warehouse's counts
+                for seller_peer_id, seller_info in sellers.items():
+                    seller_info["product_count"] -= self.unflushed_count(seller_peer_id)
+                    self.seller_versions[seller_peer_id] = version
+                for seller_peer_id in self.seller_information.put_product(item, sellers):
+                    self.seller_versions.pop(seller_peer_id, None)
+            finally:
+                self.transaction_semaphore.release()
+            # Changes after the first fill are caught up incrementally
+            if self.cache_version is None:
+                self.cache_version = version
+        finally:
+            self.storage_semaphore.release()
+        with open("trader_" + self.id + ".txt","a+") as f:
+            print(datetime.datetime.now(), "Filled cache with ", len(sellers), " sellers of ", item, " at version ", version, file = f)
+        return sellers
 
-            # If not found in cache, load state and check again, avoids underselling
-            if not sl or not found:
-                with open("trader_" + self.id + ".txt","a+") as f:
-                    print(datetime.datetime.now(),"Item not found in cache, loading from warehouse", file = f)
-                self.load_state()
-                sl, found = self.check_seller_in_cache(item,item_count)
-            else:
-                with open("trader_" + self.id + ".txt","a+") as f:
-                    print(datetime.datetime.now(),"Item found in cache", file = f)
-            
-            if found:
-                if not sl:
-                    with open("server_outputs.txt", "a+") as f:
-                        print(datetime.datetime.now(), "No seller found for ", item, file = f)
-                    # When no seller can fulfill the demand, simply reject the buyer request from trader
-                    with Pyro5.api.Proxy(self.neighbors[buyer_info["id"]]) as neighbor:
-                            neighbor.transaction(item,buyer_info["id"],"",self.id,False,True,item_count)
-                            self.put_log(tlog,transactions_file,True,False)
-                            self.fail_sem.release()
-                            with open("trader_" + self.id + ".txt","a+") as f:
-                                print(datetime.datetime.now(),"Informed ",buyer_info["id"]," that no seller can fulfill the demand for ", item , file = f)
-                            return
-                else:
-                    with open("server_outputs.txt","a+") as f:
-                        print(datetime.datetime.now(),"Found ", item, " in warehouse. Informing trader ", self.id , file = f)
-                    seller = sl
-                    seller_peer_id = seller["seller"]["id"]
-                    print("seller with peer id ", seller_peer_id, " chosen for transactions")
-                    # Add seller to the transaction log along with buyers interested in buying from it
-                    # Update the trader's seller information to update the selected seller's transaction
-                    # and save it to saved transactions file
-                    try:
-                        self.seller_information[seller_peer_id]["product_count"] -= item_count
-                        self.seller_information[seller_peer_id]["buyer_list"].append(buyer_info["id"])
-                        with Pyro5.api.Proxy(self.neighbors[seller_peer_id]) as seller_add:
-                            seller_add.addBuyer(buyer_info["id"])
-
-                        # Update transaction in warehouse
-                        with Pyro5.api.Proxy(self.neighbors["server9"]) as server:
-                            server.update_warehouse(seller_peer_id, item_count, buyer_info, seller)
-                        
-                        tlog = {"buyer":buyer_info["id"],"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":False}
-                        self.put_log(tlog,transactions_file,False,True)
-                    except Exception as e:
-                        print("[DEBUG] error in updating transaction information: ", e)
-                    
-                    # Choose a buyer and decrement the product count
-                    with Pyro5.api.Proxy(self.neighbors[seller_peer_id]) as neighbor:
-                            neighbor.transaction(item,buyer_info["id"], seller_peer_id,self.id,False,False,item_count)
+    @Pyro5.server.expose
+    def get_seller_cache_stats(self):
+        """
+        Get the counters of the trader's bounded seller cache
+        :return: dictionary of capacity, policy, cached sellers and products, hits, misses and evictions, None without a bounded cache
+        """
+        if isinstance(self.seller_information, SellerCache):
+            return self.seller_information.stats()
+        return None
 
-                    tlog = {"buyer":buyer_info["id"],"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":True}
-                    self.put_log(tlog,transactions_file,True,True)
+    def check_product_view(self, item, item_count, split):
+        """
+        Ask the warehouse's running totals of a product whether an order can be filled, without reading the warehouse
+        The totals leave out the sales not written behind yet, so they only overstate what is left to sell
+        :param item: name of the item
+        :param item_count: count of the item
+        :param split: boolean indicating if the order may be split across sellers
+        :return: None if the order may be filled, otherwise True if the product has sellers and False if it has none
+        """
+        try:
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                view = server.get_product_view(item)
+        except Pyro5.errors.CommunicationError as e:
+            print(datetime.datetime.now(), self.id, "could not read the view of", item, e)
+            return None
+        if view is None or view["sellers"] == 0:
+            return False
+        most = view["top_sellers"][0]["product_count"] if view["top_sellers"] else 0
+        if most >= item_count or (split and view["total_stock"] >= item_count):
+            return None
+        return True
 
-                    # Let buyer know that the transaction is complete
-                    with Pyro5.api.Proxy(self.neighbors[buyer_info["id"]]) as neighbor:
-                            neighbor.transaction(item,buyer_info["id"], seller_peer_id,self.id,True,False,item_count)
-                    with open("trader_" + self.id + ".txt","a+") as f:
-                        print(datetime.datetime.now(), "Informed ",buyer_info["id"]," that transaction is complete for ", item , file = f)
-            else:
-                # When no seller registered for the product, simply reject the buyer request from trader
-                with open("server_outputs.txt", "a+") as f:
-                    print(datetime.datetime.now(), "No seller found for ", item, file = f)
-                with Pyro5.api.Proxy(self.neighbors[buyer_info["id"]]) as neighbor:
-                        neighbor.transaction(item,buyer_info["id"],"",self.id,False,False,item_count)
-                        self.put_log(tlog,transactions_file,True,False)
-                with open("trader_" + self.id + ".txt","a+") as f:
-                    print(datetime.datetime.now(),"Informed ",buyer_info["id"]," that no seller can fulfill the demand for ", item , file = f)
+    def is_unavailable(self, item):
+        """
+        Check the negative cache for a product
+        :param item: name of the item
+        :return: True if the product is known to have no seller
+        """
+        expires = self.unavailable_products.get(item)
+        return expires is not None and expires > time.time()
 
-        self.fail_sem.release()
+    def mark_unavailable(self, item, version):
+        """
+        Remember that a product has no seller, unless it was restocked since the lookup started
+        :param item: name of the item
+        :param version: restock version of the item when the lookup started
+        :return: nothing
+        """
+        if self.negative_cache_ttl and self.product_versions.get(item, 0) == version:
+            self.unavailable_products[item] = time.time() + self.negative_cache_ttl
 
     @Pyro5.server.expose
-    def trading_unresolved_lookup(self,tlog):
+    def products_restocked(self, products):
         """
-        Match sellers to buyers by product name
-        :param buyer_info: buyer information
-        :param item: product name
-        :param item_count number of items to buy
+        Invalidate the negative cache for products that were just added to the warehouse
+        :param products: list of product names
         :return: nothing
         """
-        if self.role == "trader":
-            item = tlog["product"]
-            item_count = tlog["product_count"]
-            buyer_info_id = tlog["buyer"]
-
-            transactions_file = "transactions_trader_"+self.id+".json"
-            if tlog["seller"] == "_" and not tlog["completed"]:
-                
-                self.put_log(tlog,transactions_file,False,True)
+        for item in products:
+            self.product_versions[item] = self.product_versions.get(item, 0) + 1
+            self.unavailable_products.pop(item, None)
 
-
-                # Find sellers with the product
+    def sell_from_reservation(self, buyer_id, item, item_count):
+        """
+        Take units from a lease held by the trader, reserving a new block from the warehouse when none has enough
+        :param buyer_id: id of the buyer
+        :param item: name of the item
+        :param item_count: count of the item
+        :return: seller, found
+        """
+        # Stop selling from a lease half its ttl before it expires, so a settlement renews or returns it in time
+        deadline = time.time() + self.reservation_ttl / 2.0
+        self.lease_sem.acquire()
+        try:
+            for lease in self.leases.values():
+                if lease["product_name"] == item and lease["units"] >= item_count and lease["expires"] > deadline:
+                    self.sell_from_lease(lease, buyer_id, item_count)
+                    with open("trader_" + self.id + ".txt","a+") as f:
+                        print(datetime.datetime.now(),"Item sold from lease ", lease["lease_id"], file = f)
+                    return {"seller": lease["seller"], "product_name": item}, True
+        finally:
+            self.lease_sem.release()
+
+        with open("trader_" + self.id + ".txt","a+") as f:
+            print(datetime.datetime.now(),"No lease for item, reserving from warehouse", file = f)
+        # The warehouse answers with the ttl of the lease, counted from before the request on this peer's clock
+        # so the lease never outlives the warehouse's copy
+        requested = time.time()
+        with self.transport.proxy(self.neighbors["server9"]) as server:
+            lease, found = server.reserve_units(self.id, item, item_count, max(item_count, self.reservation_block), self.reservation_ttl)
+        if not lease:
+            return '', found
+
+        lease["expires"] = requested + lease.pop("ttl")
+        lease["settled"] = 0
+        self.lease_sem.acquire()
+        try:
+            self.leases[lease["lease_id"]] = lease
+            self.sell_from_lease(lease, buyer_id, item_count)
+        finally:
+            self.lease_sem.release()
+        return {"seller": lease["seller"], "product_name": item}, True
+
+    def sell_from_lease(self, lease, buyer_id, item_count):
+        """
+        Take units from a lease and journal the sale in the transaction log, so another trader can settle it
+        The journal keeps every sale of the lease until the warehouse acknowledged its last settlement
+        Must be called with lease_sem held
+        :param lease: the lease
+        :param buyer_id: id of the buyer
+        :param item_count: count of the item
+        :return: nothing
+        """
+        lease["units"] -= item_count
+        self.transaction_semaphore.acquire()
+        try:
+            lease_sales = self.transaction_information.setdefault("lease_sales", {})
+            sale = lease_sales.setdefault(lease["lease_id"], {"lease_id": lease["lease_id"], "seller": lease["seller"]["id"], "sold": 0, "buyers": []})
+            sale["sold"] += item_count
+            sale["buyers"].append(buyer_id)
+        finally:
+            self.transaction_semaphore.release()
+
+    def lease_loop(self):
+        """
+        Settle the trader's leases with the warehouse in the background, renewing the ones still selling
+        :return: nothing
+        """
+        while self.role == "trader":
+            time.sleep(self.reservation_ttl / 4.0)
+            self.settle_leases(self.role == "trader")
+
+    def settle_leases(self, renew):
+        """
+        Report the units sold from every lease in the journal and renew or return it
+        Settlements carry every sale of a lease so far, the warehouse applies the ones it has not seen
+        :param renew: boolean indicating if leases with sales since the last settlement should be renewed
+        :return: nothing
+        """
+        transactions_file = "transactions_trader_" + self.id + ".json"
+        self.lease_sem.acquire()
+        try:
+            self.transaction_semaphore.acquire()
+            try:
+                settlements = [dict(sale, buyers=list(sale["buyers"])) for sale in self.transaction_information.get("lease_sales", {}).values()]
+            finally:
+                self.transaction_semaphore.release()
+            for settlement in settlements:
+                lease = self.leases.get(settlement["lease_id"])
+                settlement["renew"] = renew and lease is not None and lease["units"] > 0 and settlement["sold"] > lease["settled"]
+                if lease is not None and not settlement["renew"]:
+                    del self.leases[settlement["lease_id"]]
+        finally:
+            self.lease_sem.release()
+        if not settlements:
+            return
+
+        sent = time.time()
+        try:
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                ttls = server.settle_leases_with_warehouse(settlements, self.reservation_ttl)
+        except Exception as e:
+            print(datetime.datetime.now(), "Exception in settle_leases", e)
+            return
+
+        self.lease_sem.acquire()
+        try:
+            self.transaction_semaphore.acquire()
+            try:
+                lease_sales = self.transaction_information.get("lease_sales", {})
+                for settlement in settlements:
+                    lease = self.leases.get(settlement["lease_id"])
+                    if lease is not None and ttls.get(settlement["lease_id"]):
+                        lease["expires"] = sent + ttls[settlement["lease_id"]]
+                        lease["settled"] = settlement["sold"]
+                        continue
+                    # The lease was returned or the warehouse already expired it, its units are back in stock
+                    # Sales made while the settlement was in flight are settled late by the next one
+                    self.leases.pop(settlement["lease_id"], None)
+                    sale = lease_sales.get(settlement["lease_id"])
+                    if sale is not None and sale["sold"] == settlement["sold"]:
+                        del lease_sales[settlement["lease_id"]]
+                with open(transactions_file,"w") as transact:
+                    json.dump(self.transaction_information,transact)
+            finally:
+                self.transaction_semaphore.release()
+        finally:
+            self.lease_sem.release()
+
+    def split_order(self, item, item_count):
+        """
+        Split an order across sellers whose combined stock covers it
+        :param item: name of the item
+        :param item_count: count of the item
+        :return: list of seller information and count to take from the seller, empty if the stock is insufficient
+        """
+        if self.inventory_format == "mmap" and self.open_inventory() is not None:
+            sellers = self.inventory.sellers_of(item, self.unflushed_counts())
+        else:
+            sellers = list(self.seller_information.values())
+        # Sellers are kept in registration order, which is oldest stock first
+        sellers = [sl for sl in sellers if sl["product_name"] == item and sl["seller"]["id"] != self.id and sl["product_count"] > 0]
+        if self.split_policy == "fewest":
+            # Taking the largest stocks first needs the fewest sellers
+            sellers.sort(key=lambda sl: sl["product_count"], reverse=True)
+
+        parts = []
+        remaining = item_count
+        for sl in sellers:
+            count = min(sl["product_count"], remaining)
+            parts.append({"seller": sl["seller"], "count": count})
+            remaining -= count
+            if remaining == 0:
+                return parts
+        return []
+
+    def fill_split_order(self, buyer_info, item, item_count, parts, transactions_file):
+        """
+        Sell an order from several sellers, recording the split in the transaction log and the warehouse at once
+        Without write-behind the warehouse takes every part or none, so two traders cannot sell the same units
+        :param buyer_info: buyer information
+        :param item: name of the item
+        :param item_count: count of the item
+        :param parts: list of seller information and count to take from the seller
+        :param transactions_file: transaction file of the trader
+        :return: True if the order was sold, False if a seller no longer had its part or could not be told about the buyer
+        """
+        seller_ids = [part["seller"]["id"] for part in parts]
+        with open("trader_" + self.id + ".txt","a+") as f:
+            print(datetime.datetime.now(),"Splitting ", item, "("+str(item_count)+") across sellers ", seller_ids, file = f)
+        tlog = {"buyer":buyer_info["id"],"order":buyer_info.get("order_id"),"seller":seller_ids,"split":parts,"product":item,"product_count":item_count,"completed":False}
+        self.put_log(tlog,transactions_file,False,True)
+
+        if not self.write_behind_interval:
+            # The warehouse checks every part against its own stock before the buyer is answered
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                taken, version, changes = server.fulfill_split(self.id, buyer_info["id"], parts)
+            self.share_sellers(version, changes)
+            if not taken:
+                self.put_log(tlog,transactions_file,True,False)
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Sellers ", seller_ids, " no longer have the parts of the split", file = f)
+                return False
+
+        try:
+            for part in parts:
+                seller_peer_id = part["seller"]["id"]
+                with self.transport.proxy(self.neighbors[seller_peer_id]) as seller_add:
+                    seller_add.addBuyer(buyer_info["id"])
+        except Exception as e:
+            with open("trader_" + self.id + ".txt","a+") as f:
+                print(datetime.datetime.now(),"Could not tell sellers ", seller_ids, " about ", buyer_info["id"], ", giving the split up: ", e, file = f)
+            if not self.write_behind_interval:
+                # The warehouse took the parts, they go back to its stock
+                with self.transport.proxy(self.neighbors["server9"]) as server:
+                    version, changes = server.register_batch_with_warehouse([{"seller": part["seller"], "product_name": item, "product_count": part["count"]} for part in parts])
+                self.share_sellers(version, changes)
+            self.put_log(tlog,transactions_file,True,False)
+            return False
+
+        if self.write_behind_interval:
+            # The parts are written behind with the other sales, the warehouse does not see them before those
+            for part in parts:
+                if part["seller"]["id"] in self.seller_information:
+                    self.seller_information[part["seller"]["id"]]["product_count"] -= part["count"]
+                self.queue_sale(part["seller"]["id"], part["count"], buyer_info["id"])
+
+        for part in parts:
+            with self.transport.proxy(self.neighbors[part["seller"]["id"]]) as neighbor:
+                neighbor.transaction(item,buyer_info["id"],part["seller"]["id"],self.id,False,False,part["count"])
+
+        tlog["completed"] = True
+        self.put_log(tlog,transactions_file,True,True)
+
+        with self.transport.proxy(self.neighbors[buyer_info["id"]]) as neighbor:
+            neighbor.transaction(item,buyer_info["id"],",".join(seller_ids),self.id,True,False,item_count,buyer_info.get("order_id"))
+        with open("trader_" + self.id + ".txt","a+") as f:
+            print(datetime.datetime.now(), "Informed ",buyer_info["id"]," that transaction is complete for ", item , file = f)
+        return True
+
+    def queue_sale(self, seller_peer_id, item_count, buyer_id):
+        """
+        Add a sale to the ones written behind to the warehouse, flushing them once write_behind_trades are waiting
+        The sale is persisted with the next transaction log entry, in a batch whose id is given when it is opened,
+        so a batch sent by a trader taking over is not applied twice either
+        :param seller_peer_id: id of the seller
+        :param item_count: count of the item
+        :param buyer_id: id of the buyer
+        :return: nothing
+        """
+        self.transaction_semaphore.acquire()
+        try:
+            batch = self.transaction_information.get("pending_sales")
+            if batch is None:
+                self.flush_counter += 1
+                batch = {"id": self.id + "-" + self.order_epoch + "-flush" + str(self.flush_counter), "sales": {}}
+                self.transaction_information["pending_sales"] = batch
+            sale = batch["sales"].setdefault(seller_peer_id, {"seller": seller_peer_id, "count": 0, "buyers": []})
+            sale["count"] += item_count
+            sale["buyers"].append(buyer_id)
+            self.pending_trades += 1
+            flush = self.pending_trades >= self.write_behind_trades
+        finally:
+            self.transaction_semaphore.release()
+        if flush:
+            self.flush_sales()
+
+    def flush_sales(self):
+        """
+        Send the sales waiting in the transaction log to the warehouse as one delta per seller
+        The batch stays in the transaction log under "flushing_sales" until the warehouse acknowledges it
+        :return: True if every sale was flushed
+        """
+        transactions_file = "transactions_trader_" + self.id + ".json"
+        self.flush_sem.acquire()
+        try:
+            while True:
+                self.transaction_semaphore.acquire()
+                try:
+                    # A batch left by a failed flush is sent again first, under the same id so the warehouse applies it once
+                    batch = self.transaction_information.get("flushing_sales")
+                    if batch is None and self.transaction_information.get("pending_sales"):
+                        batch = self.transaction_information.pop("pending_sales")
+                        self.transaction_information["flushing_sales"] = batch
+                        self.pending_trades = 0
+                        with open(transactions_file,"w") as transact:
+                            json.dump(self.transaction_information,transact)
+                finally:
+                    self.transaction_semaphore.release()
+                if batch is None:
+                    return True
+
+                try:
+                    with self.transport.proxy(self.neighbors["server9"]) as server:
+                        version, changes = server.update_warehouse_batch(list(batch["sales"].values()), batch["id"])
+                except Exception as e:
+                    # The batch stays in the transaction log for the next flush
+                    print(datetime.datetime.now(), self.id, "could not flush sales to the warehouse", e)
+                    return False
+
+                self.transaction_semaphore.acquire()
+                try:
+                    self.transaction_information.pop("flushing_sales", None)
+                    with open(transactions_file,"w") as transact:
+                        json.dump(self.transaction_information,transact)
+                finally:
+                    self.transaction_semaphore.release()
+                self.acknowledge_flush(batch["id"])
+                self.share_sellers(version, changes)
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(), "Flushed ", sum(len(sale["buyers"]) for sale in batch["sales"].values()), " sales of ", len(batch["sales"]), " sellers to the warehouse", file = f)
+        finally:
+            self.flush_sem.release()
+
+    def acknowledge_flush(self, batch_id):
+        """
+        Let the warehouse forget a batch once no transaction log holds it any more
+        A batch left unacknowledged is only remembered longer by the warehouse
+        :param batch_id: id of the batch
+        :return: nothing
+        """
+        try:
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                server.acknowledge_batch(batch_id)
+        except Exception as e:
+            print(datetime.datetime.now(), self.id, "could not acknowledge batch", batch_id, e)
+
+    def unflushed_count(self, seller_peer_id):
+        """
+        Get the units of a seller sold by the trader and not acknowledged by the warehouse yet
+        Must be called with transaction_semaphore held
+        :param seller_peer_id: id of the seller
+        :return: number of units
+        """
+        count = 0
+        for batch in [self.transaction_information.get("pending_sales"), self.transaction_information.get("flushing_sales")]:
+            if batch is not None and seller_peer_id in batch["sales"]:
+                count += batch["sales"][seller_peer_id]["count"]
+        return count
+
+    def unflushed_counts(self):
+        """
+        Get the units of every seller sold by the trader and not acknowledged by the warehouse yet
+        :return: dictionary of seller id to number of units
+        """
+        counts = {}
+        self.transaction_semaphore.acquire()
+        try:
+            for batch in [self.transaction_information.get("pending_sales"), self.transaction_information.get("flushing_sales")]:
+                for seller_peer_id, sale in (batch["sales"] if batch is not None else {}).items():
+                    counts[seller_peer_id] = counts.get(seller_peer_id, 0) + sale["count"]
+        finally:
+            self.transaction_semaphore.release()
+        return counts
+
+    def flush_loop(self):
+        """
+        Flush the sales written behind every write_behind_interval seconds while the peer is a trader
+        :return: nothing
+        """
+        while self.role == "trader":
+            time.sleep(self.write_behind_interval)
+            try:
+                self.flush_sales()
+            except Exception as e:
+                print(datetime.datetime.now(), "Exception in flush_loop", e)
+
+    def remember_order(self, order_id, state):
+        """
+        Remember the state of an order, forgetting the oldest orders beyond order_log_size
+        A forgotten order raises the floor of its buyer's orders, the orders up to the floor count as handled
+        A trader appends its orders and floors to its order journal too, so they outlive it
+        Must be called with order_sem held
+        :param order_id: id of the order
+        :param state: "claimed", "cancelled" or "hedged" on traders, the claiming trader on the warehouse
+        :return: nothing
+        """
+        self.orders[order_id] = state
+        forgotten = []
+        while len(self.orders) > self.order_log_size:
+            forgotten.append(self.orders.popitem(last=False)[0])
+        for forgotten_id in forgotten:
+            match = ORDER_ID.match(forgotten_id)
+            if match:
+                self.order_floors[match.group(1)] = max(self.order_floors.get(match.group(1), 0), int(match.group(2)))
+
+        if self.role == "trader":
+            entries = [{"order": order_id, "state": state}]
+            if forgotten:
+                entries.append({"floors": dict(self.order_floors)})
+            self.journal_orders(entries)
+
+    def journal_orders(self, entries):
+        """
+        Append entries to the order journal of the trader, the journal is rewritten with only the remembered orders
+        and floors once it holds twice as many entries as order_log_size
+        Must be called with order_sem held
+        :param entries: list of {"order": id, "state": state} and {"floors": floors} entries
+        :return: nothing
+        """
+        orders_file = "orders_trader_" + self.id + ".jsonl"
+        self.order_journal_entries += len(entries)
+        if self.order_journal_entries > 2 * self.order_log_size:
+            entries = [{"floors": dict(self.order_floors)}] + [{"order": order_id, "state": state} for order_id, state in self.orders.items()]
+            with open(orders_file + ".tmp", "w") as journal:
+                journal.writelines(json.dumps(entry) + "\n" for entry in entries)
+            os.replace(orders_file + ".tmp", orders_file)
+            self.order_journal_entries = len(entries)
+            return
+        with open(orders_file, "a") as journal:
+            journal.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    def order_state(self, order_id):
+        """
+        Get the state of an order
+        :param order_id: id of the order
+        :return: the remembered state, "forgotten" for an order at or below its buyer's floor, None for an order never seen
+        """
+        state = self.orders.get(order_id)
+        match = ORDER_ID.match(order_id) if state is None and order_id is not None else None
+        if match and int(match.group(2)) <= self.order_floors.get(match.group(1), 0):
+            return "forgotten"
+        return state
+
+    def seed_orders(self, orders_files):
+        """
+        Remember the orders claimed in order journals, so the trader does not sell them again after a takeover
+        :param orders_files: list of order journals of this and other traders
+        :return: nothing
+        """
+        for orders_file in orders_files:
+            orders = OrderedDict()
+            floors = {}
+            try:
+                with open(orders_file) as journal:
+                    for line in journal:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # the last entry of a journal being written by its trader may be cut off, it is read again at the takeover
+                            continue
+                        if "floors" in entry:
+                            floors.update(entry["floors"])
+                        else:
+                            orders.pop(entry["order"], None)
+                            orders[entry["order"]] = entry["state"]
+            except OSError:
+                continue
+            self.order_sem.acquire()
+            try:
+                for prefix, counter in floors.items():
+                    self.order_floors[prefix] = max(self.order_floors.get(prefix, 0), counter)
+                for order_id, state in orders.items():
+                    # a hedged order was not claimed by its trader
+                    if state != "hedged" and self.order_state(order_id) in [None, "hedged"]:
+                        self.remember_order(order_id, state)
+            finally:
+                self.order_sem.release()
+        with open("trader_" + self.id + ".txt","a+") as f:
+            print(datetime.datetime.now(), "Remembering ", len(self.orders), " orders from ", len(orders_files), " order journals", file = f)
+
+    def order_cancelled(self, buyer_info):
+        """
+        Check if the buyer cancelled an order or the trader already handled it
+        :param buyer_info: buyer information
+        :return: True if the order must be dropped
+        """
+        return self.order_state(buyer_info.get("order_id")) not in [None, "hedged"]
+
+    def claim_order(self, buyer_info):
+        """
+        Claim an order before selling it, hedged orders are claimed at the warehouse so only one trader sells them
+        :param buyer_info: buyer information
+        :return: True if the trader may sell the order
+        """
+        order_id = buyer_info.get("order_id")
+        if order_id is None:
+            return True
+        self.order_sem.acquire()
+        try:
+            state = self.order_state(order_id)
+            if state is not None and state != "hedged":
+                return False
+            # the buyer sent a copy of the order to another trader after this one
+            hedged = buyer_info.get("hedged") or state == "hedged"
+            self.remember_order(order_id, "claimed")
+        finally:
+            self.order_sem.release()
+        if hedged:
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                return server.claim_order_with_warehouse(order_id, self.id)
+        return True
+
+    @Pyro5.server.expose
+    def cancel_order(self, order_id):
+        """
+        Drop an order the buyer got sold by another trader, unless this trader already claimed it
+        :param order_id: id of the order
+        :return: True if the order was cancelled before the trader claimed it
+        """
+        self.order_sem.acquire()
+        try:
+            if self.order_state(order_id) not in [None, "hedged"]:
+                return False
+            self.remember_order(order_id, "cancelled")
+            return True
+        finally:
+            self.order_sem.release()
+
+    @Pyro5.server.expose
+    def hedge_order(self, order_id):
+        """
+        Let the buyer send a copy of an order to another trader, the order is then claimed at the warehouse before it is sold
+        :param order_id: id of the order
+        :return: True if the copy may be sent, False if the trader already claimed the order without the warehouse
+        """
+        self.order_sem.acquire()
+        try:
+            state = self.order_state(order_id)
+            if state is not None:
+                return state not in ["claimed", "forgotten"]
+            self.remember_order(order_id, "hedged")
+            return True
+        finally:
+            self.order_sem.release()
+
+    @Pyro5.server.expose
+    def claim_order_with_warehouse(self, order_id, trader_id):
+        """
+        Give an order to the first trader that claims it
+        :param order_id: id of the order
+        :param trader_id: id of the trader
+        :return: True if the order belongs to the trader
+        """
+        self.record("claim_order_with_warehouse", order_id, trader_id)
+        self.order_sem.acquire()
+        try:
+            if self.order_state(order_id) is None:
+                self.remember_order(order_id, trader_id)
+            return self.orders.get(order_id) == trader_id
+        finally:
+            self.order_sem.release()
+
+    @Pyro5.server.expose
+    def trading_lookup(self,buyer_info,item,item_count):
+        """
+        Match sellers to buyers by product name
+        :param buyer_info: buyer information
+        :param item: product name
+        :param item_count number of items to buy
+        :return: True if the request was handled, False if it was rejected because the trader is busy, None if the order was handled by another trader
+        """
+        self.record("trading_lookup", buyer_info, item, item_count)
+        # Reject straight away instead of queueing without bound, the buyer backs off and tries another trader
+        if self.role != "trader" or not self.admission_sem.acquire(blocking=False):
+            if self.role == "trader":
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Busy, rejected request from buyer ",buyer_info["id"], "for product ",item, file = f)
+            return False
+
+        self.fail_sem.acquire()
+        try:
+            if self.role == "trader":
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Received request from buyer ",buyer_info["id"], "for product ",item,"("+str(item_count)+")", file = f)
+                transactions_file = "transactions_trader_"+self.id+".json"
+                # Save current incomplete transaction to a file for recovery
+                tlog = {"buyer":buyer_info["id"],"order":buyer_info.get("order_id"),"seller":"_","product":item,"product_count":item_count,"completed":False}
+                self.put_log(tlog,transactions_file,False,True)
+
+                # Find sellers with the product
+                sl = ''
+                found = False
+                claimed = True
+                looked_up = False
+                version = self.product_versions.get(item, 0)
+
+                if self.order_cancelled(buyer_info):
+                    claimed = False
+                elif self.is_unavailable(item):
+                    # No seller registered the product, answer without going to the warehouse
+                    with open("trader_" + self.id + ".txt","a+") as f:
+                        print(datetime.datetime.now(),"Item known to have no seller", file = f)
+                elif self.reservation_ttl:
+                    # Sell from units leased from the warehouse, which cannot be sold by other traders
+                    claimed = self.claim_order(buyer_info)
+                    if claimed:
+                        sl, found = self.sell_from_reservation(buyer_info["id"],item,item_count)
+                        looked_up = True
+                else:
+                    looked_up = True
+                    if self.with_cache:
+                        # Check if the seller is in the cache
+                        sl, found = self.check_seller_in_cache(item,item_count)
+
+                    # If not found in cache, load state and check again, avoids underselling
+                    # A mapped warehouse is read in place, so its misses are already current
+                    # An order the warehouse's view of the product rules out is answered without reloading
+                    if (not sl or not found) and not (self.with_cache and self.inventory_format == "mmap"):
+                        viewed = self.check_product_view(item, item_count, bool(self.split_policy))
+                        if viewed is not None:
+                            sl, found = '', viewed
+                            with open("trader_" + self.id + ".txt","a+") as f:
+                                print(datetime.datetime.now(),"Item not found in cache, and the warehouse's view rules the order out", file = f)
+                        else:
+                            with open("trader_" + self.id + ".txt","a+") as f:
+                                print(datetime.datetime.now(),"Item not found in cache, loading from warehouse", file = f)
+                            self.reload_in_turn()
+                            sl, found = self.check_seller_in_cache(item,item_count)
+                    elif sl and found:
+                        with open("trader_" + self.id + ".txt","a+") as f:
+                            print(datetime.datetime.now(),"Item found in cache", file = f)
+                    # Claim the order only once it can be answered, so a hedged copy stuck in a reload loses the race
+                    if found:
+                        claimed = self.claim_order(buyer_info)
+
+                if not claimed:
+                    # A hedged copy of the order was or will be handled by another trader
+                    self.put_log(tlog,transactions_file,True,False)
+                    with open("trader_" + self.id + ".txt","a+") as f:
+                        print(datetime.datetime.now(),"Dropped order ",buyer_info.get("order_id")," handled by another trader", file = f)
+                    return None
+
+                # Only a miss of a real lookup starts the negative cache ttl, answers from it leave it running out
+                if looked_up and not found:
+                    self.mark_unavailable(item, version)
+            
+                if found:
+                    # No single seller has enough, fill the order from several sellers when their combined stock does
+                    # A split whose units another trader sold first is planned once more from the counts the warehouse returned
+                    filled = False
+                    if not sl and self.split_policy and not self.reservation_ttl:
+                        for attempt in range(2):
+                            parts = self.split_order(item,item_count)
+                            if not parts:
+                                break
+                            filled = self.fill_split_order(buyer_info,item,item_count,parts,transactions_file)
+                            if filled:
+                                break
+                    if filled:
+                        pass
+                    elif not sl:
+                        with open("server_outputs.txt", "a+") as f:
+                            print(datetime.datetime.now(), "No seller found for ", item, file = f)
+                        # When no seller can fulfill the demand, simply reject the buyer request from trader
+                        with self.transport.proxy(self.neighbors[buyer_info["id"]]) as neighbor:
+                                neighbor.transaction(item,buyer_info["id"],"",self.id,False,True,item_count,buyer_info.get("order_id"))
+                                self.put_log(tlog,transactions_file,True,False)
+                                with open("trader_" + self.id + ".txt","a+") as f:
+                                    print(datetime.datetime.now(),"Informed ",buyer_info["id"]," that no seller can fulfill the demand for ", item , file = f)
+                                return True
+                    else:
+                        with open("server_outputs.txt","a+") as f:
+                            print(datetime.datetime.now(),"Found ", item, " in warehouse. Informing trader ", self.id , file = f)
+                        seller = sl
+                        seller_peer_id = seller["seller"]["id"]
+                        print("seller with peer id ", seller_peer_id, " chosen for transactions")
+                        # Add seller to the transaction log along with buyers interested in buying from it
+                        # Update the trader's seller information to update the selected seller's transaction
+                        # and save it to saved transactions file
+                        try:
+                            if not self.reservation_ttl and seller_peer_id in self.seller_information:
+                                self.seller_information[seller_peer_id]["product_count"] -= item_count
+                            with self.transport.proxy(self.neighbors[seller_peer_id]) as seller_add:
+                                seller_add.addBuyer(buyer_info["id"])
+
+                            # Update transaction in warehouse, leased units are settled by lease_loop instead
+                            if self.write_behind_interval and not self.reservation_ttl:
+                                self.queue_sale(seller_peer_id, item_count, buyer_info["id"])
+                            elif not self.reservation_ttl:
+                                with self.transport.proxy(self.neighbors["server9"]) as server:
+                                    version, changes = server.update_warehouse(seller_peer_id, item_count, buyer_info, seller)
+                                self.share_sellers(version, changes)
+                        
+                            tlog = {"buyer":buyer_info["id"],"order":buyer_info.get("order_id"),"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":False}
+                            self.put_log(tlog,transactions_file,False,True)
+                        except Exception as e:
+                            print("[DEBUG] error in updating transaction information: ", e)
+                    
+                        # Choose a buyer and decrement the product count
+                        with self.transport.proxy(self.neighbors[seller_peer_id]) as neighbor:
+                                neighbor.transaction(item,buyer_info["id"], seller_peer_id,self.id,False,False,item_count)
+
+                        tlog = {"buyer":buyer_info["id"],"order":buyer_info.get("order_id"),"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":True}
+                        self.put_log(tlog,transactions_file,True,True)
+
+                        # Let buyer know that the transaction is complete
+                        with self.transport.proxy(self.neighbors[buyer_info["id"]]) as neighbor:
+                                neighbor.transaction(item,buyer_info["id"], seller_peer_id,self.id,True,False,item_count,buyer_info.get("order_id"))
+                        with open("trader_" + self.id + ".txt","a+") as f:
+                            print(datetime.datetime.now(), "Informed ",buyer_info["id"]," that transaction is complete for ", item , file = f)
+                else:
+                    # When no seller registered for the product, simply reject the buyer request from trader
+                    with open("server_outputs.txt", "a+") as f:
+                        print(datetime.datetime.now(), "No seller found for ", item, file = f)
+                    with self.transport.proxy(self.neighbors[buyer_info["id"]]) as neighbor:
+                            neighbor.transaction(item,buyer_info["id"],"",self.id,False,False,item_count,buyer_info.get("order_id"))
+                            self.put_log(tlog,transactions_file,True,False)
+                    with open("trader_" + self.id + ".txt","a+") as f:
+                        print(datetime.datetime.now(),"Informed ",buyer_info["id"]," that no seller can fulfill the demand for ", item , file = f)
+        finally:
+            # Release even if the lookup fails so the trader keeps serving requests
+            self.fail_sem.release()
+            self.admission_sem.release()
+        return True
+
+    def reload_in_turn(self):
+        """
+        Reload the cache for a lookup that missed, giving up the request's turn while the reload runs
+        so the requests queued behind it run into the same reload and share it
+        Must be called with fail_sem held, which is held again on return
+        :return: nothing
+        """
+        self.fail_sem.release()
+        try:
+            self.single_flight("warehouse", self.load_state)
+        finally:
+            self.fail_sem.acquire()
+
+    @Pyro5.server.expose
+    def trading_basket_lookup(self, buyer_info, basket):
+        """
+        Match a basket of products to sellers with a single warehouse update, selling every item or none
+        :param buyer_info: buyer information
+        :param basket: list of product name and count
+        :return: True if the request was handled, False if it was rejected because the trader is busy, None if the order was handled by another trader
+        """
+        self.record("trading_basket_lookup", buyer_info, basket)
+        if self.role != "trader" or not self.admission_sem.acquire(blocking=False):
+            if self.role == "trader":
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Busy, rejected basket from buyer ",buyer_info["id"], file = f)
+            return False
+
+        self.fail_sem.acquire()
+        try:
+            with open("trader_" + self.id + ".txt","a+") as f:
+                print(datetime.datetime.now(),"Received basket from buyer ",buyer_info["id"], "for ",basket, file = f)
+            transactions_file = "transactions_trader_"+self.id+".json"
+            tlog = {"buyer":buyer_info["id"],"order":buyer_info.get("order_id"),"seller":"_","basket":basket,"completed":False}
+            self.put_log(tlog,transactions_file,False,True)
+
+            if not self.claim_order(buyer_info):
+                self.put_log(tlog,transactions_file,True,False)
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Dropped basket order ",buyer_info.get("order_id")," handled by another trader", file = f)
+                return None
+
+            # A basket the views of its products rule out is answered without flushing or going to the warehouse
+            viewed = [self.check_product_view(item["product"], item["count"], False) for item in basket]
+            if any(found is not None for found in viewed):
+                with self.transport.proxy(self.neighbors[buyer_info["id"]]) as neighbor:
+                    neighbor.basket_transaction(basket,[],self.id,False,False not in viewed,buyer_info.get("order_id"))
+                self.put_log(tlog,transactions_file,True,False)
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Informed ",buyer_info["id"]," that the basket cannot be fulfilled, from the views of its products", file = f)
+                return True
+
+            # The warehouse matches baskets against its own stock, so it must have every sale written behind
+            if self.write_behind_interval and not self.flush_sales():
+                self.put_log(tlog,transactions_file,True,False)
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Could not flush sales before the basket of ",buyer_info["id"], file = f)
+                return False
+
+            # The warehouse matches and takes every item atomically
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                allocations, found = server.fulfill_basket(self.id, buyer_info["id"], basket)
+
+            if not allocations:
+                with self.transport.proxy(self.neighbors[buyer_info["id"]]) as neighbor:
+                    neighbor.basket_transaction(basket,[],self.id,False,found,buyer_info.get("order_id"))
+                self.put_log(tlog,transactions_file,True,False)
+                with open("trader_" + self.id + ".txt","a+") as f:
+                    print(datetime.datetime.now(),"Informed ",buyer_info["id"]," that the basket cannot be fulfilled", file = f)
+                return True
+
+            # A single journal entry covers every item of the basket
+            tlog = {"buyer":buyer_info["id"],"order":buyer_info.get("order_id"),"seller":[allocation["seller"]["id"] for allocation in allocations],"basket":basket,"allocations":allocations,"completed":False}
+            self.put_log(tlog,transactions_file,False,True)
+            for allocation in allocations:
+                seller_peer_id = allocation["seller"]["id"]
+                if seller_peer_id in self.seller_information:
+                    self.seller_information[seller_peer_id]["product_count"] -= allocation["count"]
+                with self.transport.proxy(self.neighbors[seller_peer_id]) as neighbor:
+                    neighbor.addBuyer(buyer_info["id"])
+                    neighbor.transaction(allocation["product"],buyer_info["id"],seller_peer_id,self.id,False,False,allocation["count"])
+            tlog["completed"] = True
+            self.put_log(tlog,transactions_file,True,True)
+
+            with self.transport.proxy(self.neighbors[buyer_info["id"]]) as neighbor:
+                neighbor.basket_transaction(basket,allocations,self.id,True,True,buyer_info.get("order_id"))
+            with open("trader_" + self.id + ".txt","a+") as f:
+                print(datetime.datetime.now(), "Informed ",buyer_info["id"]," that the basket is complete", file = f)
+        finally:
+            self.fail_sem.release()
+            self.admission_sem.release()
+        return True
+
+    @Pyro5.server.expose
+    def trading_unresolved_lookup(self,tlog):
+        """
+        Match sellers to buyers by product name
+        :param buyer_info: buyer information
+        :param item: product name
+        :param item_count number of items to buy
+        :return: nothing
+        """
+        if self.role == "trader":
+            item = tlog["product"]
+            item_count = tlog["product_count"]
+            buyer_info_id = tlog["buyer"]
+            order_id = tlog.get("order")
+
+            transactions_file = "transactions_trader_"+self.id+".json"
+            if tlog["seller"] == "_" and not tlog["completed"]:
+                
+                self.put_log(tlog,transactions_file,False,True)
+
+
+                # Find sellers with the product
                 sl, found = self.check_seller_in_cache(item,item_count)
 
                 # If not found in cache, load state and check again, avoids underselling
                 if not sl or not found and self.with_cache:
-                    self.load_state()
+                    self.single_flight("warehouse", self.load_state)
                     sl, found = self.check_seller_in_cache(item,item_count)
                 
                 if found:
                     if not sl:
                         # When no seller can fulfill the demand, simply reject the buyer request from trader
-                        with Pyro5.api.Proxy(self.neighbors[buyer_info_id]) as neighbor:
-                                neighbor.transaction(item,buyer_info_id,"",self.id,False,True,item_count)
+                        with self.transport.proxy(self.neighbors[buyer_info_id]) as neighbor:
+                                neighbor.transaction(item,buyer_info_id,"",self.id,False,True,item_count,order_id)
                                 self.put_log(tlog,transactions_file,True,False)
-                                self.fail_sem.release()
                                 return
                     else:
                         
@@ -842,33 +2328,31 @@ class Peer(Process):
                         # Update the trader's seller information to update the selected seller's transaction
                         # and save it to saved transactions file
                         try:
-                            self.seller_information[seller_peer_id]["product_count"] -= item_count
-                            self.seller_information[seller_peer_id]["buyer_list"].append(buyer_info_id)
-                            with Pyro5.api.Proxy(self.neighbors[seller_peer_id]) as seller_add:
+                            if seller_peer_id in self.seller_information:
+                                self.seller_information[seller_peer_id]["product_count"] -= item_count
+                            with self.transport.proxy(self.neighbors[seller_peer_id]) as seller_add:
                                 seller_add.addBuyer(buyer_info_id)
-                            with open("seller_information.json","w") as sell:
-                                data = json.load(sell)
-                                data[seller_peer_id]["product_count"] -= item_count
-                                data[seller_peer_id]["buyer_list"].append(buyer_info_id)
-                                json.dump(data,sell)
-                            tlog = {"buyer":buyer_info_id,"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":False}
+                            with self.transport.proxy(self.neighbors["server9"]) as server:
+                                version, changes = server.update_warehouse(seller_peer_id, item_count, {"id":buyer_info_id}, seller)
+                            self.share_sellers(version, changes)
+                            tlog = {"buyer":buyer_info_id,"order":order_id,"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":False}
                             self.put_log(tlog,transactions_file,False,True)
                         except Exception as e:
                             print("[DEBUG] error in updating transaction information: ", e)
                         
                         # Choose a buyer and decrement the product count
-                        with Pyro5.api.Proxy(self.neighbors[seller_peer_id]) as neighbor:
+                        with self.transport.proxy(self.neighbors[seller_peer_id]) as neighbor:
                                 neighbor.transaction(item,buyer_info_id, seller_peer_id,self.id,False,False,item_count)
 
-                        tlog = {"buyer":buyer_info_id,"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":True}
+                        tlog = {"buyer":buyer_info_id,"order":order_id,"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":True}
                         self.put_log(tlog,transactions_file,True,True)
 
                         # Let buyer know that the transaction is complete
-                        with Pyro5.api.Proxy(self.neighbors[buyer_info_id]) as neighbor:
-                                neighbor.transaction(item,buyer_info_id, seller_peer_id,self.id,True,False,item_count)
+                        with self.transport.proxy(self.neighbors[buyer_info_id]) as neighbor:
+                                neighbor.transaction(item,buyer_info_id, seller_peer_id,self.id,True,False,item_count,order_id)
                 else:
-                    with Pyro5.api.Proxy(self.neighbors[buyer_info_id]) as neighbor:
-                            neighbor.transaction(item,buyer_info_id,"",self.id,False,False,item_count)
+                    with self.transport.proxy(self.neighbors[buyer_info_id]) as neighbor:
+                            neighbor.transaction(item,buyer_info_id,"",self.id,False,False,item_count,order_id)
                             self.put_log(tlog,transactions_file,True,False)
             elif tlog["seller"] != "_" and not tlog["completed"]:
                 seller_peer_id = tlog["seller"]
@@ -878,22 +2362,18 @@ class Peer(Process):
                     print("[DEBUG] error in updating transaction information: ", e)
                 
                 # Choose a buyer and decrement the product count
-                with Pyro5.api.Proxy(self.neighbors[seller_peer_id]) as neighbor:
+                with self.transport.proxy(self.neighbors[seller_peer_id]) as neighbor:
                         neighbor.transaction(item,buyer_info_id, seller_peer_id,self.id,False,False,item_count)
 
-                tlog = {"buyer":buyer_info_id,"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":True}
+                tlog = {"buyer":buyer_info_id,"order":order_id,"seller":seller_peer_id,"product":item,"product_count":item_count,"completed":True}
                 self.put_log(tlog,transactions_file,True,True)
 
                 # Let buyer know that the transaction is complete
-                with Pyro5.api.Proxy(self.neighbors[buyer_info_id]) as neighbor:
-                        neighbor.transaction(item,buyer_info_id, seller_peer_id,self.id,True,False,item_count)
-
-    @Pyro5.server.expose
-    def addBuyer(self, buyer_id):
-        self.buyer_list.append(buyer_id)
+                with self.transport.proxy(self.neighbors[buyer_info_id]) as neighbor:
+                        neighbor.transaction(item,buyer_info_id, seller_peer_id,self.id,True,False,item_count,order_id)
 
     @Pyro5.server.expose
-    def transaction(self,product_name,buyer_info_id,seller_id,trader_id,buyer_success,insufficient,item_cnt):
+    def transaction(self,product_name,buyer_info_id,seller_id,trader_id,buyer_success,insufficient,item_cnt,order_id=None):
         """
         Complete the transaction at the buyer and seller
         :param product_name: product name
@@ -903,21 +2383,17 @@ class Peer(Process):
         :param buyer_success: boolean indicating if the transaction was successful for the buyer
         :param insufficient: boolean indicating the buyer demand can't be satisfied by any of seller's resources currently
         :param item_cnt: integer denoting the number of items to be sold
+        :param order_id: id of the order, None for the answers of traders that do not send it
         :return: nothing
         """
         if self.role == "seller" and self.product_name == product_name:
             print(datetime.datetime.now(),self.id," received request from trader ",trader_id," for item ",product_name,"("+str(item_cnt)+")")
-            buyer_clocks = {}
-            for buyer in self.buyer_list:
-                with Pyro5.api.Proxy(self.neighbors[buyer]) as neighbor:
-                    buyer_clocks[buyer] = neighbor.getClock()
-
-            # Choose the buyer with the highest clock value
-            max_key = max(buyer_clocks, key=buyer_clocks.get)
-
-            # If the max_key buyer is the one who initiated the transaction, complete the transaction
-            if max_key == buyer_info_id:
-                print(datetime.datetime.now(),self.id," sold ",item_cnt," ",product_name," to ",buyer_info_id)
+            self.stock_sem.acquire()
+            self.stock -= item_cnt
+            self.stock_sem.release()
+            # The trader waits on this call, and some past buyers may be traders now,
+            # so their clocks are asked for after answering it
+            self.executor.submit(self.compare_buyer_clocks, product_name, buyer_info_id, item_cnt)
 
         elif self.role == "buyer":
             if buyer_success:
@@ -927,6 +2403,8 @@ class Peer(Process):
                 self.buy_request_semaphore.acquire()
                 self.buy_request_done = True
                 self.buy_request_semaphore.release()
+                if self.first_trade is not None:
+                    self.first_trade.set()
             else:
                 if insufficient:
                     print(datetime.datetime.now(),self.id," has extra demand than the current supply of ",product_name)
@@ -936,11 +2414,79 @@ class Peer(Process):
                     self.buy_request_done = True
                     self.buy_request_semaphore.release()
 
+            # A pipelined order chose its product when it was sent
+            if order_id is not None and self.complete_order(order_id, True):
+                return
             self.product_sem.acquire()
             self.product_name = self.products[random.randint(0, len(self.products)-1)]
             print(datetime.datetime.now(), self.id, " now buying ", self.product_name)
             self.product_sem.release()
 
+    def compare_buyer_clocks(self, product_name, buyer_info_id, item_cnt):
+        """
+        Ask the seller's buyers for their clocks and report the sale if its buyer has the highest clock
+        :param product_name: product name
+        :param buyer_info_id: id of the buyer of the sale
+        :param item_cnt: integer denoting the number of items sold
+        :return: nothing
+        """
+        buyer_clocks = {}
+        for buyer in set(self.buyer_list):
+            try:
+                with self.transport.proxy(self.neighbors[buyer]) as neighbor:
+                    buyer_clocks[buyer] = neighbor.getClock()
+            except Exception as e:
+                print(datetime.datetime.now(), self.id, "could not get the clock of", buyer, e)
+        if not buyer_clocks:
+            return
+
+        # Choose the buyer with the highest clock value
+        max_key = max(buyer_clocks, key=buyer_clocks.get)
+
+        # If the max_key buyer is the one who initiated the transaction, complete the transaction
+        if max_key == buyer_info_id:
+            print(datetime.datetime.now(),self.id," sold ",item_cnt," ",product_name," to ",buyer_info_id)
+
+    @Pyro5.server.expose
+    def basket_transaction(self, basket, allocations, trader_id, buyer_success, found, order_id=None):
+        """
+        Complete a basket order at the buyer
+        :param basket: list of product name and count
+        :param allocations: the seller chosen for every item of the basket
+        :param trader_id: trader id
+        :param buyer_success: boolean indicating if the whole basket was bought
+        :param found: boolean indicating if every product of the basket has a seller
+        :param order_id: id of the order, None for the answers of traders that do not send it
+        :return: nothing
+        """
+        if self.role != "buyer":
+            return
+        # As for a single order, the request is done once it is bought or no seller has one of its products
+        if buyer_success:
+            print("**********")
+            for allocation in allocations:
+                print(datetime.datetime.now(),self.id," bought item ",allocation["product"], " from seller ",allocation["seller"]["id"])
+            print("**********")
+            self.buy_request_semaphore.acquire()
+            self.buy_request_done = True
+            self.buy_request_semaphore.release()
+            if self.first_trade is not None:
+                self.first_trade.set()
+        elif found:
+            print(datetime.datetime.now(),self.id," has extra demand than the current supply for the basket ",basket)
+        else:
+            print(datetime.datetime.now(),self.id," could not find any seller for some item of the basket ",basket)
+            self.buy_request_semaphore.acquire()
+            self.buy_request_done = True
+            self.buy_request_semaphore.release()
+
+        if order_id is not None and self.complete_order(order_id, True):
+            return
+        self.product_sem.acquire()
+        self.product_name = self.products[random.randint(0, len(self.products)-1)]
+        print(datetime.datetime.now(), self.id, " now buying ", self.product_name)
+        self.product_sem.release()
+
     @Pyro5.server.expose
     def register_products(self, seller_info):
         """
@@ -948,21 +2494,68 @@ class Peer(Process):
         :param seller_info: seller information
         :return: nothing
         """
+        self.record("register_products", seller_info)
         
         peer_id = seller_info["seller"]["id"]
         with open("trader_" + self.id + ".txt", "a+") as f:
             print(datetime.datetime.now(), peer_id, " registering products with trader ", self.id, file = f)
-        seller_info["buyer_list"] = []
-
         
         if peer_id in self.seller_information.keys():
             self.seller_information[peer_id]["product_count"] += seller_info["product_count"]
         else:
-            self.seller_information[peer_id] = seller_info
-        
+            self.seller_information[peer_id] = dict(seller_info)
+
+        # Coalesce with deltas of the same seller that are not forwarded yet
+        self.registration_sem.acquire()
+        if peer_id in self.pending_registrations:
+            self.pending_registrations[peer_id]["product_count"] += seller_info["product_count"]
+        else:
+            self.pending_registrations[peer_id] = seller_info
+        self.registration_sem.release()
+
         # update data in warehouse
-        with Pyro5.api.Proxy(self.neighbors["server9"]) as neighbor:
-            neighbor.register_products_with_warehouse(seller_info)
+        self.forward_registrations()
+
+    def forward_registrations(self):
+        """
+        Forward the pending restock deltas to the warehouse in as few batches as possible
+        :return: nothing
+        """
+        # Only one thread forwards at a time, deltas registered meanwhile go out with its next batch
+        while self.pending_registrations and self.forward_sem.acquire(blocking=False):
+            try:
+                while True:
+                    self.registration_sem.acquire()
+                    batch = list(self.pending_registrations.values())
+                    self.pending_registrations = {}
+                    self.registration_sem.release()
+                    if not batch:
+                        break
+                    with self.transport.proxy(self.neighbors["server9"]) as neighbor:
+                        version, changes = neighbor.register_batch_with_warehouse(batch)
+                    self.share_sellers(version, changes)
+
+                    # The products are in the warehouse now, drop them from every trader's negative cache
+                    products = list(set(seller_info["product_name"] for seller_info in batch))
+                    self.products_restocked(products)
+                    # The other trader may be forwarding its own restocks to this one, so it is told after returning
+                    self.executor.submit(self.tell_traders_restocked, products)
+            finally:
+                self.forward_sem.release()
+
+    def tell_traders_restocked(self, products):
+        """
+        Drop products that were just added to the warehouse from the negative cache of the other traders
+        :param products: list of product names
+        :return: nothing
+        """
+        for trader in self.trader:
+            if trader != self.id:
+                try:
+                    with self.transport.proxy(self.neighbors[trader]) as neighbor:
+                        neighbor.products_restocked(products)
+                except Exception as e:
+                    print(datetime.datetime.now(), "Exception in tell_traders_restocked", e)
 
     @Pyro5.server.expose
     def register_products_with_warehouse(self, seller_info):
@@ -971,27 +2564,317 @@ class Peer(Process):
         :param seller_info: seller information
         :return: nothing
         """
-        
-        peer_id = seller_info["seller"]["id"]
-        data = {}
-        if os.path.exists("seller_information.json"):
-            self.storage_semaphore.acquire()
-            with open("seller_information.json") as sell:
-                data = json.load(sell)
+        self.register_batch_with_warehouse([seller_info])
+
+    @Pyro5.server.expose
+    def register_batch_with_warehouse(self, seller_infos):
+        """
+        Register a batch of restock deltas with a single warehouse write
+        :param seller_infos: list of seller information, product_count being the units added
+        :return: the warehouse version and the seller information of every restocked seller
+        """
+        self.record("register_batch_with_warehouse", seller_infos)
+        self.storage_semaphore.acquire()
+        try:
+            data = self.load_warehouse([seller_info["seller"]["id"] for seller_info in seller_infos])
+
+            for seller_info in seller_infos:
+                peer_id = seller_info["seller"]["id"]
+                if peer_id in data.keys():
+                    data[peer_id]["product_count"] += seller_info["product_count"]
+                else:
+                    data[peer_id] = seller_info
+            self.save_warehouse(data, [seller_info["seller"]["id"] for seller_info in seller_infos])
+            version = self.warehouse_version
+        finally:
             self.storage_semaphore.release()
 
+        with open("server_outputs.txt", "a+") as f:
+            print(datetime.datetime.now(), "Registered products with warehouse ", file = f)
+        return version, {seller_info["seller"]["id"]: data[seller_info["seller"]["id"]] for seller_info in seller_infos}
+
+    @Pyro5.server.expose
+    def reserve_units(self, trader_id, item, item_count, block, ttl):
+        """
+        Lease units of a product to a trader, taking them out of the warehouse stock until the lease is settled
+        :param trader_id: id of the trader
+        :param item: name of the item
+        :param item_count: the least number of units to reserve
+        :param block: the number of units to reserve if the seller has them
+        :param ttl: lease time in seconds
+        :return: lease with its ttl in seconds, found
+        """
+        self.record("reserve_units", trader_id, item, item_count, block, ttl)
+        self.storage_semaphore.acquire()
+        try:
+            data = self.load_warehouse()
+            leases = self.load_leases()
+            changed = self.expire_leases(data)
+
+            found = False
+            lease = None
+            for peer_id in data.keys():
+                if data[peer_id]["product_name"] != item or peer_id == trader_id:
+                    continue
+                found = True
+                if data[peer_id]["product_count"] >= item_count:
+                    units = min(block, data[peer_id]["product_count"])
+                    data[peer_id]["product_count"] -= units
+                    self.lease_counter += 1
+                    # The epoch keeps the ids of leases granted before a restart apart
+                    lease = {"lease_id": self.id + "-" + self.order_epoch + "-" + str(self.lease_counter), "trader": trader_id, "seller": data[peer_id]["seller"], "product_name": item, "units": units, "ttl": ttl}
+                    leases[lease["lease_id"]] = {"lease_id": lease["lease_id"], "trader": trader_id, "seller": data[peer_id]["seller"], "product_name": item, "units": units, "expires": time.time() + ttl, "settled": 0, "buyers": 0, "returned": False}
+                    self.save_leases()
+                    changed.append(peer_id)
+                    break
+            if changed:
+                self.save_warehouse(data, changed)
+        finally:
+            self.storage_semaphore.release()
+
+        if lease:
+            with open("server_outputs.txt", "a+") as f:
+                print(datetime.datetime.now(), "Leased ", lease["units"], " ", item, " of ", lease["seller"]["id"], " to trader ", trader_id, file = f)
+        return lease, found
+
+    @Pyro5.server.expose
+    def settle_leases_with_warehouse(self, settlements, ttl):
+        """
+        Record the units sold from leases and renew or return them, with a single warehouse write
+        A settlement carries every sale of its lease so far, only the sales not settled before are applied,
+        and sales of a lease that already expired are taken out of the seller's stock
+        :param settlements: list of lease id, seller id, units sold, buyers and whether to renew the lease
+        :param ttl: lease time in seconds for renewed leases
+        :return: the new ttl in seconds of every lease, 0 for leases that are returned or already expired
+        """
+        self.record("settle_leases_with_warehouse", settlements, ttl)
+        ttls = {}
         self.storage_semaphore.acquire()
-        with open("seller_information.json","w") as sell:
-            if peer_id in data.keys():
-                data[peer_id]["product_count"] += seller_info["product_count"]
+        try:
+            data = self.load_warehouse([settlement["seller"] for settlement in settlements] + self.leased_sellers())
+            leases = self.load_leases()
+            changed = self.expire_leases(data)
+
+            for settlement in settlements:
+                lease_id = settlement["lease_id"]
+                seller_peer_id = settlement["seller"]
+                ttls[lease_id] = 0
+                # A lease forgotten since is settled once more from scratch
+                lease = leases.setdefault(lease_id, {"lease_id": lease_id, "seller": {"id": seller_peer_id}, "units": 0, "settled": 0, "buyers": 0, "returned": True})
+                sold = settlement["sold"] - lease["settled"]
+                if sold > 0 and lease["returned"] and seller_peer_id in data:
+                    data[seller_peer_id]["product_count"] -= sold
+                    changed.append(seller_peer_id)
+                elif sold > 0:
+                    lease["units"] -= sold
+                self.record_buyers(seller_peer_id, settlement["buyers"][lease["buyers"]:])
+                lease["settled"] = max(lease["settled"], settlement["sold"])
+                lease["buyers"] = max(lease["buyers"], len(settlement["buyers"]))
+                if lease["returned"]:
+                    continue
+                if settlement["renew"] and lease["units"] > 0:
+                    lease["expires"] = time.time() + ttl
+                    ttls[lease_id] = ttl
+                else:
+                    changed.append(self.return_lease(data, lease))
+            self.save_leases()
+            if changed:
+                self.save_warehouse(data, changed)
+        finally:
+            self.storage_semaphore.release()
+
+        with open("server_outputs.txt", "a+") as f:
+            print(datetime.datetime.now(), "Settled ", len(settlements), " leases in warehouse", file = f)
+        return ttls
+
+    @Pyro5.server.expose
+    def fulfill_basket(self, trader_id, buyer_id, basket):
+        """
+        Take every item of a basket from the warehouse atomically, or nothing if any item cannot be sold
+        :param trader_id: id of the trader
+        :param buyer_id: id of the buyer
+        :param basket: list of product name and count
+        :return: the seller chosen for every item or an empty list, and whether every product has a seller
+        """
+        self.record("fulfill_basket", trader_id, buyer_id, basket)
+        allocations = []
+        found = True
+        self.storage_semaphore.acquire()
+        try:
+            data = self.load_warehouse()
+            changed = self.expire_leases(data)
+            available = {peer_id: data[peer_id]["product_count"] for peer_id in data if peer_id != trader_id}
+            for item in basket:
+                sellers = [peer_id for peer_id in available if data[peer_id]["product_name"] == item["product"]]
+                if not sellers:
+                    found = False
+                seller_peer_id = next((peer_id for peer_id in sellers if available[peer_id] >= item["count"]), None)
+                if seller_peer_id is None:
+                    allocations = []
+                    break
+                available[seller_peer_id] -= item["count"]
+                allocations.append({"product": item["product"], "count": item["count"], "seller": data[seller_peer_id]["seller"]})
+
+            for allocation in allocations:
+                data[allocation["seller"]["id"]]["product_count"] -= allocation["count"]
+                self.record_buyers(allocation["seller"]["id"], [buyer_id])
+                changed.append(allocation["seller"]["id"])
+            if changed:
+                self.save_warehouse(data, changed)
+        finally:
+            self.storage_semaphore.release()
+
+        with open("server_outputs.txt", "a+") as f:
+            if allocations:
+                print(datetime.datetime.now(), "Recorded transaction for purchase of a basket of ", len(allocations), " items in warehouse", file = f)
             else:
-                data[peer_id] = seller_info
+                print(datetime.datetime.now(), "Could not fulfill basket ", basket, file = f)
+        return allocations, found
 
-            json.dump(data,sell)
-        self.storage_semaphore.release()
+    @Pyro5.server.expose
+    def fulfill_split(self, trader_id, buyer_id, parts):
+        """
+        Take every part of an order split across sellers from the warehouse atomically, or nothing if a seller no longer has its part
+        :param trader_id: id of the trader
+        :param buyer_id: id of the buyer
+        :param parts: list of seller information and count to take from the seller
+        :return: whether the parts were taken, the warehouse version and the seller information of every seller of the parts
+        """
+        self.record("fulfill_split", trader_id, buyer_id, parts)
+        self.storage_semaphore.acquire()
+        try:
+            data = self.load_warehouse([part["seller"]["id"] for part in parts] + self.leased_sellers())
+            changed = self.expire_leases(data)
+            seller_ids = [part["seller"]["id"] for part in parts if part["seller"]["id"] in data]
+            taken = len(seller_ids) == len(parts) and all(data[part["seller"]["id"]]["product_count"] >= part["count"] for part in parts)
+            if taken:
+                for part in parts:
+                    data[part["seller"]["id"]]["product_count"] -= part["count"]
+                    self.record_buyers(part["seller"]["id"], [buyer_id])
+                    changed.append(part["seller"]["id"])
+            if changed:
+                self.save_warehouse(data, changed)
+            version = self.warehouse_version
+        finally:
+            self.storage_semaphore.release()
 
         with open("server_outputs.txt", "a+") as f:
-            print(datetime.datetime.now(), "Registered products with warehouse ", file = f)
+            if taken:
+                print(datetime.datetime.now(), "Recorded transaction for purchase from ", len(parts), " sellers in warehouse", file = f)
+            else:
+                print(datetime.datetime.now(), "Could not take the split ", parts, file = f)
+        return taken, version, {seller_peer_id: data[seller_peer_id] for seller_peer_id in seller_ids}
+
+    def record_buyers(self, seller_peer_id, buyer_ids):
+        """
+        Record the buyers of a seller in its bounded history
+        :param seller_peer_id: seller peer id
+        :param buyer_ids: list of buyer ids
+        :return: nothing
+        """
+        if seller_peer_id not in self.buyer_history:
+            spill_file = "buyer_history_" + seller_peer_id + ".txt" if self.buyer_history_spill else None
+            self.buyer_history[seller_peer_id] = BuyerHistory(self.buyer_history_size, spill_file)
+        for buyer_id in buyer_ids:
+            self.buyer_history[seller_peer_id].add(buyer_id)
+
+    @Pyro5.server.expose
+    def get_buyer_history(self, seller_peer_id):
+        """
+        Get the buyers of a seller
+        :param seller_peer_id: seller peer id
+        :return: the most recent buyers, purchases per buyer and total purchases
+        """
+        if seller_peer_id not in self.buyer_history:
+            return {"recent": [], "counts": {}, "total": 0}
+        history = self.buyer_history[seller_peer_id]
+        return {"recent": history.recent(), "counts": dict(history.counts), "total": history.total}
+
+    def expire_leases(self, data):
+        """
+        Return the unsold units of expired leases to the warehouse stock
+        Units sold but not settled yet come back with them, the trader's late settlement takes them out again
+        Must be called with storage_semaphore held
+        :param data: seller information loaded from the warehouse
+        :return: list of the ids of the sellers whose stock changed
+        """
+        now = time.time()
+        expired = [lease for lease in self.load_leases().values() if not lease["returned"] and lease["expires"] <= now]
+        changed = [self.return_lease(data, lease) for lease in expired]
+        if expired:
+            self.save_leases()
+        return changed
+
+    def leased_sellers(self):
+        """
+        Get the sellers with units out on a lease, which expire_leases may return units to
+        Must be called with storage_semaphore held
+        :return: list of seller ids
+        """
+        return [lease["seller"]["id"] for lease in self.load_leases().values() if not lease["returned"]]
+
+    def return_lease(self, data, lease):
+        """
+        Put the unsold units of a lease back in stock, remembering the lease for late settlements
+        The oldest returned leases beyond order_log_size are forgotten
+        :param data: seller information loaded from the warehouse
+        :param lease: the lease
+        :return: the id of the seller of the lease
+        """
+        data[lease["seller"]["id"]]["product_count"] += lease["units"]
+        lease["units"] = 0
+        lease["returned"] = True
+        self.granted_leases.move_to_end(lease["lease_id"])
+        returned = [lease_id for lease_id, granted in self.granted_leases.items() if granted["returned"]]
+        for lease_id in returned[:max(0, len(returned) - self.order_log_size)]:
+            del self.granted_leases[lease_id]
+        return lease["seller"]["id"]
+
+    def load_leases(self):
+        """
+        Load the leases granted to traders, kept in leases.json next to the warehouse so they outlive a restart
+        Must be called with storage_semaphore held
+        :return: ordered dictionary of lease id to lease
+        """
+        if self.granted_leases is None:
+            self.granted_leases = OrderedDict()
+            if os.path.exists("leases.json"):
+                with open("leases.json") as f:
+                    self.granted_leases = OrderedDict(json.load(f))
+        return self.granted_leases
+
+    def load_batches(self):
+        """
+        Load the write-behind batches applied to the warehouse, kept in batches.json next to the warehouse so they outlive a restart
+        Must be called with storage_semaphore held
+        :return: dictionary of batch id to the units and buyers applied per seller
+        """
+        if self.applied_batches is None:
+            self.applied_batches = {}
+            if os.path.exists("batches.json"):
+                with open("batches.json") as f:
+                    self.applied_batches = json.load(f)
+        return self.applied_batches
+
+    def save_batches(self):
+        """
+        Save the write-behind batches applied to the warehouse
+        Must be called with storage_semaphore held
+        :return: nothing
+        """
+        with open("batches.json.tmp","w") as f:
+            json.dump(self.applied_batches, f)
+        os.replace("batches.json.tmp","batches.json")
+
+    def save_leases(self):
+        """
+        Save the leases granted to traders
+        Must be called with storage_semaphore held
+        :return: nothing
+        """
+        with open("leases.json.tmp","w") as f:
+            json.dump(list(self.granted_leases.items()), f)
+        os.replace("leases.json.tmp","leases.json")
 
     @Pyro5.server.expose
     def load_state(self):
@@ -999,12 +2882,464 @@ class Peer(Process):
         Load the state of the peer
         :return: nothing
         """
-        if os.path.exists("seller_information.json"):
-            self.storage_semaphore.acquire()
-            with open("seller_information.json") as sell:
-                self.seller_information = json.load(sell)
-            # if self.id in self.seller_information.keys():
+        self.storage_semaphore.acquire()
+        try:
+            # A mapped warehouse is read in place, and the server owns the warehouse
+            if self.inventory_format == "mmap" and isinstance(self.seller_information, SellerCache) and self.role != "server":
+                self.refresh_products()
+            elif self.inventory_format == "mmap" or self.role == "server":
+                self.seller_information = self.load_warehouse()
+            else:
+                self.catch_up()
+        finally:
+            self.storage_semaphore.release()
+
+    def refresh_products(self):
+        """
+        Read the products resident in the bounded seller cache again from the mapped warehouse
+        Must be called with storage_semaphore held
+        :return: nothing
+        """
+        if self.open_inventory() is None:
+            return
+        for product in list(self.seller_information.products):
+            sellers = {sl["seller"]["id"]: sl for sl in self.inventory.sellers_of(product)}
+            for seller_peer_id in self.seller_information.put_product(product, sellers):
+                self.seller_versions.pop(seller_peer_id, None)
+
+    def single_flight(self, key, reload):
+        """
+        Run a reload once for the callers that need it at the same time, and for those that need it again within reload_window
+        :param key: what is reloaded, a product name or "warehouse" for the whole cache
+        :param reload: function doing the reload
+        :return: the result of the reload, shared by every caller
+        """
+        self.reload_sem.acquire()
+        try:
+            # the reload in flight or finished within reload_window, with the time it finished
+            future, finished = self.reloads.get(key, (None, None))
+            shared = future is not None and (finished is None or time.time() - finished < self.reload_window)
+            if shared:
+                self.reload_shared += 1
+            else:
+                future = Future()
+                self.reloads[key] = (future, None)
+                self.reload_count += 1
+        finally:
+            self.reload_sem.release()
+        if shared:
+            return future.result()
+
+        try:
+            result = reload()
+        except Exception as e:
+            # a failed reload is not reused, the next miss tries again
+            self.reload_sem.acquire()
+            self.reloads.pop(key, None)
+            self.reload_sem.release()
+            future.set_exception(e)
+            raise
+        self.reload_sem.acquire()
+        self.reloads[key] = (future, time.time())
+        self.reload_sem.release()
+        future.set_result(result)
+        return result
+
+    @Pyro5.server.expose
+    def get_reload_stats(self):
+        """
+        Get the number of cache reloads run by the trader and the number of misses that shared one
+        :return: dictionary of reloads and shared misses
+        """
+        return {"reloads": self.reload_count, "shared": self.reload_shared}
+
+    def catch_up(self):
+        """
+        Bring the trader's seller information up to date, with only the sellers changed since its version when possible
+        :return: nothing
+        """
+        try:
+            with self.transport.proxy(self.neighbors["server9"]) as server:
+                changes = None
+                if self.cache_version is not None:
+                    version, changes = server.get_warehouse_changes(self.cache_version)
+                if changes is None:
+                    if isinstance(self.seller_information, SellerCache):
+                        # A bounded cache reads again only the sellers of its resident products
+                        version, changes = server.get_product_sellers(list(self.seller_information.products))
+                    else:
+                        version, changes = server.get_warehouse_snapshot()
+                    with open("trader_" + self.id + ".txt","a+") as f:
+                        print(datetime.datetime.now(), "Loaded warehouse snapshot at version ", version, file = f)
+                    # versions count from the time the warehouse started, so a restarted warehouse is ahead of every version kept.
+                    # A version below the cache's only comes from a server whose clock went back, and the kept versions would hide its sellers
+                    if self.cache_version is not None and version < self.cache_version:
+                        self.seller_versions = {}
+                self.merge_sellers(version, changes)
+                self.cache_version = version
+        except Pyro5.errors.CommunicationError:
+            # Read the file directly and take a snapshot again once the warehouse answers
+            if isinstance(self.seller_information, SellerCache):
+                # The whole file does not fit a bounded cache, its products are filled again on demand
+                self.seller_information.clear()
+            else:
+                self.seller_information = self.load_warehouse()
+            self.seller_versions = {}
+            self.cache_version = None
+
+    def merge_sellers(self, version, changes):
+        """
+        Apply seller information read at a warehouse version, keeping the entries already known at a later version
+        Must be called with storage_semaphore held
+        :param version: the warehouse version the seller information was read at
+        :param changes: seller information of the changed sellers
+        :return: nothing
+        """
+        self.transaction_semaphore.acquire()
+        try:
+            for seller_peer_id, seller_info in changes.items():
+                if self.seller_versions.get(seller_peer_id, -1) > version:
+                    continue
+                # Sales not written behind yet are missing from the warehouse's counts
+                seller_info["product_count"] -= self.unflushed_count(seller_peer_id)
+                self.seller_information[seller_peer_id] = seller_info
+                # A bounded cache keeps no versions of the sellers of products it does not hold
+                if seller_peer_id in self.seller_information:
+                    self.seller_versions[seller_peer_id] = version
+        finally:
+            self.transaction_semaphore.release()
+
+    def share_sellers(self, version, changes):
+        """
+        Apply the seller information returned by a warehouse update, and gossip it to the other traders
+        :param version: the warehouse version after the update
+        :param changes: seller information of the updated sellers
+        :return: nothing
+        """
+        self.storage_semaphore.acquire()
+        try:
+            self.merge_sellers(version, copy.deepcopy(changes))
+        finally:
+            self.storage_semaphore.release()
+        if not self.gossip_interval:
+            return
+
+        self.gossip_sem.acquire()
+        self.gossip_seq += 1
+        update = {"seq": self.gossip_seq, "version": version, "changes": changes}
+        self.gossip_log.append(update)
+        self.gossip_sem.release()
+        targets = {trader: self.neighbors[trader] for trader in self.other_traders()}
+        if targets:
+            # pushed in the background, so the sale does not wait for the other traders
+            self.executor.submit(self.broadcaster.broadcast, targets, "receive_gossip", (self.id, update))
+
+    def other_traders(self):
+        """
+        Get the ids of the other traders
+        :return: list of trader ids
+        """
+        return [trader for trader in self.trader_ids() if trader != self.id and trader in self.neighbors]
+
+    @Pyro5.server.expose
+    def receive_gossip(self, trader_id, update):
+        """
+        Apply a seller update gossiped by another trader, and repair the updates missed before it
+        :param trader_id: id of the trader that sent the update
+        :param update: sequence number, warehouse version and seller information of the update
+        :return: False if the peer is not a trader, True otherwise
+        """
+        self.record("receive_gossip", trader_id, update)
+        if self.role != "trader":
+            return False
+        self.gossip_sem.acquire()
+        last = self.gossip_seen.get(trader_id, 0)
+        self.gossip_seen[trader_id] = max(last, update["seq"])
+        self.gossip_sem.release()
+
+        self.storage_semaphore.acquire()
+        try:
+            self.merge_sellers(update["version"], update["changes"])
+        finally:
+            self.storage_semaphore.release()
+        if update["seq"] > last + 1:
+            self.executor.submit(self.repair_gossip, trader_id, last)
+        return True
+
+    @Pyro5.server.expose
+    def get_gossip(self, since):
+        """
+        Get the seller updates sent after a sequence number
+        :param since: the sequence number of the last update the caller received
+        :return: the current sequence number, and the updates after since or None if some of them were dropped from the log
+        """
+        self.gossip_sem.acquire()
+        try:
+            if since > self.gossip_seq:
+                # the caller heard from an earlier run of this trader
+                since = 0
+            if since < self.gossip_seq - len(self.gossip_log):
+                return self.gossip_seq, None
+            return self.gossip_seq, [update for update in self.gossip_log if update["seq"] > since]
+        finally:
+            self.gossip_sem.release()
+
+    def repair_gossip(self, trader_id, since):
+        """
+        Fetch the seller updates of another trader missed after a sequence number, catching up with the warehouse if they are gone
+        :param trader_id: id of the other trader
+        :param since: the sequence number of the last update received from it
+        :return: nothing
+        """
+        try:
+            with self.transport.proxy(self.neighbors[trader_id]) as trader:
+                seq, updates = trader.get_gossip(since)
+        except Pyro5.errors.CommunicationError as e:
+            print(datetime.datetime.now(), self.id, "could not repair gossip from", trader_id, e)
+            return
+        if updates is None:
+            with open("trader_" + self.id + ".txt","a+") as f:
+                print(datetime.datetime.now(), "Missed gossip of trader ", trader_id, ", catching up with the warehouse", file = f)
+            self.single_flight("warehouse", self.load_state)
+            updates = []
+        self.storage_semaphore.acquire()
+        try:
+            for update in updates:
+                self.merge_sellers(update["version"], update["changes"])
+        finally:
             self.storage_semaphore.release()
+        self.gossip_sem.acquire()
+        if seq < self.gossip_seen.get(trader_id, 0):
+            # the other trader restarted its sequence
+            self.gossip_seen[trader_id] = seq
+        else:
+            self.gossip_seen[trader_id] = max(self.gossip_seen.get(trader_id, 0), seq)
+        self.gossip_sem.release()
+
+    def gossip_loop(self):
+        """
+        Repair missed gossip with every other trader every gossip_interval seconds while the peer is a trader
+        :return: nothing
+        """
+        while self.role == "trader":
+            time.sleep(self.gossip_interval)
+            for trader_id in self.other_traders():
+                try:
+                    self.repair_gossip(trader_id, self.gossip_seen.get(trader_id, 0))
+                except Exception as e:
+                    print(datetime.datetime.now(), "Exception in gossip_loop", e)
+
+    @Pyro5.server.expose
+    def get_warehouse_snapshot(self):
+        """
+        Get the whole warehouse and its version
+        :return: version, seller information of every seller
+        """
+        self.storage_semaphore.acquire()
+        try:
+            self.load_snapshot()
+            return self.warehouse_version, self.warehouse_snapshot
+        finally:
+            self.storage_semaphore.release()
+
+    @Pyro5.server.expose
+    def get_warehouse_changes(self, since):
+        """
+        Get the sellers changed after a version of the warehouse
+        :param since: the version the caller is at
+        :return: the current version, and the seller information of every changed seller or None if the caller needs a snapshot
+        """
+        self.storage_semaphore.acquire()
+        try:
+            # a version from before a server restart is below warehouse_changes_from, like one older than the change log,
+            # and neither can be caught up
+            if since > self.warehouse_version or since + 1 < self.warehouse_changes_from:
+                return self.warehouse_version, None
+            changed = set()
+            for version, seller_id in reversed(self.warehouse_changes):
+                if version <= since:
+                    break
+                changed.add(seller_id)
+            return self.warehouse_version, {seller_id: self.warehouse_snapshot[seller_id] for seller_id in changed}
+        finally:
+            self.storage_semaphore.release()
+
+    @Pyro5.server.expose
+    def get_product_sellers(self, products):
+        """
+        Get the sellers of some products and the warehouse version, without the rest of the warehouse
+        :param products: list of product names
+        :return: version, seller information of every seller of the products
+        """
+        self.storage_semaphore.acquire()
+        try:
+            self.load_snapshot()
+            return self.warehouse_version, {seller_id: self.warehouse_snapshot[seller_id] for product in products for seller_id in self.product_stock.get(product, {})}
+        finally:
+            self.storage_semaphore.release()
+
+    def track_changes(self, data, changed=None):
+        """
+        Give the warehouse a new version if any seller changed, and remember which sellers did
+        :param data: seller information being saved, at least of every seller in changed
+        :param changed: ids of the sellers the write may have changed, None to compare every seller
+        :return: nothing
+        """
+        # the warehouse is not written yet, so a snapshot loaded now holds the sellers before the write
+        self.load_snapshot()
+        candidates = data.keys() if changed is None else dict.fromkeys(changed)
+        previous = {seller_id: self.warehouse_snapshot[seller_id] for seller_id in candidates if seller_id in self.warehouse_snapshot}
+        changed = [seller_id for seller_id in candidates if previous.get(seller_id) != data[seller_id]]
+        if changed:
+            self.warehouse_version += 1
+            for seller_id in changed:
+                if len(self.warehouse_changes) == self.warehouse_changes.maxlen:
+                    self.warehouse_changes_from = self.warehouse_changes[0][0] + 1
+                self.warehouse_changes.append((self.warehouse_version, seller_id))
+                self.warehouse_snapshot[seller_id] = data[seller_id]
+            self.update_views(previous, data, changed)
+
+    def load_snapshot(self):
+        """
+        Load the warehouse the server has not written yet, and build the product views from it
+        :return: nothing
+        """
+        if self.warehouse_snapshot is None:
+            self.warehouse_snapshot = self.load_warehouse()
+            self.update_views({}, self.warehouse_snapshot, list(self.warehouse_snapshot))
+
+    def update_views(self, previous, data, changed):
+        """
+        Apply the changed sellers to the running totals of their products
+        :param previous: seller information before the change
+        :param data: seller information after the change
+        :param changed: ids of the changed sellers
+        :return: nothing
+        """
+        products = set()
+        for seller_id in changed:
+            if seller_id in previous:
+                product = previous[seller_id]["product_name"]
+                count = self.product_stock[product].pop(seller_id)
+                view = self.product_views[product]
+                view["total_stock"] -= count
+                view["sellers"] -= 1
+                view["sellers_in_stock"] -= count > 0
+                products.add(product)
+            product = data[seller_id]["product_name"]
+            count = data[seller_id]["product_count"]
+            self.product_stock.setdefault(product, {})[seller_id] = count
+            view = self.product_views.setdefault(product, {"product_name": product, "total_stock": 0, "sellers": 0, "sellers_in_stock": 0, "top_sellers": [], "version": 0})
+            view["total_stock"] += count
+            view["sellers"] += 1
+            view["sellers_in_stock"] += count > 0
+            if count > 0:
+                heapq.heappush(self.product_heaps.setdefault(product, []), (-count, seller_id))
+            products.add(product)
+
+        # only the top sellers of the changed products are ranked again
+        for product in products:
+            self.product_views[product]["top_sellers"] = self.rank_sellers(product)
+            self.product_views[product]["version"] = self.warehouse_version
+
+    def rank_sellers(self, product):
+        """
+        Get the top_sellers sellers of a product with the most stock from its heap
+        Entries pushed before a seller's stock changed again are dropped as they reach the top of the heap
+        :param product: name of the product
+        :return: list of seller id and stock, most stock first
+        """
+        stock = self.product_stock[product]
+        heap = self.product_heaps.setdefault(product, [])
+        if len(heap) > 2 * len(stock) + self.top_sellers:
+            # outdated entries outnumber the sellers, so the heap is built again from the current stock
+            heap[:] = [(-count, seller_id) for seller_id, count in stock.items() if count > 0]
+            heapq.heapify(heap)
+        top = []
+        while heap and len(top) < self.top_sellers:
+            count, seller_id = heapq.heappop(heap)
+            # a seller whose stock went back to an earlier count has two current entries, the second is dropped
+            if stock.get(seller_id) == -count and all(seller["seller"] != seller_id for seller in top):
+                top.append({"seller": seller_id, "product_count": -count})
+        for seller in top:
+            heapq.heappush(heap, (-seller["product_count"], seller["seller"]))
+        return top
+
+    @Pyro5.server.expose
+    def get_product_view(self, product):
+        """
+        Get the running totals of a product without reading the warehouse
+        :param product: name of the product
+        :return: total stock, number of sellers, sellers in stock, top sellers and warehouse version, or None for an unknown product
+        """
+        self.storage_semaphore.acquire()
+        try:
+            self.load_snapshot()
+            view = self.product_views.get(product)
+            return dict(view) if view is not None else None
+        finally:
+            self.storage_semaphore.release()
+
+    @Pyro5.server.expose
+    def get_product_views(self):
+        """
+        Get the running totals of every product without reading the warehouse
+        :return: dictionary of product name to its totals
+        """
+        self.storage_semaphore.acquire()
+        try:
+            self.load_snapshot()
+            return {product: dict(view) for product, view in self.product_views.items()}
+        finally:
+            self.storage_semaphore.release()
+
+    def open_inventory(self):
+        """
+        Map the memory-mapped warehouse, the server creates it and traders wait until it exists
+        :return: the inventory, or None if the server has not created it yet
+        """
+        if self.inventory is None and (self.role == "server" or os.path.exists("seller_information.mmap")):
+            self.inventory = MappedInventory("seller_information.mmap", self.products, self.inventory_capacity, writable=self.role == "server")
+        return self.inventory
+
+    def load_warehouse(self, seller_ids=None):
+        """
+        Load the whole warehouse, or only some sellers of the memory-mapped warehouse
+        :param seller_ids: ids of the sellers to read from the memory-mapped warehouse, None for every seller.
+            The JSON warehouse is always loaded whole
+        :return: seller information of every seller read
+        """
+        if self.inventory_format == "mmap":
+            inventory = self.open_inventory()
+            return inventory.to_dict(seller_ids) if inventory is not None else {}
+        if not os.path.exists("seller_information.json"):
+            return {}
+        with open("seller_information.json") as sell:
+            return json.load(sell)
+
+    def save_warehouse(self, data, changed=None):
+        """
+        Save the warehouse atomically so that traders never read a partially written file
+        :param data: seller information to save
+        :param changed: ids of the sellers the write may have changed, None to compare every seller
+        :return: nothing
+        """
+        if self.role == "server":
+            self.track_changes(data, changed)
+        if self.inventory_format == "mmap":
+            # Only the changed counts are written, in place
+            inventory = self.open_inventory()
+            inventory.refresh_index()
+            for peer_id in (data.keys() if changed is None else dict.fromkeys(changed)):
+                seller_info = data[peer_id]
+                if peer_id not in inventory.index:
+                    inventory.add(peer_id, seller_info["seller"]["bully_id"], seller_info["product_name"], seller_info["product_count"])
+                elif inventory.read(inventory.index[peer_id])[3] != seller_info["product_count"]:
+                    inventory.update(peer_id, seller_info["product_count"])
+            return
+        with open("seller_information.json.tmp","w") as sell:
+            json.dump(data,sell)
+        os.replace("seller_information.json.tmp","seller_information.json")
 
     @Pyro5.server.expose
     def put_log(self,tlog,transactions_file,completed,available):
@@ -1016,22 +3351,28 @@ class Peer(Process):
         :param available: boolean indicating if the previous transaction was available as logged
         :return: nothing
         """
+        # A buyer may have several orders outstanding, so entries are kept per order when the order has an id
+        key = tlog["order"] if tlog.get("order") is not None else tlog["buyer"]
         self.transaction_semaphore.acquire()
-        if not completed and available:
-            self.transaction_information[tlog["buyer"]] = tlog
-        else:
-            del self.transaction_information[tlog["buyer"]]
-        with open(transactions_file,"w") as transact:
-            json.dump(self.transaction_information,transact)
-        self.transaction_semaphore.release()
+        try:
+            if not completed and available:
+                self.transaction_information[key] = tlog
+            else:
+                self.transaction_information.pop(key, None)
+            with open(transactions_file,"w") as transact:
+                json.dump(self.transaction_information,transact)
+        finally:
+            self.transaction_semaphore.release()
 
 def exit_handler():
     """
     Exit handler
     :return: nothing
     """
-    os.remove("seller_information.json")
-    for f in glob.glob("transactions_*.json"):
+    for f in ["seller_information.json", "seller_information.mmap", "leases.json", "batches.json"]:
+        if os.path.exists(f):
+            os.remove(f)
+    for f in glob.glob("transactions_*.json") + glob.glob("orders_trader_*.jsonl"):
         os.remove(f)
     # os.remove("transactions_trader_0.json")
     # os.remove("transactions_trader_1.json")
@@ -0,0 +1,82 @@
+# sampling profiler that can be started and stopped inside a running peer process
+import sys
+import threading
+from collections import Counter
+import time
+
+
+class StackSampler:
+    """
+    The StackSampler class periodically samples the stacks of every thread of the process.
+    Samples are aggregated as collapsed stacks, one "thread;frame;...;frame count" line per distinct stack,
+    which is the input format of flamegraph.pl and speedscope.
+    It has the following methods:
+    1. start - Start sampling in a background thread
+    2. stop - Stop sampling
+    3. collapsed - Get the collapsed stacks
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        Construct a new 'StackSampler' object.
+
+        :param interval: The time between two samples in seconds
+        :return: returns nothing
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start sampling in a background thread
+        :return: nothing
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampling thread to exit
+        :return: nothing
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def sample_loop(self):
+        """
+        Take a sample every interval until stopped
+        :return: nothing
+        """
+        own_id = threading.get_ident()
+        while self.running:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(code.co_name + " (" + code.co_filename.rsplit("/", 1)[-1] + ":" + str(code.co_firstlineno) + ")")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self, prefix=None):
+        """
+        Get the collapsed stacks
+        :param prefix: The frame prepended to every stack, used to tell processes apart in an aggregate
+        :return: collapsed stacks, one per line
+        """
+        lines = []
+        for stack, count in self.stacks.most_common():
+            if prefix:
+                stack = prefix + ";" + stack
+            lines.append(stack + " " + str(count))
+        return "\n".join(lines) + "\n" if lines else ""
@@ -0,0 +1,136 @@
+# Deterministic replay of a recorded workload against an in-memory topology
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import random
+import sys
+import time
+import numpy as np
+from config import MarketConfig, PeerConfig
+from peer import Peer
+from transport import InMemoryTransport
+from workload import load_trace
+
+# calls that originate from buyers and sellers, the warehouse calls they cause are replayed by the traders
+DRIVER_CALLS = ["trading_lookup", "trading_basket_lookup", "register_products"]
+
+def get_topology(records):
+    """
+    Find the traders, buyers, sellers and products of a recorded workload
+    :param records: list of recorded calls
+    :return: traders, buyers, sellers mapped to their product, products
+    """
+    traders, buyers, sellers = [], [], {}
+    for record in records:
+        if record["call"] not in DRIVER_CALLS:
+            continue
+        if record["peer"] not in traders:
+            traders.append(record["peer"])
+        if record["call"] == "register_products":
+            seller_info = record["args"][0]
+            sellers[seller_info["seller"]["id"]] = seller_info["product_name"]
+        elif record["args"][0]["id"] not in buyers:
+            buyers.append(record["args"][0]["id"])
+    products = sorted(set(sellers.values()) | set(record["args"][1] for record in records if record["call"] == "trading_lookup"))
+    return traders, buyers, sellers, products
+
+def get_peers(records, transport):
+    """
+    Create the peers of the recorded topology, with the traders already in place
+    :param records: list of recorded calls
+    :param transport: The in-memory transport shared by all peers
+    :return: the list of peers
+    """
+    traders, buyers, sellers, products = get_topology(records)
+    n_items = 5
+    product_time = 3
+    peers = []
+    config = PeerConfig(market=MarketConfig(n_items, product_time, len(traders)))
+
+    def make_peer(id, bully_id, role):
+        return Peer(id, bully_id, role, products, "localhost", config, transport=transport)
+
+    for i, id in enumerate(traders):
+        peers.append(make_peer(id, i, "trader"))
+    for i, id in enumerate(buyers):
+        if id not in traders:
+            peers.append(make_peer(id, len(peers), "buyer"))
+    for id in sellers:
+        if id not in traders:
+            peer = make_peer(id, len(peers), "seller")
+            peer.product_name = sellers[id]
+            peers.append(peer)
+    peers.append(make_peer("server9", -1, "server"))
+
+    for peer in peers:
+        peer.ns = peer.get_nameserver(peer.hostname)
+        peer.register_name(peer.transport.bind(peer))
+    for peer in peers:
+        peer.get_neighbors(announce=False)
+        # registrations come from the trace, not from the sellers' restock timers
+        peer.restocking = True
+        peer.setTrader(traders)
+    return peers
+
+def replay(records, transport, pacing, workers):
+    """
+    Re-drive the recorded buy requests and registrations against their traders
+    :param records: list of recorded calls
+    :param transport: The in-memory transport of the topology
+    :param pacing: "fast" to replay back to back in trace order, "recorded" to keep the recorded timing
+    :param workers: The number of threads replaying calls concurrently with recorded pacing
+    :return: the latency of every replayed call by call name
+    """
+    calls = [record for record in records if record["call"] in DRIVER_CALLS]
+    latencies = {call: [] for call in DRIVER_CALLS}
+
+    def dispatch(record):
+        start = time.time()
+        try:
+            with transport.proxy(record["peer"]) as trader:
+                getattr(trader, record["call"])(*record["args"])
+        except Exception as e:
+            print(datetime.datetime.now(), "Exception in replay of ", record["call"], e)
+        latencies[record["call"]].append(time.time() - start)
+
+    if pacing == "fast":
+        for record in calls:
+            dispatch(record)
+        return latencies
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    start = time.time()
+    for record in calls:
+        delay = record["t"] - calls[0]["t"] - (time.time() - start)
+        if delay > 0:
+            time.sleep(delay)
+        pool.submit(dispatch, record)
+    pool.shutdown()
+    return latencies
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or len(sys.argv) > 4:
+        print("Incorrect number of arguments, the correct command is python3 replay.py trace_glob [fast|recorded] [seed]")
+        sys.exit()
+    pattern = sys.argv[1]
+    pacing = sys.argv[2] if len(sys.argv) > 2 else "fast"
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    random.seed(seed)
+    records = load_trace(pattern)
+    transport = InMemoryTransport(seed=seed)
+    peers = get_peers(records, transport)
+
+    start = time.time()
+    latencies = replay(records, transport, pacing, 32)
+    elapsed = time.time() - start
+    for peer in peers:
+        if peer.role == "trader":
+            peer.role = "retire"
+
+    total = sum(len(values) for values in latencies.values())
+    print(datetime.datetime.now(), "Replayed", total, "calls in", round(elapsed, 3), "s,", round(total / elapsed, 2), "calls per second")
+    for call, values in latencies.items():
+        if values:
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            print(call, ":", len(values), "calls, latency p50", round(p50, 3), "ms, p95", round(p95, 3), "ms, p99", round(p99, 3), "ms")
@@ -0,0 +1,133 @@
+# Single process simulation of the bazaar - peers run as asyncio tasks over an in-memory transport
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import datetime
+import random
+import sys
+import time
+from config import HeartbeatConfig, MarketConfig, PeerConfig
+from peer import Peer
+from transport import InMemoryTransport
+
+def get_peers(n_peers, transport, heartbeat=None):
+    """
+    Create the peers of the simulated bazaar, with the same role mix as join.py
+    :param n_peers: The number of buyers and sellers
+    :param transport: The in-memory transport shared by all peers
+    :param heartbeat: The heartbeat settings of the traders, None to not watch each other
+    :return: the list of peers
+    """
+    n_items = 5
+    n_traders = 2
+    product_time = 3
+    roles = ['buyer', 'seller']
+    products = ['fish', 'salt', 'boar']
+    with_cache = True
+    peers = []
+    config = PeerConfig(market=MarketConfig(n_items, product_time, n_traders, with_cache), heartbeat=heartbeat if heartbeat is not None else HeartbeatConfig())
+
+    def make_peer(id, bully_id, role):
+        return Peer(id, bully_id, role, products, "localhost", config, transport=transport.endpoint(id))
+
+    # ensures at least 1 seller and 1 buyer
+    peers.append(make_peer('seller' + str(n_peers-2), n_peers-2, 'seller'))
+    peers.append(make_peer('buyer' + str(n_peers-1), n_peers-1, 'buyer'))
+
+    # add n_peers-2 buyers and sellers
+    for i in range(n_peers - 2):
+        role = roles[random.randint(0,len(roles) - 1)]
+        peers.append(make_peer(role + str(i), i, role))
+
+    peers.append(make_peer('server9', -1, 'server'))
+    return peers
+
+async def seller_loop(peer, loop, pool, deadline):
+    """
+    Restock the seller every product_time seconds
+    :return: nothing
+    """
+    while time.time() < deadline:
+        if peer.role == "seller":
+            try:
+                await loop.run_in_executor(pool, peer.startSellerTrading)
+            except Exception as e:
+                print(datetime.datetime.now(), "Exception in seller_loop", e)
+        await asyncio.sleep(peer.product_time)
+
+async def buyer_loop(peer, loop, pool, deadline, stats):
+    """
+    Send buy requests back to back until the deadline
+    :return: nothing
+    """
+    while time.time() < deadline:
+        if peer.role == "buyer":
+            try:
+                if await loop.run_in_executor(pool, peer.sendBuyRequest):
+                    stats["completed"] += 1
+                else:
+                    stats["rejected"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                print(datetime.datetime.now(), "Exception in buyer_loop", e)
+        await asyncio.sleep(1)
+
+async def simulate(peers, duration, workers):
+    """
+    Join all peers, elect the traders and run the market for the given duration
+    :return: the request statistics
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    for peer in peers:
+        peer.ns = peer.get_nameserver(peer.hostname)
+        peer.register_name(peer.transport.bind(peer))
+        peer.announce()
+    for peer in peers:
+        peer.get_neighbors(announce=False)
+        # seller_loop below drives the restock timer instead of a thread per seller
+        peer.restocking = True
+
+    # peer 0 elects the traders, exactly as in the networked mode
+    # the election does not retry lost messages, so faults are only injected once trading starts
+    transport = peers[0].transport.transport
+    latency, loss = transport.latency, transport.loss
+    transport.latency, transport.loss = 0.0, 0.0
+    coordinator = [peer for peer in peers if peer.bully_id == 0][0]
+    await loop.run_in_executor(pool, coordinator.elect_traders)
+    transport.latency, transport.loss = latency, loss
+
+    stats = {"completed": 0, "rejected": 0, "failed": 0}
+    start = time.time()
+    deadline = start + duration
+    tasks = []
+    for peer in peers:
+        if peer.role == "seller":
+            tasks.append(seller_loop(peer, loop, pool, deadline))
+        elif peer.role == "buyer":
+            tasks.append(buyer_loop(peer, loop, pool, deadline, stats))
+    await asyncio.gather(*tasks)
+    stats["elapsed"] = time.time() - start
+
+    # stop heartbeat loops so the process can exit
+    for peer in peers:
+        if peer.role == "trader":
+            peer.role = "retire"
+    pool.shutdown()
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or len(sys.argv) > 6:
+        print("Incorrect number of arguments, the correct command is python3 simulate.py number_of_peers duration_in_sec [latency_in_ms] [loss_rate] [timeout_in_sec]")
+        sys.exit()
+    n_peers = int(sys.argv[1])
+    duration = float(sys.argv[2])
+    latency = float(sys.argv[3]) / 1000.0 if len(sys.argv) > 3 else 0.0
+    loss = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+    heartbeat_timeout = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+
+    transport = InMemoryTransport(latency, loss)
+    peers = get_peers(n_peers, transport, HeartbeatConfig(heartbeat_timeout > 0, heartbeat_timeout))
+    stats = asyncio.run(simulate(peers, duration, min(64, n_peers)))
+    print(datetime.datetime.now(), "Simulated", n_peers, "peers for", round(stats["elapsed"], 2), "s:", stats["completed"], "buy requests completed,", stats["rejected"], "rejected by busy traders,", stats["failed"], "failed,", round(stats["completed"] / stats["elapsed"], 2), "requests per second")
@@ -0,0 +1,116 @@
+# the modules under test live at the top of the repository
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from config import PeerConfig
+from peer import Peer
+from transport import InMemoryTransport
+
+
+class Market:
+    """
+    The Market class wires peers to each other over one in-memory transport, without a nameserver or an election.
+    Every call between them is recorded in calls as its sender, target and method.
+    It has the following methods:
+    1. add - Create a peer
+    2. connect - Make every peer a neighbor of the others and tell them the traders
+    3. stock - Register units of sellers with the warehouse
+    4. build - Create traders, the warehouse, sellers and buyers, connect them and stock the sellers
+    5. close - Stop the loops of the traders
+    """
+
+    def __init__(self):
+        """
+        Construct a new 'Market' object.
+
+        :return: returns nothing
+        """
+        self.transport = InMemoryTransport()
+        self.peers = {}
+        self.calls = []
+        deliver = self.transport.deliver
+
+        def recorded(uri, method, args, source=None):
+            self.calls.append((source, uri, method))
+            return deliver(uri, method, args, source)
+        self.transport.deliver = recorded
+
+    def add(self, peer_id, role, products=("fish",), **sections):
+        """
+        Create a peer, its bully id is the number of peers created before it
+        :param peer_id: The id of the peer
+        :param role: The role of the peer
+        :param products: The products the peer buys or sells
+        :param sections: Settings of the peer by section of config.PeerConfig, the others take their defaults
+        :return: the peer
+        """
+        peer = Peer(peer_id, len(self.peers), role, list(products), "localhost", PeerConfig(**sections), transport=self.transport.endpoint(peer_id))
+        self.transport.bind(peer)
+        self.peers[peer_id] = peer
+        return peer
+
+    def connect(self):
+        """
+        Make every peer a neighbor of the others and tell them the traders
+        :return: the market
+        """
+        traders = [peer_id for peer_id, peer in self.peers.items() if peer.role == "trader"]
+        for peer in self.peers.values():
+            peer.neighbors = {peer_id: peer_id for peer_id in self.peers if peer_id != peer.id}
+            peer.trader = list(traders)
+        return self
+
+    def stock(self, counts):
+        """
+        Register units of sellers with the warehouse
+        :param counts: dictionary of seller id to the units it adds
+        :return: the warehouse version and the seller information of every restocked seller
+        """
+        seller_infos = [{"seller": {"bully_id": self.peers[peer_id].bully_id, "id": peer_id}, "product_name": self.peers[peer_id].product_name, "product_count": count} for peer_id, count in counts.items()]
+        return self.peers["server9"].register_batch_with_warehouse(seller_infos)
+
+    def build(self, stock, traders=("seller0",), buyers=("buyer4",), products=None, load_state=False, trader_sections=None, server_sections=None, buyer_sections=None):
+        """
+        Create traders, the warehouse, sellers and buyers, connect them and stock the sellers
+        :param stock: dictionary of seller id to its units, in the order the sellers are created
+        :param traders: ids of the traders
+        :param buyers: ids of the buyers
+        :param products: dictionary of seller id to its product, fish for the sellers not in it
+        :param load_state: whether the traders load the warehouse before returning
+        :param trader_sections: settings of the traders by section of config.PeerConfig
+        :param server_sections: settings of the warehouse by section of config.PeerConfig
+        :param buyer_sections: settings of the buyers by section of config.PeerConfig
+        :return: the traders, the warehouse, the sellers and the buyers
+        """
+        products = products or {}
+        trader_peers = [self.add(peer_id, "trader", **(trader_sections or {})) for peer_id in traders]
+        server = self.add("server9", "server", **(server_sections or {}))
+        sellers = [self.add(peer_id, "seller", products=(products.get(peer_id, "fish"),)) for peer_id in stock]
+        buyer_peers = [self.add(peer_id, "buyer", **(buyer_sections or {})) for peer_id in buyers]
+        self.connect()
+        self.stock(stock)
+        if load_state:
+            for trader in trader_peers:
+                trader.load_state()
+        return trader_peers, server, sellers, buyer_peers
+
+    def close(self):
+        """
+        Stop the loops of the traders
+        :return: nothing
+        """
+        for peer in self.peers.values():
+            if peer.role == "trader":
+                peer.role = "retire"
+
+
+@pytest.fixture
+def market(tmp_path, monkeypatch):
+    # peers write their logs and the warehouse to the working directory
+    monkeypatch.chdir(tmp_path)
+    market = Market()
+    yield market
+    market.close()
@@ -0,0 +1,74 @@
+import random
+import threading
+import time
+import pytest
+from config import BuyerConfig, TraderConfig
+from faults import FaultInjector
+
+
+@pytest.fixture
+def two_traders(market):
+    def build(max_pending_requests=8, max_retries=3):
+        traders, _, _, buyers = market.build({"seller2": 5}, traders=("seller0", "seller1"), buyers=("buyer3", "buyer4"), load_state=True,
+                                             trader_sections={"trader": TraderConfig(max_pending_requests=max_pending_requests)},
+                                             buyer_sections={"buyer": BuyerConfig(max_retries=max_retries)})
+        return traders, buyers
+    return build
+
+
+def wait_for(condition, timeout=1):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_trader_rejects_requests_beyond_max_pending_requests(market, two_traders):
+    (trader, _), (buyer, other_buyer) = two_traders(max_pending_requests=1)
+    injector = FaultInjector()
+    market.transport.faults = injector
+    # the first request holds the only slot until its buyer answers
+    injector.inject({"fault": "pause", "target": "buyer3"})
+    first = threading.Thread(target=trader.trading_lookup, args=(buyer.tradingMessage(), "fish", 1))
+    first.start()
+    try:
+        wait_for(lambda: any(uri == "buyer3" for _, uri, _ in market.calls))
+        assert trader.trading_lookup(other_buyer.tradingMessage(), "fish", 1) is False
+        with open("trader_seller0.txt") as f:
+            assert "Busy, rejected request from buyer  buyer4" in f.read()
+    finally:
+        injector.heal({"fault": "pause", "target": "buyer3"})
+        first.join(1)
+    assert not first.is_alive()
+    # the slot is free again once the first request is answered
+    assert trader.trading_lookup(other_buyer.tradingMessage(), "fish", 1)
+    assert other_buyer.buy_request_done
+
+
+def test_rejected_buyer_backs_off_exponentially_with_jitter(monkeypatch, two_traders):
+    traders, (buyer, _) = two_traders(max_pending_requests=1, max_retries=3)
+    for trader in traders:
+        trader.admission_sem.acquire()
+    bounds, sleeps = [], []
+    uniform = random.Random(3).uniform
+    monkeypatch.setattr(random, "uniform", lambda low, high: bounds.append((low, high)) or uniform(low, high))
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+
+    assert not buyer.sendBuyRequest()
+    # no sleep after the last attempt, and the delay doubles from retry_backoff
+    assert bounds == [(0, 0.1), (0, 0.2), (0, 0.4)]
+    assert len(sleeps) == 3 and all(0 <= delay <= high for delay, (_, high) in zip(sleeps, bounds))
+    # full jitter, so buyers rejected together do not retry together
+    assert len(set(sleeps)) == 3
+
+
+def test_rejected_request_fails_over_to_the_other_trader(market, monkeypatch, two_traders):
+    (busy, free), (buyer, _) = two_traders(max_pending_requests=1)
+    busy.admission_sem.acquire()
+    monkeypatch.setattr(time, "sleep", lambda delay: None)
+    # the busy trader is tried first, and not again while the other has not rejected the request
+    monkeypatch.setattr(random, "choice", lambda candidates: candidates[0])
+
+    assert buyer.sendBuyRequest()
+    assert [uri for source, uri, method in market.calls if source == "buyer3" and method == "trading_lookup"] == ["seller0", "seller1"]
+    assert buyer.buy_request_done
@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.fixture
+def basket_market(market):
+    traders, server, sellers, buyers = market.build({"seller1": 3, "seller2": 2}, products={"seller2": "salt"})
+    return traders[0], server, sellers, buyers[0]
+
+
+def counts(server):
+    return {peer_id: seller_info["product_count"] for peer_id, seller_info in server.load_warehouse().items()}
+
+
+def test_full_basket_is_sold(basket_market):
+    trader, server, sellers, buyer = basket_market
+    assert trader.trading_basket_lookup(buyer.tradingMessage(), [{"product": "fish", "count": 2}, {"product": "salt", "count": 2}])
+    assert counts(server) == {"seller1": 1, "seller2": 0}
+    assert [seller.stock for seller in sellers] == [-2, -2]
+    assert buyer.buy_request_done
+
+
+def test_basket_beyond_the_stock_sells_nothing(basket_market):
+    trader, server, sellers, buyer = basket_market
+    assert trader.trading_basket_lookup(buyer.tradingMessage(), [{"product": "fish", "count": 2}, {"product": "salt", "count": 3}])
+    assert counts(server) == {"seller1": 3, "seller2": 2}
+    assert [seller.stock for seller in sellers] == [0, 0]
+    # like a single order beyond the supply, the buyer is not done
+    assert not buyer.buy_request_done
+
+
+def test_basket_with_an_unknown_product_sells_nothing(basket_market):
+    trader, server, sellers, buyer = basket_market
+    assert trader.trading_basket_lookup(buyer.tradingMessage(), [{"product": "fish", "count": 1}, {"product": "boar", "count": 1}])
+    assert counts(server) == {"seller1": 3, "seller2": 2}
+    assert [seller.stock for seller in sellers] == [0, 0]
+    # like a single order of a product nobody sells
+    assert buyer.buy_request_done
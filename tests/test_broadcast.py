@@ -0,0 +1,101 @@
+import time
+import Pyro5.server
+from broadcast import Broadcaster
+from config import BroadcastConfig
+from faults import FaultInjector
+
+
+class Recording:
+    """the transport of the sender, recording the peers it calls directly"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.uris = []
+
+    def proxy(self, uri):
+        self.uris.append(uri)
+        return self.transport.proxy(uri)
+
+
+class SlowPeer:
+    def __init__(self, delay):
+        self.delay = delay
+
+    @Pyro5.server.expose
+    def get_bully_id(self):
+        time.sleep(self.delay)
+        return -1
+
+
+def buyers(market, n_peers):
+    for i in range(n_peers):
+        market.add("buyer" + str(i), "buyer")
+    return {peer_id: peer_id for peer_id in market.peers}
+
+
+def test_slow_and_unknown_peers_do_not_delay_the_others(market):
+    targets = buyers(market, 3)
+    market.transport.peers["slow"] = SlowPeer(1.0)
+    targets["slow"] = "slow"
+    targets["gone"] = "gone"
+    start = time.time()
+    acks, failures = Broadcaster(market.transport, timeout=0.2).broadcast(targets, "get_bully_id")
+    assert time.time() - start < 0.9
+    assert acks == {"buyer0": 0, "buyer1": 1, "buyer2": 2}
+    assert failures["slow"] == "timed out"
+    assert set(failures) == {"slow", "gone"}
+
+
+def test_fanout_relays_through_subtrees(market):
+    targets = buyers(market, 7)
+    sender = Recording(market.transport)
+    acks, failures = Broadcaster(sender, timeout=1.0, fanout=2).broadcast(targets, "get_bully_id")
+    assert failures == {}
+    assert acks == {peer_id: int(peer_id[5:]) for peer_id in targets}
+    # the sender only calls the head of every subtree
+    assert sorted(sender.uris) == ["buyer0", "buyer1"]
+
+
+def test_unreachable_relay_does_not_cut_off_its_subtree(market):
+    targets = buyers(market, 7)
+    injector = FaultInjector()
+    injector.inject({"fault": "kill", "target": "buyer0"})
+    market.transport.faults = injector
+    acks, failures = Broadcaster(market.transport, timeout=1.0, fanout=2).broadcast(targets, "get_bully_id")
+    assert set(failures) == {"buyer0"}
+    assert set(acks) == set(targets) - {"buyer0"}
+
+
+def test_peer_broadcast_reaches_every_neighbor_once_through_relays(market):
+    sender = market.add("buyer0", "buyer", broadcast=BroadcastConfig(broadcast_timeout=1.0, broadcast_fanout=3))
+    for i in range(1, 20):
+        market.add("buyer" + str(i), "buyer", broadcast=BroadcastConfig(broadcast_timeout=1.0, broadcast_fanout=3))
+    market.connect()
+    traders = [{"bully_id": 99, "id": "seller99"}]
+    acks = sender.broadcast("setTrader", traders)
+    assert set(acks) == set(sender.neighbors)
+    # every neighbor took the message and the sender kept its own traders
+    assert all(peer.trader == traders for peer_id, peer in market.peers.items() if peer_id != "buyer0")
+    assert sender.trader == []
+    delivered = [uri for _, uri, method in market.calls if method in ["setTrader", "relay_broadcast"]]
+    assert sorted(delivered) == sorted(sender.neighbors)
+    # the sender only calls the heads of its 3 subtrees, which relay on to the heads of theirs
+    assert len([source for source, _, _ in market.calls if source == "buyer0"]) == 3
+    relays = {source for source, _, method in market.calls if method == "relay_broadcast" and source != "buyer0"}
+    assert relays and relays < set(sender.neighbors)
+
+
+def test_slow_peer_in_a_subtree_times_out_alone(market):
+    targets = buyers(market, 9)
+
+    @Pyro5.server.expose
+    def slow_bully_id():
+        time.sleep(1.0)
+        return -1
+    market.peers["buyer5"].get_bully_id = slow_bully_id
+    start = time.time()
+    acks, failures = Broadcaster(market.transport, timeout=0.2, fanout=2).broadcast(targets, "get_bully_id")
+    assert failures == {"buyer5": "timed out"}
+    assert acks == {peer_id: int(peer_id[5:]) for peer_id in targets if peer_id != "buyer5"}
+    # the relays waited for the subtree of the slow peer, not for the peer itself
+    assert time.time() - start < 0.9
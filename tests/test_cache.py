@@ -0,0 +1,144 @@
+import pytest
+from cache import SellerCache
+from config import TraderConfig
+
+
+def sellers(product, *seller_ids):
+    return {seller_id: {"seller": {"bully_id": 0, "id": seller_id}, "product_name": product, "product_count": 5} for seller_id in seller_ids}
+
+
+def test_lru_evicts_least_recently_used_product():
+    cache = SellerCache(4, "lru")
+    cache.put_product("fish", sellers("fish", "seller1", "seller2"))
+    cache.put_product("salt", sellers("salt", "seller3", "seller4"))
+    # fish becomes the most recently used
+    assert cache.lookup("fish") is not None
+    evicted = cache.put_product("boar", sellers("boar", "seller5"))
+    assert sorted(evicted) == ["seller3", "seller4"]
+    assert list(cache.products) == ["fish", "boar"]
+    assert "seller3" not in cache and "seller1" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lfu_evicts_least_often_used_product():
+    cache = SellerCache(4, "lfu")
+    cache.put_product("fish", sellers("fish", "seller1", "seller2"))
+    cache.put_product("salt", sellers("salt", "seller3", "seller4"))
+    for _ in range(3):
+        cache.lookup("fish")
+    cache.lookup("salt")
+    # salt is the most recently used, but fish is used more often
+    evicted = cache.put_product("boar", sellers("boar", "seller5"))
+    assert sorted(evicted) == ["seller3", "seller4"]
+    assert set(cache.products) == {"fish", "boar"}
+
+
+def test_refresh_keeps_lfu_uses():
+    cache = SellerCache(4, "lfu")
+    cache.put_product("fish", sellers("fish", "seller1"))
+    cache.put_product("salt", sellers("salt", "seller2"))
+    for _ in range(3):
+        cache.lookup("fish")
+    cache.lookup("salt")
+    # reading fish again must not make it look less used than salt
+    cache.put_product("fish", sellers("fish", "seller1", "seller3"))
+    cache.put_product("boar", sellers("boar", "seller4", "seller5"))
+    assert set(cache.products) == {"fish", "boar"}
+
+
+def test_counts_hits_misses_and_size():
+    cache = SellerCache(10)
+    assert cache.lookup("fish") is None
+    cache.put_product("fish", sellers("fish", "seller1", "seller2"))
+    assert set(cache.lookup("fish")) == {"seller1", "seller2"}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["sellers"], stats["products"]) == (1, 1, 2, 1)
+
+
+def test_product_larger_than_capacity_is_kept_alone():
+    cache = SellerCache(2)
+    cache.put_product("fish", sellers("fish", "seller1"))
+    cache.put_product("salt", sellers("salt", "seller2", "seller3", "seller4"))
+    assert list(cache.products) == ["salt"]
+    assert len(cache) == 3
+
+
+def test_only_sellers_of_resident_products_are_stored():
+    cache = SellerCache(10)
+    cache.put_product("fish", sellers("fish", "seller1"))
+    cache["seller2"] = sellers("salt", "seller2")["seller2"]
+    assert "seller2" not in cache
+    cache["seller3"] = sellers("fish", "seller3")["seller3"]
+    assert cache["seller3"]["product_name"] == "fish"
+    # a seller that moves to a product that is not resident leaves the cache
+    cache["seller1"] = sellers("salt", "seller1")["seller1"]
+    assert "seller1" not in cache
+    assert len(cache) == 1 and cache.keys() == ["seller3"]
+
+
+def test_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        SellerCache(4, "fifo")
+
+
+def test_moved_and_discarded_sellers_keep_the_size_right():
+    cache = SellerCache(10)
+    cache.put_product("fish", sellers("fish", "seller1", "seller2"))
+    cache.put_product("salt", sellers("salt", "seller3"))
+    # seller2 now sells salt, and both products are resident
+    cache["seller2"] = sellers("salt", "seller2")["seller2"]
+    assert set(cache.lookup("salt")) == {"seller2", "seller3"} and set(cache.lookup("fish")) == {"seller1"}
+    cache.discard("seller3")
+    assert len(cache) == 2 and cache.stats()["sellers"] == 2
+    cache.clear()
+    assert (len(cache), cache.stats()["products"], cache.stats()["hits"]) == (0, 0, 2)
+
+
+@pytest.fixture
+def bounded(market):
+    def build(policy, capacity=2):
+        traders, _, _, buyers = market.build({"seller1": 5, "seller2": 5, "seller3": 5, "seller4": 5}, buyers=("buyer5",), products={"seller3": "salt", "seller4": "boar"},
+                                             trader_sections={"trader": TraderConfig(seller_cache_size=capacity, seller_cache_policy=policy)})
+        return traders[0], buyers[0]
+    return build
+
+
+def fills(market):
+    return [method for source, _, method in market.calls if source == "seller0" and method == "get_product_sellers"]
+
+
+def test_trader_caches_whole_products_and_evicts_the_least_recently_used(market, bounded):
+    trader, buyer = bounded("lru")
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    # the product is resident with all of its sellers, the next order is a hit
+    assert set(trader.seller_information.products["fish"]) == {"seller1", "seller2"}
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    assert len(fills(market)) == 1
+
+    assert trader.trading_lookup(buyer.tradingMessage(), "salt", 1)
+    assert list(trader.seller_information.products) == ["salt"]
+    assert "seller1" not in trader.seller_versions and "seller3" in trader.seller_versions
+    stats = trader.get_seller_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["sellers"], stats["products"]) == (1, 2, 1, 1, 1)
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    assert len(fills(market)) == 3
+
+
+def test_trader_evicts_the_least_often_used_product(market, bounded):
+    trader, buyer = bounded("lfu", capacity=3)
+    for _ in range(3):
+        assert trader.trading_lookup(buyer.tradingMessage(), "salt", 1)
+    assert trader.trading_lookup(buyer.tradingMessage(), "boar", 1)
+    # salt was used more often, so boar goes when the two sellers of fish need the room
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    assert set(trader.seller_information.products) == {"salt", "fish"}
+    assert trader.get_seller_cache_stats()["evictions"] == 1
+
+
+def test_updates_of_products_that_are_not_resident_are_not_cached(bounded):
+    trader, buyer = bounded("lru")
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    trader.merge_sellers(trader.cache_version + 1, {"seller3": {"seller": {"bully_id": 3, "id": "seller3"}, "product_name": "salt", "product_count": 2}})
+    assert "seller3" not in trader.seller_information and "seller3" not in trader.seller_versions
+    trader.merge_sellers(trader.cache_version + 1, {"seller2": {"seller": {"bully_id": 2, "id": "seller2"}, "product_name": "fish", "product_count": 2}})
+    assert trader.seller_information["seller2"]["product_count"] == 2
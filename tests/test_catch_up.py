@@ -0,0 +1,62 @@
+import pytest
+from config import WarehouseConfig
+
+
+@pytest.fixture
+def warehouse(market):
+    def build(change_log_size=1024):
+        traders, server, _, _ = market.build({"seller1": 5, "seller2": 5, "seller3": 5}, buyers=(), server_sections={"warehouse": WarehouseConfig(change_log_size=change_log_size)})
+        return traders[0], server
+    return build
+
+
+def reads(market):
+    return [method for _, uri, method in market.calls if uri == "server9" and method.startswith("get_warehouse")]
+
+
+def test_trader_catches_up_with_the_changed_sellers_only(market, warehouse):
+    trader, server = warehouse()
+    trader.load_state()
+    assert reads(market) == ["get_warehouse_snapshot"]
+    assert trader.seller_information["seller1"]["product_count"] == 5
+
+    version = trader.cache_version
+    server.update_warehouse("seller1", 2, {"id": "buyer4"}, None)
+    server.update_warehouse("seller1", 1, {"id": "buyer4"}, None)
+    assert server.get_warehouse_changes(version) == (version + 2, {"seller1": server.load_warehouse()["seller1"]})
+
+    trader.load_state()
+    assert reads(market) == ["get_warehouse_snapshot", "get_warehouse_changes"]
+    assert trader.cache_version == version + 2
+    assert {peer_id: seller_info["product_count"] for peer_id, seller_info in trader.seller_information.items()} == {"seller1": 2, "seller2": 5, "seller3": 5}
+
+
+def test_trader_behind_the_change_log_takes_a_snapshot(market, warehouse):
+    trader, server = warehouse(change_log_size=2)
+    trader.load_state()
+    version = trader.cache_version
+    for peer_id in ["seller1", "seller2", "seller3"]:
+        server.update_warehouse(peer_id, 1, {"id": "buyer4"}, None)
+    assert server.get_warehouse_changes(version) == (version + 3, None)
+
+    trader.load_state()
+    assert reads(market) == ["get_warehouse_snapshot", "get_warehouse_changes", "get_warehouse_snapshot"]
+    assert all(seller_info["product_count"] == 4 for seller_info in trader.seller_information.values())
+
+
+
+def test_trader_ahead_of_a_restarted_warehouse_takes_a_snapshot(market, warehouse):
+    trader, server = warehouse()
+    trader.load_state()
+    server.update_warehouse("seller1", 1, {"id": "buyer4"}, None)
+    trader.load_state()
+    # the restarted warehouse only knows the file, and its versions are above the ones before the restart
+    restarted = market.add("server9", "server")
+    assert restarted.warehouse_version > trader.cache_version
+    assert restarted.get_warehouse_changes(trader.cache_version) == (restarted.warehouse_version, None)
+    restarted.update_warehouse("seller2", 3, {"id": "buyer4"}, None)
+
+    trader.load_state()
+    assert trader.cache_version == restarted.warehouse_version
+    assert trader.seller_information["seller2"]["product_count"] == 2
+    assert reads(market)[-1] == "get_warehouse_snapshot"
@@ -0,0 +1,39 @@
+from config import PeerConfig
+from peer import Peer
+
+
+def test_defaults_are_the_settings_of_the_baseline_launcher():
+    peer = Peer("buyer1", 1, "buyer", ["fish"], "localhost", PeerConfig())
+    # join.py ran 2 traders with cache, 5 items per restock every 3 s and no heartbeat
+    assert (peer.n_traders, peer.with_cache, peer.product_count, peer.product_time) == (2, True, 5, 3)
+    assert (peer.fault_tolerance_heartbeat, peer.heartbeat_timeout) == (False, 0)
+    # and none of the features a peer opts into
+    assert peer.reservation_ttl is None and peer.write_behind_interval is None and peer.gossip_interval is None
+    assert isinstance(peer.seller_information, dict) and peer.inventory_format == "json"
+    assert (peer.basket_size, peer.pipeline_window, peer.hedge_requests) == (1, 1, False)
+    assert peer.recorder is None and peer.server_type is None and peer.rpc_workers is None
+    assert peer.broadcaster.fanout is None
+
+
+def test_default_peers_trade_as_the_baseline_did(market):
+    trader = market.add("seller0", "trader")
+    market.add("server9", "server")
+    market.add("seller1", "seller")
+    buyer = market.add("buyer2", "buyer")
+    market.connect()
+    market.stock({"seller1": 5})
+    trader.load_state()
+
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 5)
+    assert buyer.buy_request_done
+    # every sale goes straight to the warehouse, without leases, batches, gossip or claims
+    assert [method for _, uri, method in market.calls if uri == "server9"][-1] == "update_warehouse"
+    assert not {"reserve_units", "update_warehouse_batch", "receive_gossip", "claim_order_with_warehouse"} & {method for _, _, method in market.calls}
+
+
+def test_a_single_trader_starts_no_heartbeat(market):
+    trader = market.add("seller0", "trader")
+    market.connect()
+    trader.startTrading(1)
+    # no other trader to ping, and the only trader does not retire
+    assert trader.role == "trader"
@@ -0,0 +1,59 @@
+import threading
+import pytest
+import Pyro5.server
+import Pyro5.svr_multiplex
+import Pyro5.svr_threads
+from Pyro5 import config as pyro_config
+from config import DaemonConfig
+
+
+def test_thread_daemon_takes_the_worker_count(market):
+    threadpool_size = pyro_config.THREADPOOL_SIZE
+    peer = market.add("seller1", "trader", daemon=DaemonConfig("thread", rpc_workers=6))
+    with peer.make_daemon() as daemon:
+        assert isinstance(daemon.transportServer, Pyro5.svr_threads.SocketServer_Threadpool)
+        assert daemon.transportServer.pool.size == 6
+        assert daemon.transportServer.pool.min_size <= 6
+    assert pyro_config.THREADPOOL_SIZE == threadpool_size
+
+
+def test_daemons_keep_their_own_settings(market):
+    server_type = pyro_config.SERVERTYPE
+    multiplexed = market.add("seller1", "trader", daemon=DaemonConfig("multiplex"))
+    threaded = market.add("server9", "server", daemon=DaemonConfig("thread", rpc_workers=2))
+    with multiplexed.make_daemon() as first, threaded.make_daemon() as second:
+        assert isinstance(first.transportServer, Pyro5.svr_multiplex.SocketServer_Multiplex)
+        assert isinstance(second.transportServer, Pyro5.svr_threads.SocketServer_Threadpool)
+        assert pyro_config.SERVERTYPE == server_type
+
+        # the third call finds both workers busy
+        pool = second.transportServer.pool
+        release = threading.Event()
+        pool.process(release.wait)
+        pool.process(release.wait)
+        with pytest.raises(Pyro5.svr_threads.NoFreeWorkersError):
+            pool.process(release.wait)
+        release.set()
+
+
+def test_default_daemon_keeps_the_pyro_settings(market):
+    server_type, threadpool_size = pyro_config.SERVERTYPE, pyro_config.THREADPOOL_SIZE
+    peer = market.add("seller1", "trader")
+    with peer.make_daemon() as daemon:
+        assert isinstance(daemon, Pyro5.server.Daemon)
+    assert (pyro_config.SERVERTYPE, pyro_config.THREADPOOL_SIZE) == (server_type, threadpool_size)
+
+
+def test_loops_do_not_take_the_threads_of_calls(market):
+    peer = market.add("seller1", "trader", daemon=DaemonConfig(background_workers=2))
+    assert peer.background is not peer.executor
+    assert peer.background._max_workers == 2
+
+    # long-lived loops fill every background thread, calls still run on the executor
+    stop = threading.Event()
+    loops = [peer.background.submit(stop.wait) for _ in range(2)]
+    try:
+        assert peer.executor.submit(lambda: "called").result(timeout=1) == "called"
+        assert not any(loop.done() for loop in loops)
+    finally:
+        stop.set()
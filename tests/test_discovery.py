@@ -0,0 +1,47 @@
+import pytest
+from config import PeerConfig
+from peer import Peer
+from transport import InMemoryNameServer, InMemoryTransport
+
+
+@pytest.fixture
+def joined(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # every uri comes from the listing, a lookup would be one nameserver call per peer
+    monkeypatch.setattr(InMemoryNameServer, "lookup", lambda self, name: pytest.fail("looked up " + name))
+    transport = InMemoryTransport()
+    peers = [Peer(peer_id, index, role, ["fish"], "localhost", PeerConfig(), transport=transport.endpoint(peer_id))
+             for peer_id, index, role in [("buyer12", 12, "buyer"), ("seller3", 3, "seller"), ("merchant0", 0, "seller"), ("server9", -1, "server")]]
+    for peer in peers:
+        peer.ns = peer.get_nameserver(peer.hostname)
+        peer.register_name(peer.transport.bind(peer))
+    # names registered by anything but a peer are not listed as peers
+    peers[0].ns.register("Pyro.NameServer", "PYRO:Pyro.NameServer@localhost:9090")
+    return transport, peers
+
+
+def test_peer_table_is_keyed_by_index_from_one_listing(joined):
+    transport, peers = joined
+    for peer in peers:
+        peer.get_neighbors()
+    for peer in peers:
+        peer.executor.shutdown(wait=True)
+
+    buyer = peers[0]
+    assert buyer.peer_table == {12: ("buyer12", "buyer12"), 3: ("seller3", "seller3"), 0: ("merchant0", "merchant0"), -1: ("server9", "server9")}
+    # the neighbors are every other peer, whatever their name
+    assert buyer.neighbors == {"seller3": "seller3", "merchant0": "merchant0", "server9": "server9"}
+    assert all(len(peer.neighbors) == 3 for peer in peers)
+
+
+def test_a_peer_that_joins_late_is_added_with_its_index(joined):
+    transport, peers = joined
+    early, late = peers[0], peers[1]
+    del transport.names["seller3"]
+    early.get_neighbors()
+    assert 3 not in early.peer_table
+
+    late.register_name("seller3")
+    late.get_neighbors()
+    late.executor.shutdown(wait=True)
+    assert early.peer_table[3] == ("seller3", "seller3") and early.neighbors["seller3"] == "seller3"
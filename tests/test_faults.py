@@ -0,0 +1,49 @@
+import pytest
+from faults import report
+
+
+def sale_times(start, per_window):
+    # sales spread evenly inside every one second window
+    return [start + window + (i + 0.5) / count for window, count in enumerate(per_window) for i in range(count)]
+
+
+def fault(kind, at, injected=None, detected=None):
+    return {"fault": kind, "target": "seller0", "at": at, "injected": injected, "detected": detected, "healed": None}
+
+
+def test_report_measures_detection_recovery_and_the_dip():
+    start = 1000.0
+    orders = {"start": start, "sent": 40, "rejected": 2, "lost": 1, "duplicated": 0, "sale_times": sale_times(start, [4, 4, 4, 4, 2, 1, 2, 4, 4, 4])}
+    results = [fault("kill", 4, start + 4.5, start + 5.25), fault("pause", 6, start + 6.2), fault("drop", 20)]
+    summary = report(results, orders, 10, 1.0)
+
+    assert summary["throughput"] == [4, 4, 4, 4, 2, 1, 2, 4, 4, 4]
+    assert summary["completed"] == 33
+    # the baseline is the throughput of the windows before the first fault
+    assert summary["baseline_throughput"] == 4
+    kill, pause, drop = summary["faults"]
+    assert kill["time_to_detect"] == pytest.approx(0.75)
+    # 80% of the baseline is back in the window ending at 8 s, 3.5 s after the kill
+    assert kill["time_to_recover"] == pytest.approx(3.5)
+    assert pause["time_to_detect"] is None
+    assert pause["time_to_recover"] == pytest.approx(1.8)
+    # a fault never injected is not measured
+    assert (drop["time_to_detect"], drop["time_to_recover"]) == (None, None)
+    assert summary["min_throughput_after_fault"] == 1
+    assert summary["throughput_dip"] == pytest.approx(0.75)
+    assert summary["orders"] == {"sent": 40, "rejected": 2, "lost": 1, "duplicated": 0}
+
+
+def test_report_without_recovery_or_faults():
+    start = 1000.0
+    orders = {"start": start, "sent": 8, "rejected": 0, "lost": 0, "duplicated": 0, "sale_times": sale_times(start, [2, 2, 0, 0])}
+    kill, = report([fault("kill", 2, start + 2.0, start + 2.5)], orders, 4, 1.0)["faults"]
+    assert kill["time_to_recover"] is None
+    assert kill["time_to_detect"] == pytest.approx(0.5)
+
+    # with no fault there is nothing after it, and late sales count in the last window
+    orders["sale_times"].append(start + 4.5)
+    summary = report([], orders, 4, 2.0)
+    assert summary["throughput"] == [2, 0.5]
+    assert summary["baseline_throughput"] == 1.25
+    assert (summary["min_throughput_after_fault"], summary["throughput_dip"]) == (None, None)
@@ -0,0 +1,105 @@
+import copy
+import time
+import pytest
+from config import GossipConfig
+from faults import FaultInjector
+
+
+@pytest.fixture
+def traders(market):
+    def build(gossip_log_size=1024, gossip_interval=60):
+        (first, second), server, _, _ = market.build({"seller2": 5, "seller3": 5}, traders=("seller0", "seller1"), buyers=(), load_state=True, trader_sections={"gossip": GossipConfig(gossip_interval, gossip_log_size)})
+        return first, second, server
+    return build
+
+
+def eventually(check, timeout=2.0):
+    deadline = time.time() + timeout
+    while not check() and time.time() < deadline:
+        time.sleep(0.01)
+    return check()
+
+
+def sell(trader, server, seller_peer_id, item_count):
+    version, changes = server.update_warehouse(seller_peer_id, item_count, {"id": "buyer4"}, None)
+    trader.share_sellers(version, changes)
+    return version, changes
+
+
+def test_sale_reaches_the_other_trader(traders):
+    first, second, server = traders()
+    sell(first, server, "seller2", 2)
+    assert first.seller_information["seller2"]["product_count"] == 3
+    assert eventually(lambda: second.seller_information["seller2"]["product_count"] == 3)
+    assert second.gossip_seen == {"seller0": 1}
+
+
+def test_older_update_does_not_overwrite_a_newer_one(traders):
+    first, second, server = traders()
+    old_version, old_changes = server.update_warehouse("seller2", 1, {"id": "buyer4"}, None)
+    new_version, new_changes = server.update_warehouse("seller2", 1, {"id": "buyer4"}, None)
+    second.receive_gossip("seller0", {"seq": 1, "version": new_version, "changes": new_changes})
+    second.receive_gossip("seller0", {"seq": 2, "version": old_version, "changes": old_changes})
+    assert second.seller_information["seller2"]["product_count"] == 3
+
+
+def test_missed_updates_are_repaired_from_the_sender(market, traders):
+    first, second, server = traders()
+    # the second trader misses the first two updates
+    first.trader = ["seller0"]
+    sell(first, server, "seller2", 1)
+    sell(first, server, "seller3", 2)
+    first.trader = ["seller0", "seller1"]
+    sell(first, server, "seller2", 1)
+    assert eventually(lambda: second.gossip_seen == {"seller0": 3})
+    assert eventually(lambda: second.seller_information["seller3"]["product_count"] == 3)
+    assert ("seller1", "seller0", "get_gossip") in market.calls
+    assert second.seller_information["seller2"]["product_count"] == 3
+
+
+def test_updates_dropped_from_the_log_are_caught_up_with_the_warehouse(market, traders):
+    first, second, server = traders(gossip_log_size=1)
+    first.trader = ["seller0"]
+    sell(first, server, "seller3", 2)
+    first.trader = ["seller0", "seller1"]
+    sell(first, server, "seller2", 1)
+    assert eventually(lambda: ("seller1", "server9", "get_warehouse_changes") in market.calls)
+    assert eventually(lambda: second.seller_information["seller3"]["product_count"] == 3)
+    assert second.seller_information["seller2"]["product_count"] == 4
+
+
+def test_updates_are_ordered_by_their_sequence_numbers(market, traders):
+    first, second, server = traders()
+    first.trader = ["seller0"]
+    sell(first, server, "seller2", 1)
+    sell(first, server, "seller3", 2)
+    updates = copy.deepcopy(list(first.gossip_log))
+
+    # the second update arrives first, the gap before it is fetched from the sender
+    second.receive_gossip("seller0", updates[1])
+    assert second.gossip_seen == {"seller0": 2}
+    assert eventually(lambda: second.seller_information["seller2"]["product_count"] == 4)
+    assert second.seller_information["seller3"]["product_count"] == 3
+
+    # the first update arriving late changes nothing and is not repaired again
+    second.receive_gossip("seller0", updates[0])
+    assert second.gossip_seen == {"seller0": 2}
+    assert [method for source, _, method in market.calls if source == "seller1"].count("get_gossip") == 1
+    assert (second.seller_information["seller2"]["product_count"], second.seller_information["seller3"]["product_count"]) == (4, 3)
+
+
+def test_dropped_update_is_repaired_by_anti_entropy(market, traders):
+    first, second, server = traders(gossip_interval=0.05)
+    injector = FaultInjector()
+    market.transport.faults = injector
+    injector.inject({"fault": "drop", "method": "receive_gossip", "target": "seller1"})
+    sell(first, server, "seller2", 2)
+    assert eventually(lambda: ("seller0", "seller1", "receive_gossip") in market.calls)
+    injector.heal({"fault": "drop", "method": "receive_gossip", "target": "seller1"})
+    assert second.seller_information["seller2"]["product_count"] == 5
+
+    # no later update shows the gap, the periodic repair finds it
+    second.background.submit(second.gossip_loop)
+    assert eventually(lambda: second.seller_information["seller2"]["product_count"] == 3)
+    assert second.gossip_seen == {"seller0": 1}
+    assert ("seller1", "server9", "get_warehouse_changes") not in market.calls
@@ -0,0 +1,50 @@
+from history import BuyerHistory
+
+
+def test_ring_keeps_most_recent_buyers():
+    history = BuyerHistory(3)
+    for buyer_id in ["buyer1", "buyer2", "buyer3", "buyer4", "buyer5"]:
+        history.add(buyer_id)
+    assert history.recent() == ["buyer3", "buyer4", "buyer5"]
+    assert history.total == 5
+
+
+def test_counts_cover_buyers_that_left_the_ring():
+    history = BuyerHistory(2)
+    for buyer_id in ["buyer1", "buyer2", "buyer1", "buyer3", "buyer1"]:
+        history.add(buyer_id)
+    assert history.recent() == ["buyer3", "buyer1"]
+    assert history.counts == {"buyer1": 3, "buyer2": 1, "buyer3": 1}
+
+
+def test_spill_file_receives_evicted_buyers_in_order(tmp_path):
+    spill_file = tmp_path / "buyer_history_seller1.txt"
+    history = BuyerHistory(2, str(spill_file))
+    with history:
+        for buyer_id in ["buyer1", "buyer2", "buyer3", "buyer4"]:
+            history.add(buyer_id)
+        # flushed as soon as a buyer leaves the ring
+        assert spill_file.read_text().split() == ["buyer1", "buyer2"]
+    assert history.spill is None
+    assert history.recent() == ["buyer3", "buyer4"]
+    assert history.counts["buyer1"] == 1 and history.total == 4
+
+
+def test_no_spill_file_until_the_ring_is_full(tmp_path):
+    spill_file = tmp_path / "buyer_history_seller1.txt"
+    history = BuyerHistory(3, str(spill_file))
+    history.add("buyer1")
+    history.add("buyer2")
+    assert not spill_file.exists()
+
+
+def test_spill_file_is_opened_once(tmp_path, monkeypatch):
+    spill_file = tmp_path / "buyer_history_seller1.txt"
+    history = BuyerHistory(1, str(spill_file))
+    opened = []
+    monkeypatch.setattr("builtins.open", lambda *args, _open=open, **kwargs: opened.append(args[0]) or _open(*args, **kwargs))
+    for buyer_id in ["buyer1", "buyer2", "buyer3", "buyer4"]:
+        history.add(buyer_id)
+    history.close()
+    assert opened == [str(spill_file)]
+    assert spill_file.read_text().split() == ["buyer1", "buyer2", "buyer3"]
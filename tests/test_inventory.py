@@ -0,0 +1,137 @@
+import threading
+import time
+import pytest
+from inventory import FIELDS, SEQ, MappedInventory
+
+PRODUCTS = ["fish", "salt", "boar"]
+
+
+@pytest.fixture
+def inventories(tmp_path):
+    path = str(tmp_path / "seller_information.mmap")
+    writer = MappedInventory(path, PRODUCTS, capacity=4, writable=True)
+    reader = MappedInventory(path, PRODUCTS)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def test_records_round_trip(inventories):
+    writer, reader = inventories
+    writer.add("seller1", 1, "salt", 7)
+    reader.refresh_index()
+    assert reader.read(reader.index["seller1"]) == ("seller1", 1, PRODUCTS.index("salt"), 7, 1)
+    assert reader.to_dict() == {"seller1": {"seller": {"bully_id": 1, "id": "seller1"}, "product_name": "salt", "product_count": 7}}
+
+
+def test_update_is_seen_by_reader_with_new_version(inventories):
+    writer, reader = inventories
+    writer.add("seller1", 1, "fish", 7)
+    writer.update("seller1", 3)
+    writer.update("seller1", 2)
+    reader.refresh_index()
+    _, _, _, count, version = reader.read(reader.index["seller1"])
+    assert (count, version) == (2, 3)
+    # the sequence number stays even once a write is complete
+    assert SEQ.unpack_from(reader.map, reader.offset(reader.index["seller1"]))[0] % 2 == 0
+
+
+def test_read_waits_for_a_write_in_progress(inventories):
+    writer, reader = inventories
+    writer.add("seller1", 1, "fish", 7)
+    offset = writer.offset(0)
+    seq = SEQ.unpack_from(writer.map, offset)[0]
+    # start a write by hand and leave it half done
+    SEQ.pack_into(writer.map, offset, seq + 1)
+    FIELDS.pack_into(writer.map, offset + SEQ.size, b"seller1", 1, 0, 99, 2)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(reader.read(0)))
+    thread.start()
+    time.sleep(0.1)
+    assert result == []
+    SEQ.pack_into(writer.map, offset, seq + 2)
+    thread.join(1)
+    assert result == [("seller1", 1, 0, 99, 2)]
+
+
+def test_concurrent_reads_never_see_a_torn_record(inventories):
+    writer, reader = inventories
+    writer.add("seller1", 1, "fish", 0)
+    stop = threading.Event()
+
+    def write():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            writer.write(0, "seller1", 1, 0, n, n)
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(20000):
+            _, _, _, count, version = reader.read(0)
+            assert count == version
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_grows_when_full_and_reader_maps_again(inventories):
+    writer, reader = inventories
+    old_maps = [writer.map, reader.map]
+    for i in range(10):
+        writer.add("seller" + str(i), i, PRODUCTS[i % 3], i)
+    assert writer.capacity == 16
+    assert len(reader.to_dict()) == 10
+    assert reader.capacity == 16
+    # the mappings replaced are closed, not left to the garbage collector
+    assert all(old_map.closed for old_map in old_maps)
+    assert [sl["seller"]["id"] for sl in reader.sellers_of("fish")] == ["seller0", "seller3", "seller6", "seller9"]
+
+
+def test_find_seller_skips_excluded_and_short_stock(inventories):
+    writer, reader = inventories
+    writer.add("seller1", 1, "fish", 1)
+    writer.add("seller2", 2, "fish", 9)
+    writer.add("seller3", 3, "fish", 9)
+    seller, found = reader.find_seller("fish", 5, "seller2")
+    assert found and seller["seller"]["id"] == "seller3"
+    assert reader.find_seller("salt", 1, "seller2") == ("", False)
+
+
+def test_rejects_long_seller_ids(inventories):
+    writer, _ = inventories
+    with pytest.raises(ValueError):
+        writer.add("seller" * 10, 1, "fish", 1)
+
+
+def test_to_dict_reads_only_the_sellers_asked_for(inventories):
+    writer, reader = inventories
+    writer.add("seller1", 1, "fish", 1)
+    writer.add("seller2", 2, "salt", 9)
+    assert reader.to_dict(["seller2", "seller7"]) == {"seller2": {"seller": {"bully_id": 2, "id": "seller2"}, "product_name": "salt", "product_count": 9}}
+
+
+def test_reads_carry_on_while_the_file_is_mapped_again(inventories):
+    writer, reader = inventories
+    writer.add("seller0", 0, "fish", 7)
+    reader.refresh_index()
+    stop = threading.Event()
+    errors = []
+
+    def read_loop():
+        try:
+            while not stop.is_set():
+                assert reader.read(0)[3] == 7
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=read_loop)
+    thread.start()
+    try:
+        for i in range(1, 40):
+            writer.add("seller" + str(i), i, "salt", i)
+            reader.refresh_index()
+    finally:
+        stop.set()
+        thread.join()
+    assert errors == []
+    assert reader.capacity == 64
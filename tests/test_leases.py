@@ -0,0 +1,116 @@
+import json
+import time
+import pytest
+from config import LeaseConfig
+
+
+@pytest.fixture
+def leasing(market):
+    trader = market.add("seller0", "trader", leases=LeaseConfig(reservation_ttl=5, reservation_block=3))
+    server = market.add("server9", "server")
+    market.add("seller1", "seller")
+    buyer = market.add("buyer2", "buyer")
+    market.connect()
+    market.stock({"seller1": 5})
+    return trader, server, buyer
+
+
+def stock(server):
+    return server.load_warehouse()["seller1"]["product_count"]
+
+
+def test_sales_settled_after_the_lease_expired_are_taken_out_of_stock(leasing):
+    trader, server, buyer = leasing
+    lease, found = server.reserve_units("seller0", "fish", 1, 3, 0.05)
+    assert lease["ttl"] == 0.05 and stock(server) == 2
+    time.sleep(0.1)
+    settlement = {"lease_id": lease["lease_id"], "seller": "seller1", "sold": 2, "buyers": ["buyer2", "buyer2"], "renew": True}
+    assert server.settle_leases_with_warehouse([settlement], 5) == {lease["lease_id"]: 0}
+    assert stock(server) == 3
+    assert server.get_buyer_history("seller1")["total"] == 2
+    # a settlement sent again is not applied twice
+    server.settle_leases_with_warehouse([settlement], 5)
+    assert stock(server) == 3
+    assert server.get_buyer_history("seller1")["total"] == 2
+
+
+def test_leases_outlive_a_warehouse_restart(market, leasing):
+    trader, server, buyer = leasing
+    lease, found = server.reserve_units("seller0", "fish", 1, 3, 5)
+    restarted = market.add("server9", "server")
+    settlement = {"lease_id": lease["lease_id"], "seller": "seller1", "sold": 1, "buyers": ["buyer2"], "renew": False}
+    assert restarted.settle_leases_with_warehouse([settlement], 5) == {lease["lease_id"]: 0}
+    assert stock(restarted) == 4
+
+
+def test_lease_sales_are_journaled_until_settled(leasing):
+    trader, server, buyer = leasing
+    for _ in range(2):
+        assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    assert stock(server) == 2
+    with open("transactions_trader_seller0.json") as f:
+        journal = json.load(f)["lease_sales"]
+    assert [(sale["seller"], sale["sold"], sale["buyers"]) for sale in journal.values()] == [("seller1", 2, ["buyer2", "buyer2"])]
+
+    # the lease is still selling, so it is renewed and its sales stay journaled
+    trader.settle_leases(True)
+    assert len(trader.leases) == 1
+    assert stock(server) == 2 and server.get_buyer_history("seller1")["total"] == 2
+    trader.settle_leases(False)
+    assert trader.leases == {}
+    assert stock(server) == 3
+    with open("transactions_trader_seller0.json") as f:
+        assert json.load(f)["lease_sales"] == {}
+    assert server.get_buyer_history("seller1")["total"] == 2
+
+
+def test_lease_writes_only_version_the_leased_seller(market, leasing):
+    trader, server, buyer = leasing
+    market.add("seller3", "seller")
+    market.stock({"seller3": 4})
+    version = server.warehouse_version
+    lease, found = server.reserve_units("seller0", "fish", 1, 3, 0.05)
+    time.sleep(0.1)
+    server.settle_leases_with_warehouse([], 5)
+    # the lease and its expiry are both in the change log, seller3 is untouched
+    assert server.warehouse_version == version + 2
+    assert list(server.get_warehouse_changes(version)[1]) == ["seller1"]
+
+
+def test_unsold_units_of_an_expired_lease_are_reclaimed_for_other_traders(leasing):
+    trader, server, buyer = leasing
+    lease, found = server.reserve_units("seller0", "fish", 1, 5, 0.05)
+    assert lease["units"] == 5 and stock(server) == 0
+    assert server.reserve_units("seller4", "fish", 1, 3, 5) == (None, True)
+    time.sleep(0.1)
+    # the next warehouse call returns the expired lease before leasing again
+    other, found = server.reserve_units("seller4", "fish", 1, 3, 5)
+    assert other["units"] == 3 and stock(server) == 2
+    assert server.load_leases()[lease["lease_id"]]["returned"] and server.load_leases()[lease["lease_id"]]["units"] == 0
+
+
+def test_trader_reserves_again_instead_of_selling_from_a_lease_about_to_expire(leasing):
+    trader, server, buyer = leasing
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    (lease,) = trader.leases.values()
+    # within half the ttl of its expiry, too late for a settlement to renew it
+    lease["expires"] = time.time() + 1
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    assert len(trader.leases) == 2 and lease["units"] == 2
+    assert stock(server) == 0
+
+
+def test_leases_json_is_reloaded_and_expired_after_a_restart(market, leasing):
+    trader, server, buyer = leasing
+    lease, found = server.reserve_units("seller0", "fish", 1, 3, 0.05)
+    with open("leases.json") as f:
+        saved = dict(json.load(f))[lease["lease_id"]]
+    assert (saved["units"], saved["returned"]) == (3, False)
+
+    time.sleep(0.1)
+    restarted = market.add("server9", "server")
+    restarted.settle_leases_with_warehouse([], 5)
+    assert stock(restarted) == 5
+    with open("leases.json") as f:
+        saved = dict(json.load(f))[lease["lease_id"]]
+    assert (saved["units"], saved["returned"]) == (0, True)
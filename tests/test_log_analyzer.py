@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from experiments.log_analyzer import GAP_BINS, LogStats, find_failover, read_timestamps
+
+BIN_FACTOR = GAP_BINS[1] / GAP_BINS[0]
+
+
+@pytest.fixture
+def logs(tmp_path):
+    buyer = tmp_path / "buyer.txt"
+    buyer.write_text("".join([
+        "2026-01-01 00:00:00.000000 buyer4  bought item fish from seller seller1\n",
+        "2026-01-01 00:00:00.200000 buyer4  now buying  fish\n",
+        "2026-01-01 00:00:00.500000 buyer4  bought item fish from seller seller1\n",
+        "**********\n",
+        # datetime drops a zero fraction
+        "2026-01-01 00:00:01 buyer4  bought item fish from seller seller2\n",
+        "2026-01-01 00:00:02.500000 buyer4  bought item fish from seller seller2\n",
+        "2026-01-01 00:00:03.500000 buyer4  bought item fish from seller seller1\n",
+    ]))
+    trader = tmp_path / "trader_seller0.txt"
+    trader.write_text("".join([
+        "2026-01-01 00:00:00.100000 Received request from buyer  buyer4\n",
+        "2026-01-01 00:00:01.200000 seller0  is retiring from the market\n",
+        "2026-01-01 00:00:01.900000 seller0  is retiring from the market\n",
+    ]))
+    return str(buyer), str(trader)
+
+
+def test_timestamps_are_read_in_chunks(logs):
+    buyer, _ = logs
+    chunks = list(read_timestamps(buyer, " bought ", chunk_lines=3))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert np.diff(np.concatenate(chunks)).tolist() == [500000, 500000, 1500000, 1000000]
+
+
+@pytest.mark.parametrize("chunk_lines", [1, 1000])
+def test_counts_throughput_and_gaps(logs, chunk_lines):
+    buyer, trader = logs
+    stats = LogStats(1.0, find_failover([buyer, trader]))
+    stats.add_log(buyer, chunk_lines=chunk_lines)
+    assert stats.total == 5
+    assert stats.mean_throughput() == pytest.approx(5 / 3.5)
+    starts, rates = stats.throughput()
+    assert starts.tolist() == [0, 1, 2, 3]
+    assert rates.tolist() == [2, 1, 1, 1]
+    # gaps of 0.5, 0.5, 1.5 and 1 s, also across chunks
+    assert stats.gap_count == 4 and stats.gap_sum == 3500000
+    p50, p95, p99 = stats.gap_percentiles()
+    assert 0.5 <= p50 < 0.5 * BIN_FACTOR
+    assert 1.5 <= p95 == p99 < 1.5 * BIN_FACTOR
+    # the first retirement splits 3 events over 1 s from 2 events over 1 s
+    assert stats.failover == int(np.datetime64("2026-01-01T00:00:01.200000", "us").astype(np.int64))
+    assert stats.failover_throughput() == [3.0, 2.0]
+
+
+def test_an_earlier_log_shifts_the_windows(logs, tmp_path):
+    buyer, _ = logs
+    other = tmp_path / "buyer5.txt"
+    other.write_text("2025-12-31 23:59:59.500000 buyer5  bought item fish\n2026-01-01 00:00:00.250000 buyer5  bought item fish\n")
+    stats = LogStats(1.0)
+    stats.add_log(buyer)
+    stats.add_log(str(other))
+    assert stats.throughput()[1].tolist() == [1, 3, 1, 1, 1]
+    # gaps are taken within each log only
+    assert stats.gap_count == 5 and stats.gap_sum == 4250000
+    assert stats.failover_throughput() == [None, None]
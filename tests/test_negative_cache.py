@@ -0,0 +1,23 @@
+import time
+from config import TraderConfig
+
+
+def test_answers_from_the_negative_cache_do_not_extend_it(market):
+    trader = market.add("seller0", "trader", trader=TraderConfig(negative_cache_ttl=0.3))
+    market.add("server9", "server")
+    market.add("seller1", "seller")
+    buyer = market.add("buyer2", "buyer", products=("boar",))
+    market.connect()
+    market.stock({"seller1": 5})
+
+    assert trader.trading_lookup(buyer.tradingMessage(), "boar", 1)
+    expires = trader.unavailable_products["boar"]
+    time.sleep(0.1)
+    assert trader.trading_lookup(buyer.tradingMessage(), "boar", 1)
+    assert trader.unavailable_products["boar"] == expires
+
+    # once the ttl ran out the warehouse is asked again
+    time.sleep(0.25)
+    assert not trader.is_unavailable("boar")
+    assert trader.trading_lookup(buyer.tradingMessage(), "boar", 1)
+    assert trader.unavailable_products["boar"] > expires
@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+import Pyro5.server
+from config import BuyerConfig, TraderConfig
+
+
+def order(buyer, counter):
+    return dict(buyer.tradingMessage(), order_id=buyer.id + "-1-" + str(counter))
+
+
+def journal(trader_id):
+    with open("orders_trader_" + trader_id + ".jsonl") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_forgotten_orders_stay_claimed(market):
+    trader = market.add("seller0", "trader", trader=TraderConfig(order_log_size=2))
+    buyer = market.add("buyer4", "buyer")
+    market.connect()
+    for counter in range(1, 4):
+        assert trader.claim_order(order(buyer, counter))
+    assert list(trader.orders) == ["buyer4-1-2", "buyer4-1-3"]
+    assert trader.order_floors == {"buyer4-1": 1}
+    assert not trader.claim_order(order(buyer, 1))
+    assert not trader.cancel_order("buyer4-1-1")
+    # a later order of the buyer is not held back by the floor
+    assert trader.claim_order(order(buyer, 4))
+
+
+def test_trader_taking_over_does_not_sell_claimed_orders_again(market):
+    first = market.add("seller0", "trader", trader=TraderConfig(order_log_size=1))
+    second = market.add("seller1", "trader")
+    server = market.add("server9", "server")
+    market.add("seller2", "seller")
+    buyer = market.add("buyer4", "buyer")
+    market.connect()
+    market.stock({"seller2": 5})
+    for counter in range(1, 3):
+        assert first.trading_lookup(order(buyer, counter), "fish", 1)
+    with open("transactions_trader_seller0.json") as f:
+        assert "orders" not in json.load(f)
+
+    second.seed_orders(["orders_trader_seller0.jsonl"])
+    assert second.order_floors == {"buyer4-1": 1}
+    for counter in range(1, 3):
+        assert second.trading_lookup(order(buyer, counter), "fish", 1) is None
+    assert server.load_warehouse()["seller2"]["product_count"] == 3
+
+
+def test_order_journal_is_appended_and_rewritten_when_it_doubles(market):
+    trader = market.add("seller0", "trader", trader=TraderConfig(order_log_size=4))
+    buyer = market.add("buyer4", "buyer")
+    market.connect()
+    for counter in range(1, 7):
+        assert trader.claim_order(order(buyer, counter))
+    # every order is appended, with the floors of every order forgotten
+    assert len(journal("seller0")) == 8 and journal("seller0")[-1] == {"floors": {"buyer4-1": 2}}
+    assert trader.claim_order(order(buyer, 7))
+    assert journal("seller0") == [{"floors": {"buyer4-1": 3}}] + [{"order": "buyer4-1-" + str(counter), "state": "claimed"} for counter in range(4, 8)]
+    assert trader.claim_order(order(buyer, 8))
+    assert len(journal("seller0")) == 7
+
+    # a cut off last entry is skipped
+    with open("orders_trader_seller0.jsonl", "a") as f:
+        f.write('{"order": "buyer4-1-1')
+    second = market.add("seller1", "trader")
+    second.seed_orders(["orders_trader_seller0.jsonl"])
+    assert list(second.orders) == ["buyer4-1-" + str(counter) for counter in range(5, 9)]
+    assert second.order_state("buyer4-1-4") == "forgotten"
+
+
+def test_hedged_buyer_is_not_held_up_by_a_stalled_hedge_order(market):
+    first = market.add("seller0", "trader")
+    market.add("seller1", "trader")
+    buyer = market.add("buyer4", "buyer", buyer=BuyerConfig(hedge_requests=True, hedge_delay=0.05))
+    market.connect()
+    stalled = threading.Event()
+
+    @Pyro5.server.expose
+    def slow_lookup(buyer_info, item, item_count):
+        time.sleep(0.2)
+        return True
+    first.trading_lookup = slow_lookup
+    first.hedge_order = Pyro5.server.expose(lambda order_id: stalled.wait())
+    try:
+        start = time.time()
+        assert buyer.call_hedged("seller0", "trading_lookup", (buyer.new_order(), "fish", 1))
+        assert time.time() - start < 1
+    finally:
+        stalled.set()
@@ -0,0 +1,26 @@
+import time
+from config import BuyerConfig
+
+
+def test_window_stays_full_and_every_call_returns_one_order(market):
+    trader = market.add("seller0", "trader")
+    market.add("server9", "server")
+    market.add("seller1", "seller")
+    buyer = market.add("buyer2", "buyer", buyer=BuyerConfig(pipeline_window=4))
+    market.connect()
+    market.stock({"seller1": 1000})
+    trader.load_state()
+
+    for calls in range(1, 6):
+        assert buyer.sendBuyRequest()
+        # the first call fills the window, every later call sends one order for the one it returned
+        assert buyer.order_counter == 3 + calls
+        assert buyer.window_in_use() == 3
+        assert len(buyer.finished_orders) <= 3
+
+    deadline = time.time() + 2
+    while buyer.outstanding and time.time() < deadline:
+        time.sleep(0.01)
+    # the orders not returned yet wait in the window, none is lost or counted twice
+    assert not buyer.outstanding and len(buyer.finished_orders) == 3
+    assert sum(1 for _, uri, method in market.calls if uri == "seller0" and method == "trading_lookup") == 8
@@ -0,0 +1,79 @@
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+import join
+from faults import FaultInjector
+from profiler import StackSampler
+
+
+def spin_in_known_frame(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_sampler_collapses_the_stacks_of_other_threads():
+    stop = threading.Event()
+    busy = threading.Thread(target=spin_in_known_frame, args=(stop,), name="busy")
+    busy.start()
+    sampler = StackSampler(interval=0.001)
+    assert sampler.collapsed() == ""
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    stop.set()
+    busy.join()
+
+    assert sampler.samples > 0 and not sampler.thread.is_alive()
+    busy_stacks = {stack: count for stack, count in sampler.stacks.items() if stack.startswith("busy;")}
+    # the thread is named at the root and its innermost frame is the last one
+    assert all(stack.split(";")[-1].startswith("spin_in_known_frame (test_profiler.py:") for stack in busy_stacks)
+    assert 0 < sum(busy_stacks.values()) <= sampler.samples
+    # the sampling thread leaves itself out
+    assert not any("sample_loop" in stack for stack in sampler.stacks)
+
+    lines = sampler.collapsed("seller1").splitlines()
+    assert len(lines) == len(sampler.stacks)
+    assert all(line.startswith("seller1;") for line in lines)
+    counts = [int(line.rsplit(" ", 1)[1]) for line in lines]
+    assert counts == sorted(counts, reverse=True) and sum(counts) == sum(sampler.stacks.values())
+
+
+def test_peer_profiles_once_and_dumps_its_stacks(market):
+    peer = market.add("seller1", "seller")
+    assert peer.stop_profiling() == ""
+    assert peer.start_profiling(0.001)
+    assert not peer.start_profiling(0.001)
+    time.sleep(0.05)
+    collapsed = peer.stop_profiling()
+    assert collapsed and all(line.startswith("seller1;") for line in collapsed.splitlines())
+    with open("profile_seller1.folded") as f:
+        assert f.read() == collapsed
+    # profiling may start again once stopped
+    assert peer.stop_profiling() == ""
+    assert peer.start_profiling(0.001)
+    peer.stop_profiling()
+
+
+def test_collect_profiles_stops_the_profilers_it_started(market, monkeypatch):
+    peers = [market.add(peer_id, "seller") for peer_id in ["seller1", "seller2", "seller3"]]
+    ns = market.transport.get_nameserver()
+    for peer in peers:
+        ns.register(peer.id, peer.id)
+    injector = FaultInjector()
+    injector.inject({"fault": "drop", "method": "start_profiling", "target": "seller2"})
+    market.transport.faults = injector
+    monkeypatch.setattr(join.Pyro5.api, "locate_ns", lambda host: ns)
+    monkeypatch.setattr(join.Pyro5.api, "Proxy", market.transport.proxy)
+
+    def interrupted(duration):
+        time.sleep(0.05)
+        raise KeyboardInterrupt
+    monkeypatch.setattr(join, "time", SimpleNamespace(sleep=interrupted))
+
+    # a peer that cannot be reached is skipped, and an interrupted run still stops the others
+    with pytest.raises(KeyboardInterrupt):
+        join.collect_profiles("localhost", 10, 0.001)
+    assert all(peer.profiler is None for peer in peers)
+    with open("profile_all.folded") as f:
+        assert {line.split(";")[0] for line in f.read().splitlines()} == {"seller1", "seller3"}
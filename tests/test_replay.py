@@ -0,0 +1,50 @@
+import pytest
+from config import LaunchConfig
+from replay import get_peers, get_topology, replay
+from transport import InMemoryTransport
+from workload import load_trace
+
+
+@pytest.fixture
+def records(market):
+    trader = market.add("seller0", "trader", launch=LaunchConfig(trace=True))
+    market.add("server9", "server")
+    sellers = [market.add("seller1", "seller"), market.add("seller2", "seller", ("salt",))]
+    buyers = [market.add("buyer3", "buyer"), market.add("buyer4", "buyer", ("salt",))]
+    market.connect()
+    for seller, count in zip(sellers, [3, 2]):
+        trader.register_products({"seller": {"bully_id": seller.bully_id, "id": seller.id}, "product_name": seller.product_name, "product_count": count})
+    for buyer, item, item_count in [(buyers[0], "fish", 2), (buyers[1], "salt", 1), (buyers[0], "fish", 2)]:
+        assert trader.trading_lookup(buyer.tradingMessage(), item, item_count)
+    trader.recorder.close()
+    return load_trace("trace_*.jsonl")
+
+
+def counts(peers):
+    server = [peer for peer in peers if peer.id == "server9"][0]
+    return {peer_id: seller_info["product_count"] for peer_id, seller_info in server.load_warehouse().items()}
+
+
+def test_topology_is_found_from_the_trace(records):
+    assert get_topology(records) == (["seller0"], ["buyer3", "buyer4"], {"seller1": "fish", "seller2": "salt"}, ["fish", "salt"])
+
+
+@pytest.mark.parametrize("pacing", ["fast", "recorded"])
+def test_replay_ends_with_the_recorded_stock(market, records, tmp_path, monkeypatch, pacing):
+    recorded = counts(market.peers.values())
+    assert recorded == {"seller1": 1, "seller2": 1}
+
+    # a fresh topology in its own directory, so it starts from an empty warehouse
+    (tmp_path / "replay").mkdir()
+    monkeypatch.chdir(tmp_path / "replay")
+    transport = InMemoryTransport(seed=0)
+    peers = get_peers(records, transport)
+    assert sorted((peer.id, peer.role) for peer in peers) == [("buyer3", "buyer"), ("buyer4", "buyer"), ("seller0", "trader"), ("seller1", "seller"), ("seller2", "seller"), ("server9", "server")]
+    try:
+        latencies = replay(records, transport, pacing, 1)
+    finally:
+        for peer in peers:
+            if peer.role == "trader":
+                peer.role = "retire"
+    assert {call: len(values) for call, values in latencies.items()} == {"trading_lookup": 3, "trading_basket_lookup": 0, "register_products": 2}
+    assert counts(peers) == recorded
@@ -0,0 +1,23 @@
+from faults import FaultInjector
+
+
+def test_seller_moves_to_the_next_trader_when_its_trader_is_down(market):
+    market.add("seller0", "trader")
+    market.add("seller1", "trader")
+    server = market.add("server9", "server")
+    seller = market.add("seller2", "seller")
+    market.connect()
+    seller.restock_trader = "seller0"
+    injector = FaultInjector()
+    market.transport.faults = injector
+    # no heartbeat, so seller0 stays a trader for the seller
+    injector.inject({"fault": "kill", "target": "seller0"})
+
+    seller.startSellerTrading()
+    # nothing was registered, the units wait for the next restock
+    assert seller.restock_trader == "seller1" and seller.stock == 0
+
+    seller.startSellerTrading()
+    assert seller.stock == seller.n
+    assert server.load_warehouse()["seller2"]["product_count"] == seller.n
+    assert ("seller2", "seller1", "register_products") in market.calls
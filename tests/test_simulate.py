@@ -0,0 +1,29 @@
+import asyncio
+from collections import Counter
+from simulate import get_peers, simulate
+from transport import InMemoryTransport
+
+
+def test_a_thousand_peers_join_and_elect_with_linear_messages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    n_peers = 1000
+    transport = InMemoryTransport()
+    calls = Counter()
+    deliver = transport.deliver
+
+    def counted(uri, method, args, source=None):
+        calls[method] += 1
+        return deliver(uri, method, args, source)
+    transport.deliver = counted
+    peers = get_peers(n_peers, transport)
+
+    stats = asyncio.run(simulate(peers, 0.5, 64))
+
+    assert len([peer for peer in peers if peer.trader]) == len(peers)
+    assert len({tuple(peer.trader) for peer in peers}) == 1 and len(peers[0].trader) == 2
+    assert all(len(peer.neighbors) == n_peers for peer in peers)
+    # joining sends nothing to the other peers, and every election asks each peer for its bully id once
+    assert calls["add_neighbor"] == 0
+    assert calls["get_election_id"] == 2 * n_peers
+    assert calls["election_message"] < 3 * n_peers
+    assert stats["failed"] == 0
@@ -0,0 +1,95 @@
+import threading
+import time
+from config import TraderConfig
+from faults import FaultInjector
+
+
+def run_together(n_callers, call):
+    barrier = threading.Barrier(n_callers)
+    results = []
+
+    def caller():
+        barrier.wait()
+        try:
+            results.append(call())
+        except Exception as e:
+            results.append(e)
+    threads = [threading.Thread(target=caller) for _ in range(n_callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_misses_share_one_reload(market):
+    trader = market.add("seller1", "trader", trader=TraderConfig(reload_window=0))
+    reloads = []
+
+    def reload():
+        reloads.append(1)
+        time.sleep(0.2)
+        return len(reloads)
+    results = run_together(32, lambda: trader.single_flight("warehouse", reload))
+    assert len(reloads) == 1
+    assert results == [1] * 32
+    assert trader.get_reload_stats() == {"reloads": 1, "shared": 31}
+
+
+def test_finished_reload_is_not_reused_without_window(market):
+    trader = market.add("seller1", "trader", trader=TraderConfig(reload_window=0))
+    reloads = []
+    for _ in range(3):
+        trader.single_flight("warehouse", lambda: reloads.append(1))
+    assert len(reloads) == 3
+
+
+def test_finished_reload_is_reused_within_window(market):
+    trader = market.add("seller1", "trader", trader=TraderConfig(reload_window=0.2))
+    reloads = []
+    trader.single_flight("warehouse", lambda: reloads.append(1))
+    trader.single_flight("warehouse", lambda: reloads.append(1))
+    assert len(reloads) == 1
+    time.sleep(0.25)
+    trader.single_flight("warehouse", lambda: reloads.append(1))
+    assert len(reloads) == 2
+
+
+def test_keys_reload_independently(market):
+    trader = market.add("seller1", "trader", trader=TraderConfig(reload_window=10))
+    assert trader.single_flight("fish", lambda: "fish sellers") == "fish sellers"
+    assert trader.single_flight("salt", lambda: "salt sellers") == "salt sellers"
+    assert trader.get_reload_stats()["reloads"] == 2
+
+
+def test_failed_reload_reaches_every_waiter_and_is_not_reused(market):
+    trader = market.add("seller1", "trader", trader=TraderConfig(reload_window=10))
+
+    def reload():
+        time.sleep(0.2)
+        raise RuntimeError("warehouse unreachable")
+    results = run_together(8, lambda: trader.single_flight("warehouse", reload))
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert trader.single_flight("warehouse", lambda: "reloaded") == "reloaded"
+
+
+def test_concurrent_lookups_that_miss_share_one_reload(market):
+    trader = market.add("seller0", "trader", trader=TraderConfig(split_policy=None, reload_window=0))
+    market.add("server9", "server")
+    market.add("seller1", "seller")
+    buyers = [market.add("buyer" + str(i), "buyer") for i in range(2, 10)]
+    market.connect()
+    market.stock({"seller1": 10})
+    # every reload of the cache takes a while, so the requests arrive while it is in flight
+    injector = FaultInjector()
+    injector.inject({"fault": "delay", "method": "get_warehouse_snapshot", "latency": 0.2})
+    injector.inject({"fault": "delay", "method": "get_warehouse_changes", "latency": 0.2})
+    market.transport.faults = injector
+
+    buyer_infos = iter([buyer.tradingMessage() for buyer in buyers])
+    results = run_together(len(buyers), lambda: trader.trading_lookup(next(buyer_infos), "fish", 5))
+    assert results == [True] * len(buyers)
+    # the trader had not read the warehouse yet, so every request missed while the first one reloaded
+    assert trader.get_reload_stats() == {"reloads": 1, "shared": len(buyers) - 1}
+    # and only two of them were sold the 10 units
+    assert market.peers["server9"].load_warehouse()["seller1"]["product_count"] == 0
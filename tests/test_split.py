@@ -0,0 +1,81 @@
+import pytest
+from config import TraderConfig
+from faults import FaultInjector
+from test_single_flight import run_together
+
+
+@pytest.fixture
+def split_market(market):
+    def build(split_policy):
+        traders, server, sellers, buyers = market.build({"seller1": 3, "seller2": 1, "seller3": 4}, trader_sections={"trader": TraderConfig(split_policy=split_policy)})
+        return traders[0], server, sellers, buyers[0]
+    return build
+
+
+def counts(server):
+    return {peer_id: seller_info["product_count"] for peer_id, seller_info in server.load_warehouse().items()}
+
+
+def test_fewest_sellers_fill_the_order(split_market):
+    trader, server, sellers, buyer = split_market("fewest")
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 5)
+    assert counts(server) == {"seller1": 2, "seller2": 1, "seller3": 0}
+    # every seller of the split is told how many units it sold
+    assert [seller.stock for seller in sellers] == [-1, 0, -4]
+    assert buyer.buy_request_done
+
+
+def test_oldest_stock_fills_the_order_first(split_market):
+    trader, server, sellers, buyer = split_market("oldest")
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 5)
+    assert counts(server) == {"seller1": 0, "seller2": 0, "seller3": 3}
+    assert [seller.stock for seller in sellers] == [-3, -1, -1]
+
+
+@pytest.mark.parametrize("split_policy, item_count", [(None, 5), ("fewest", 9)])
+def test_order_is_rejected_without_a_split(split_market, split_policy, item_count):
+    trader, server, sellers, buyer = split_market(split_policy)
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", item_count)
+    assert counts(server) == {"seller1": 3, "seller2": 1, "seller3": 4}
+    assert [seller.stock for seller in sellers] == [0, 0, 0]
+    # the buyer is told the supply is insufficient
+    assert not buyer.buy_request_done
+
+
+def test_split_with_an_unreachable_seller_is_given_back(market, split_market):
+    trader, server, sellers, buyer = split_market("fewest")
+    injector = FaultInjector()
+    injector.inject({"fault": "drop", "method": "addBuyer", "target": "seller3"})
+    market.transport.faults = injector
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 5)
+    # the warehouse took the parts and got them back, and the buyer is told the supply is insufficient
+    assert counts(server) == {"seller1": 3, "seller2": 1, "seller3": 4}
+    assert [seller.stock for seller in sellers] == [0, 0, 0]
+    assert not buyer.buy_request_done
+    with open("trader_seller0.txt") as f:
+        assert "giving the split up" in f.read()
+    with open("transactions_trader_seller0.json") as f:
+        assert "split" not in f.read()
+
+
+def test_concurrent_splits_on_two_traders_do_not_oversell(market):
+    traders = [market.add(peer_id, "trader") for peer_id in ["seller0", "seller5"]]
+    server = market.add("server9", "server")
+    for peer_id in ["seller1", "seller2"]:
+        market.add(peer_id, "seller")
+    buyers = [market.add(peer_id, "buyer") for peer_id in ["buyer3", "buyer4"]]
+    market.connect()
+    market.stock({"seller1": 3, "seller2": 3})
+    for trader in traders:
+        trader.load_state()
+    # both traders plan their split from the same counts before either of them sells
+    injector = FaultInjector()
+    injector.inject({"fault": "delay", "method": "get_product_view", "latency": 0.2})
+    market.transport.faults = injector
+
+    orders = iter(zip(traders, buyers))
+    results = run_together(2, lambda: (lambda trader, buyer: trader.trading_lookup(buyer.tradingMessage(), "fish", 5))(*next(orders)))
+    assert results == [True, True]
+    assert sum(counts(server).values()) == 1
+    assert min(counts(server).values()) >= 0
+    assert [buyer.buy_request_done for buyer in buyers].count(True) == 1
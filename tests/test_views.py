@@ -0,0 +1,104 @@
+import random
+import pytest
+from config import TraderConfig, WarehouseConfig
+
+
+@pytest.fixture
+def viewed(market):
+    def build(split_policy=None):
+        traders, server, _, buyers = market.build({"seller1": 3, "seller2": 1, "seller3": 4, "seller4": 2}, buyers=("buyer5",), load_state=True, trader_sections={"trader": TraderConfig(split_policy=split_policy)})
+        return traders[0], server, buyers[0]
+    return build
+
+
+def top(server, product="fish"):
+    return [(seller["seller"], seller["product_count"]) for seller in server.get_product_view(product)["top_sellers"]]
+
+
+def reads(market):
+    return [method for _, uri, method in market.calls if uri == "server9" and method.startswith("get_warehouse")]
+
+
+def test_top_sellers_follow_sales_and_restocks(viewed):
+    trader, server, buyer = viewed()
+    assert top(server) == [("seller3", 4), ("seller1", 3), ("seller4", 2)]
+
+    server.update_warehouse("seller3", 3, {"id": "buyer5"}, None)
+    assert top(server) == [("seller1", 3), ("seller4", 2), ("seller2", 1)]
+    assert server.get_product_view("fish")["total_stock"] == 7
+
+    server.register_batch_with_warehouse([{"seller": {"bully_id": 2, "id": "seller2"}, "product_name": "fish", "product_count": 5}])
+    assert top(server) == [("seller2", 6), ("seller1", 3), ("seller4", 2)]
+    assert server.get_product_view("fish")["total_stock"] == 12
+
+
+def test_top_sellers_match_the_stock_after_many_changes(viewed):
+    trader, server, buyer = viewed()
+    rng = random.Random(7)
+    for _ in range(500):
+        seller_peer_id = rng.choice(["seller1", "seller2", "seller3", "seller4"])
+        if rng.random() < 0.5:
+            server.update_warehouse(seller_peer_id, 1, {"id": "buyer5"}, None)
+        else:
+            server.register_batch_with_warehouse([{"seller": {"bully_id": 1, "id": seller_peer_id}, "product_name": "fish", "product_count": rng.randint(1, 3)}])
+        stock = {peer_id: seller_info["product_count"] for peer_id, seller_info in server.load_warehouse().items()}
+        expected = sorted(((peer_id, count) for peer_id, count in stock.items() if count > 0), key=lambda seller: (-seller[1], seller[0]))[:3]
+        assert top(server) == expected
+    # outdated entries are dropped, so the heap stays within a few times the sellers
+    assert len(server.product_heaps["fish"]) <= 2 * 4 + 3
+
+
+def test_orders_the_view_rules_out_are_answered_without_a_reload(market, viewed):
+    trader, server, buyer = viewed()
+    assert reads(market) == ["get_warehouse_snapshot"]
+
+    # no seller has 5 units and the order is not split
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 5)
+    assert not buyer.buy_request_done
+    # no seller registered boar
+    assert trader.trading_lookup(buyer.tradingMessage(), "boar", 1)
+    assert trader.is_unavailable("boar")
+    assert reads(market) == ["get_warehouse_snapshot"]
+
+
+def test_orders_the_view_allows_still_reload(market, viewed):
+    trader, server, buyer = viewed()
+    # registered with the warehouse behind the trader's back, so only a reload finds it
+    market.stock({"seller1": 5})
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 8)
+    assert reads(market) == ["get_warehouse_snapshot", "get_warehouse_changes"]
+    assert buyer.buy_request_done
+    assert server.load_warehouse()["seller1"]["product_count"] == 0
+
+
+def test_split_orders_are_ruled_out_by_the_total_stock(market, viewed):
+    trader, server, buyer = viewed(split_policy="fewest")
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 11)
+    assert reads(market) == ["get_warehouse_snapshot"]
+    assert not buyer.buy_request_done
+
+
+def test_baskets_the_views_rule_out_never_reach_the_warehouse(market, viewed):
+    trader, server, buyer = viewed()
+    assert trader.trading_basket_lookup(buyer.tradingMessage(), [{"product": "fish", "count": 1}, {"product": "fish", "count": 5}])
+    assert "fulfill_basket" not in [method for _, _, method in market.calls]
+
+
+def test_mapped_warehouse_reads_only_the_sellers_a_sale_changes(market, monkeypatch):
+    market.add("seller0", "trader", warehouse=WarehouseConfig(inventory_format="mmap"))
+    server = market.add("server9", "server", warehouse=WarehouseConfig(inventory_format="mmap"))
+    for peer_id in ["seller1", "seller2", "seller3"]:
+        market.add(peer_id, "seller")
+    market.connect()
+    market.stock({"seller1": 3, "seller2": 1, "seller3": 4})
+    version, _ = server.get_warehouse_snapshot()
+
+    reads = []
+    to_dict = server.inventory.to_dict
+    monkeypatch.setattr(server.inventory, "to_dict", lambda seller_ids=None: reads.append(seller_ids) or to_dict(seller_ids))
+    server.update_warehouse("seller3", 3, {"id": "buyer5"}, None)
+    assert reads == [["seller3"]]
+    # the change log and the views still see the sale
+    assert server.get_warehouse_changes(version)[1] == {"seller3": {"seller": {"bully_id": 4, "id": "seller3"}, "product_name": "fish", "product_count": 1}}
+    assert top(server) == [("seller1", 3), ("seller2", 1), ("seller3", 1)]
+    assert server.get_product_view("fish")["total_stock"] == 5
@@ -0,0 +1,11 @@
+from workload import TraceRecorder, load_trace
+
+
+def test_a_new_recorder_starts_the_trace_anew(tmp_path):
+    path = str(tmp_path / "trace_seller1.jsonl")
+    for count in [3, 2]:
+        recorder = TraceRecorder(path, "seller1")
+        recorder.record("register_products", {"id": "seller1"}, count)
+        recorder.close()
+    # only the second run is left to replay
+    assert [record["args"] for record in load_trace(str(tmp_path / "trace_*.jsonl"))] == [[{"id": "seller1"}, 2]]
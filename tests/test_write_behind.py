@@ -0,0 +1,85 @@
+import pytest
+from config import TraderConfig, WarehouseConfig, WriteBehindConfig
+
+
+@pytest.fixture
+def writing_behind(market):
+    def build(counts, split_policy, inventory_format="json"):
+        traders, server, _, buyers = market.build(counts, load_state=True, server_sections={"warehouse": WarehouseConfig(inventory_format=inventory_format)},
+                                                  trader_sections={"trader": TraderConfig(split_policy=split_policy), "write_behind": WriteBehindConfig(60, 100), "warehouse": WarehouseConfig(inventory_format=inventory_format)})
+        return traders[0], server, buyers[0]
+    return build
+
+
+def counts(server):
+    return {peer_id: seller_info["product_count"] for peer_id, seller_info in server.load_warehouse().items()}
+
+
+def test_batch_sent_by_a_takeover_is_applied_once(writing_behind):
+    trader, server, buyer = writing_behind({"seller1": 5}, split_policy=None)
+    for _ in range(2):
+        assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    batch = trader.transaction_information["pending_sales"]
+    # another trader takes over the pending batch while this one keeps selling into it
+    server.update_warehouse_batch(list(batch["sales"].values()), batch["id"])
+    assert counts(server) == {"seller1": 3}
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 1)
+    assert trader.flush_sales()
+    assert counts(server) == {"seller1": 2}
+    assert server.get_buyer_history("seller1")["total"] == 3
+
+
+def test_split_parts_are_written_behind(writing_behind):
+    trader, server, buyer = writing_behind({"seller1": 3, "seller2": 4}, split_policy="fewest")
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 5)
+    assert counts(server) == {"seller1": 3, "seller2": 4}
+    assert {peer_id: sale["count"] for peer_id, sale in trader.transaction_information["pending_sales"]["sales"].items()} == {"seller2": 4, "seller1": 1}
+    assert trader.flush_sales()
+    assert counts(server) == {"seller1": 2, "seller2": 0}
+
+
+def test_mapped_reads_take_off_unflushed_sales(writing_behind):
+    trader, server, buyer = writing_behind({"seller1": 2, "seller2": 5}, inventory_format="mmap", split_policy=None)
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 2)
+    assert counts(server) == {"seller1": 2, "seller2": 5}
+    seller, found = trader.check_seller_in_cache("fish", 1)
+    assert seller["seller"]["id"] == "seller2" and seller["product_count"] == 5
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 5)
+    assert trader.flush_sales()
+    assert counts(server) == {"seller1": 0, "seller2": 0}
+
+
+def test_sales_are_flushed_before_a_basket(writing_behind):
+    trader, server, buyer = writing_behind({"seller1": 2, "seller2": 5}, split_policy=None)
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 2)
+    assert trader.trading_basket_lookup(buyer.tradingMessage(), [{"product": "fish", "count": 2}])
+    assert counts(server) == {"seller1": 0, "seller2": 3}
+    assert "pending_sales" not in trader.transaction_information
+
+
+def test_batch_sent_again_after_many_orders_is_applied_once(market):
+    trader = market.add("seller0", "trader", trader=TraderConfig(split_policy=None, order_log_size=4), write_behind=WriteBehindConfig(60, 100))
+    server = market.add("server9", "server", trader=TraderConfig(order_log_size=4))
+    market.add("seller1", "seller")
+    buyer = market.add("buyer4", "buyer")
+    market.connect()
+    market.stock({"seller1": 5})
+    trader.load_state()
+    assert trader.trading_lookup(buyer.tradingMessage(), "fish", 2)
+    batch = trader.transaction_information["pending_sales"]
+    server.update_warehouse_batch(list(batch["sales"].values()), batch["id"])
+    # hedged orders claimed at the warehouse in the meantime push the batch out of the order log
+    for i in range(10):
+        server.claim_order_with_warehouse("buyer4-1-" + str(i), "seller0")
+    server.update_warehouse_batch(list(batch["sales"].values()), batch["id"])
+    assert counts(server) == {"seller1": 3}
+
+    # and so does a restart of the warehouse
+    restarted = market.add("server9", "server")
+    restarted.update_warehouse_batch(list(batch["sales"].values()), batch["id"])
+    assert counts(restarted) == {"seller1": 3}
+
+    # the batch is forgotten once the trader flushed it and took it out of its log
+    assert trader.flush_sales()
+    assert counts(restarted) == {"seller1": 3}
+    assert restarted.applied_batches == {}
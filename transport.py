@@ -0,0 +1,352 @@
+# transports used by peers to reach the nameserver and each other
+import copy
+import random
+import threading
+import time
+import Pyro5.api
+import Pyro5.core
+import Pyro5.errors
+import Pyro5.server
+import Pyro5.svr_threads
+from Pyro5 import config as pyro_config
+
+# Pyro reads the server type of a new daemon from its process-wide config, daemons are created one at a time
+daemon_sem = threading.BoundedSemaphore(1)
+
+
+class PyroTransport:
+    """
+    The PyroTransport class connects peers over the network with Pyro5.
+    It has the following methods:
+    1. get_nameserver - Locate the Pyro nameserver
+    2. proxy - Create a proxy for a remote peer
+    """
+
+    def __init__(self, hostname):
+        """
+        Construct a new 'PyroTransport' object.
+
+        :param hostname: The hostname of the nameserver
+        :return: returns nothing
+        """
+        self.hostname = hostname
+
+    def get_nameserver(self):
+        """
+        Locate the Pyro nameserver
+        :return: The nameserver proxy
+        """
+        return Pyro5.core.locate_ns(host=self.hostname)
+
+    def proxy(self, uri):
+        """
+        Create a proxy for a remote peer
+        :param uri: The Pyro uri of the peer
+        :return: The peer proxy
+        """
+        return Pyro5.api.Proxy(uri)
+
+
+class WorkerPool(Pyro5.svr_threads.Pool):
+    """
+    The WorkerPool class serves the calls of one thread daemon with its own number of workers,
+    Pyro's pool takes its sizes from the process-wide config.
+    It has the following methods:
+    1. process - Run a call on an idle or new worker
+    2. notify_done - Keep a worker that finished its call idle, or stop it
+    """
+
+    def __init__(self, size):
+        """
+        Construct a new 'WorkerPool' object.
+
+        :param size: The largest number of workers
+        :return: returns nothing
+        """
+        if size < 1:
+            raise ValueError("threadpool sizes must be greater than zero")
+        self.size = size
+        self.min_size = min(pyro_config.THREADPOOL_SIZE_MIN, size)
+        self.idle = set()
+        self.busy = set()
+        self.closed = False
+        for _ in range(self.min_size):
+            worker = Pyro5.svr_threads.Worker(self)
+            self.idle.add(worker)
+            worker.start()
+        self.count_lock = threading.Lock()
+
+    def process(self, job):
+        """
+        Run a call on an idle or new worker
+        :param job: The call
+        :return: nothing
+        """
+        if self.closed:
+            raise Pyro5.svr_threads.PoolError("job queue is closed")
+        if self.idle:
+            worker = self.idle.pop()
+        elif self.num_workers() < self.size:
+            worker = Pyro5.svr_threads.Worker(self)
+            worker.start()
+        else:
+            raise Pyro5.svr_threads.NoFreeWorkersError("no free workers available, increase thread pool size")
+        self.busy.add(worker)
+        worker.process(job)
+
+    def notify_done(self, worker):
+        """
+        Keep a worker that finished its call idle, or stop it
+        :param worker: The worker
+        :return: nothing
+        """
+        self.busy.discard(worker)
+        if self.closed or len(self.idle) >= self.min_size:
+            worker.process(None)
+        else:
+            self.idle.add(worker)
+
+
+def make_daemon(host, server_type=None, rpc_workers=None):
+    """
+    Create a Pyro daemon with its own server type and worker count, leaving the Pyro settings of the process as they are
+    :param host: The hostname the daemon listens on
+    :param server_type: "thread" or "multiplex", None for the Pyro default
+    :param rpc_workers: The number of workers of a thread daemon, None for the Pyro default
+    :return: the daemon
+    """
+    daemon_sem.acquire()
+    default_type = pyro_config.SERVERTYPE
+    try:
+        if server_type is not None:
+            pyro_config.SERVERTYPE = server_type
+        daemon = Pyro5.server.Daemon(host=host)
+    finally:
+        pyro_config.SERVERTYPE = default_type
+        daemon_sem.release()
+    if rpc_workers is not None and isinstance(daemon.transportServer, Pyro5.svr_threads.SocketServer_Threadpool):
+        default_pool = daemon.transportServer.pool
+        daemon.transportServer.pool = WorkerPool(rpc_workers)
+        default_pool.close()
+    return daemon
+
+
+class InMemoryTransport:
+    """
+    The InMemoryTransport class connects peers living in the same process.
+    Calls are dispatched directly to the target peer, with optional injected latency and loss.
+    It has the following methods:
+    1. bind - Make a peer reachable through the transport
+    2. get_nameserver - Get the in-memory nameserver
+    3. proxy - Create a proxy for a peer
+    4. endpoint - Get the view of the transport used by one peer
+    """
+
+    def __init__(self, latency=0.0, loss=0.0, seed=None):
+        """
+        Construct a new 'InMemoryTransport' object.
+
+        :param latency: The delay in seconds added to every call
+        :param loss: The probability of a call being dropped
+        :param seed: The seed for the loss generator
+        :return: returns nothing
+        """
+        self.latency = latency
+        self.loss = loss
+        self.peers = {}
+        self.names = {}
+        self.metadata = {}
+        self.random = random.Random(seed)
+        self.random_sem = threading.BoundedSemaphore(1)
+        # consulted on every call when set, see faults.FaultInjector
+        self.faults = None
+
+    def bind(self, peer):
+        """
+        Make a peer reachable through the transport
+        :param peer: The peer object
+        :return: The uri of the peer
+        """
+        self.peers[peer.id] = peer
+        return peer.id
+
+    def get_nameserver(self):
+        """
+        Get the in-memory nameserver
+        :return: The nameserver
+        """
+        return InMemoryNameServer(self)
+
+    def proxy(self, uri):
+        """
+        Create a proxy for a peer
+        :param uri: The uri of the peer
+        :return: The peer proxy
+        """
+        return InMemoryProxy(self, uri)
+
+    def endpoint(self, peer_id):
+        """
+        Get the view of the transport used by one peer, whose calls are marked with the peer as their sender
+        :param peer_id: The id of the peer
+        :return: The endpoint
+        """
+        return InMemoryEndpoint(self, peer_id)
+
+    def deliver(self, uri, method, args, source=None):
+        """
+        Deliver a call to a peer
+        :param uri: The uri of the peer
+        :param method: The name of the exposed method
+        :param args: The positional arguments of the call
+        :param source: The id of the calling peer, None if unknown
+        :return: The result of the call
+        """
+        if self.faults is not None:
+            self.faults.apply(source, uri, method)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.loss:
+            self.random_sem.acquire()
+            dropped = self.random.random() < self.loss
+            self.random_sem.release()
+            if dropped:
+                raise Pyro5.errors.CommunicationError("message to " + uri + " dropped")
+
+        if uri not in self.peers:
+            raise Pyro5.errors.NamingError("unknown peer " + uri)
+        target = getattr(self.peers[uri], method)
+        if not getattr(target, "_pyroExposed", False):
+            raise AttributeError("method " + method + " is not exposed by " + uri)
+
+        # copy arguments and results as Pyro serialization would, so peers never share state
+        return copy.deepcopy(target(*copy.deepcopy(args)))
+
+
+class InMemoryEndpoint:
+    """
+    The InMemoryEndpoint class is the view of an in-memory transport used by one peer.
+    Calls made through it carry the peer as their sender, so faults can cut off single links.
+    """
+
+    def __init__(self, transport, peer_id):
+        """
+        Construct a new 'InMemoryEndpoint' object.
+
+        :param transport: The in-memory transport
+        :param peer_id: The id of the peer using the endpoint
+        :return: returns nothing
+        """
+        self.transport = transport
+        self.peer_id = peer_id
+
+    def bind(self, peer):
+        """
+        Make a peer reachable through the transport
+        :param peer: The peer object
+        :return: The uri of the peer
+        """
+        return self.transport.bind(peer)
+
+    def get_nameserver(self):
+        """
+        Get the in-memory nameserver
+        :return: The nameserver
+        """
+        return self.transport.get_nameserver()
+
+    def proxy(self, uri):
+        """
+        Create a proxy for a peer, sending calls on behalf of the endpoint's peer
+        :param uri: The uri of the peer
+        :return: The peer proxy
+        """
+        return InMemoryProxy(self.transport, uri, self.peer_id)
+
+
+class InMemoryNameServer:
+    """
+    The InMemoryNameServer class mimics the subset of the Pyro nameserver used by peers.
+    """
+
+    def __init__(self, transport):
+        """
+        Construct a new 'InMemoryNameServer' object.
+
+        :param transport: The in-memory transport
+        :return: returns nothing
+        """
+        self.transport = transport
+
+    def register(self, name, uri, metadata=None):
+        """
+        Register a name
+        :param name: The name to register
+        :param uri: The uri of the peer
+        :param metadata: set of strings the name is tagged with
+        :return: nothing
+        """
+        self.transport.names[name] = uri
+        self.transport.metadata[name] = set(metadata or ())
+
+    def lookup(self, name):
+        """
+        Look up a name
+        :param name: The name to look up
+        :return: The uri of the peer
+        """
+        if name not in self.transport.names:
+            raise Pyro5.errors.NamingError("unknown name: " + name)
+        return self.transport.names[name]
+
+    def list(self, return_metadata=False, metadata_all=None):
+        """
+        List all registered names
+        :param return_metadata: Boolean to indicate whether the metadata of every name is returned with its uri
+        :param metadata_all: set of strings a name must be tagged with all of to be listed, None to list every name
+        :return: The dictionary of names to uris, or to uri and metadata
+        """
+        names = {name: uri for name, uri in self.transport.names.items() if not metadata_all or set(metadata_all) <= self.transport.metadata.get(name, set())}
+        if return_metadata:
+            return {name: (uri, set(self.transport.metadata.get(name, ()))) for name, uri in names.items()}
+        return names
+
+    def _pyroClaimOwnership(self):
+        """
+        Proxies are not bound to threads in memory
+        :return: nothing
+        """
+        pass
+
+
+class InMemoryProxy:
+    """
+    The InMemoryProxy class mimics a Pyro proxy for a peer in the same process.
+    """
+
+    def __init__(self, transport, uri, source=None):
+        """
+        Construct a new 'InMemoryProxy' object.
+
+        :param transport: The in-memory transport
+        :param uri: The uri of the peer
+        :param source: The id of the calling peer, None if unknown
+        :return: returns nothing
+        """
+        self._transport = transport
+        self._uri = uri
+        self._source = source
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args):
+            return self._transport.deliver(self._uri, name, args, self._source)
+        return call
@@ -0,0 +1,70 @@
+# recording of the calls received by a peer, to replay the same workload later
+import glob
+import json
+import time
+from threading import BoundedSemaphore
+
+
+class TraceRecorder:
+    """
+    The TraceRecorder class writes the calls received by a peer to a trace file, one compact JSON line per call.
+    The file is truncated when the recorder is created, so a trace holds the calls of one run only.
+    It has the following methods:
+    1. record - Record a call
+    2. close - Flush and close the trace file
+    """
+
+    def __init__(self, path, peer_id):
+        """
+        Construct a new 'TraceRecorder' object.
+
+        :param path: The path of the trace file
+        :param peer_id: The id of the peer receiving the calls
+        :return: returns nothing
+        """
+        self.path = path
+        self.peer_id = peer_id
+        # line buffered so the trace survives the peer process being killed
+        self.file = open(path, "w", buffering=1)
+        self.sem = BoundedSemaphore(1)
+
+    def record(self, call, *args):
+        """
+        Record a call
+        :param call: The name of the method called
+        :param args: The arguments of the call
+        :return: nothing
+        """
+        line = json.dumps({"t": time.time(), "peer": self.peer_id, "call": call, "args": args}, separators=(",", ":"))
+        self.sem.acquire()
+        try:
+            self.file.write(line + "\n")
+        finally:
+            self.sem.release()
+
+    def close(self):
+        """
+        Flush and close the trace file
+        :return: nothing
+        """
+        self.sem.acquire()
+        try:
+            self.file.close()
+        finally:
+            self.sem.release()
+
+
+def load_trace(pattern):
+    """
+    Load and merge the trace files of all peers
+    :param pattern: glob pattern of the trace files
+    :return: list of recorded calls ordered by time
+    """
+    records = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records